@@ -122,12 +122,41 @@ class GAReward(Reward):
         return size_delta
 
 
+class SizeReward(Reward):
+    def __init__(self):
+        super().__init__(
+            name="size_reward",
+            observation_spaces=["size"],
+            default_value=0,
+            default_negates_returns=False,
+            deterministic=True,
+            platform_dependent=True,
+        )
+
+    def reset(self, benchmark: str, observation_view):
+        """
+        Record information about the initital state
+        """
+        self.prev_size = observation_view["size"]
+
+    def update(self, action, observations, observation_view):
+        """
+        Normalized size reduction in new state compared to previous state.
+        Does not use runtime observations, so it is the reward for sessions in size-only mode
+        (benchmark URI with 'size_only=1'), where runtime is not measured
+        """
+        size = observation_view["size"]
+        size_diff_norm = (self.prev_size - size) / self.prev_size
+        self.prev_size = size
+        return size_diff_norm
+
+
 register(
     id="gcc_multienv-v0",
     entry_point="compiler_gym.service.client_service_compiler_env:ClientServiceCompilerEnv",
     kwargs={
         "service": GCC_MULTIENV_SERVICE_BINARY,
-        "rewards": [SizeRuntimeReward(), GAReward()],
+        "rewards": [SizeRuntimeReward(), GAReward(), SizeReward()],
         "datasets": [MultienvDataset()],
     },
 )
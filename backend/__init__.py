@@ -0,0 +1,83 @@
+from compiler_gym.envs.gcc_multienv.backend.coalescing import (
+    PendingRequest,
+    RequestCoalescer,
+)
+from compiler_gym.envs.gcc_multienv.backend.kernel_pool import (
+    KernelPool,
+    kernel_address,
+    kernel_command,
+    kernel_directory,
+    read_sysctl,
+    request_passes,
+    wait_for_kernel,
+)
+from compiler_gym.envs.gcc_multienv.backend.measurement import (
+    KERNEL_RERUN,
+    RERUN_PREFIX,
+    RuntimeEstimate,
+)
+from compiler_gym.envs.gcc_multienv.backend.remote import (
+    RemoteConnectionPool,
+    RemoteSocket,
+    read_key,
+    recv_frame,
+    send_frame,
+)
+from compiler_gym.envs.gcc_multienv.backend.scheduler import (
+    CpuScheduler,
+    SlotTable,
+    parse_cpu_list,
+)
+from compiler_gym.envs.gcc_multienv.backend.shared_memory import (
+    KERNEL_SHM,
+    SHM_PREFIX,
+    recv_shared,
+    send_shared,
+)
+from compiler_gym.envs.gcc_multienv.backend.staging import (
+    STAGING_MODES,
+    materialize,
+    stage_benchmark,
+    tree_fingerprint,
+)
+from compiler_gym.envs.gcc_multienv.backend.trace import (
+    RecordingSocket,
+    ReplaySocket,
+    TraceMissError,
+    TraceStore,
+)
+
+__all__ = [
+    "CpuScheduler",
+    "KERNEL_RERUN",
+    "KERNEL_SHM",
+    "KernelPool",
+    "PendingRequest",
+    "RERUN_PREFIX",
+    "RecordingSocket",
+    "RemoteConnectionPool",
+    "RemoteSocket",
+    "ReplaySocket",
+    "RequestCoalescer",
+    "RuntimeEstimate",
+    "SHM_PREFIX",
+    "STAGING_MODES",
+    "SlotTable",
+    "TraceMissError",
+    "TraceStore",
+    "kernel_address",
+    "kernel_command",
+    "kernel_directory",
+    "materialize",
+    "parse_cpu_list",
+    "read_key",
+    "read_sysctl",
+    "recv_frame",
+    "recv_shared",
+    "request_passes",
+    "send_frame",
+    "send_shared",
+    "stage_benchmark",
+    "tree_fingerprint",
+    "wait_for_kernel",
+]
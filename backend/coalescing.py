@@ -0,0 +1,60 @@
+"""
+Coalescing of identical requests of sessions of a service process.
+Sessions of a benchmark function that ask for the state of the same pass list at the same time
+(e.g. parallel workers of a genetic algorithm, or new sessions asking for the baseline) share
+one kernel round trip: the first one evaluates the request, and the others wait for its state.
+
+Building the pipelines of several functions of a benchmark into one binary would coalesce requests
+of sibling functions too, but that needs support of the GCC kernel
+"""
+
+import threading
+
+
+class PendingRequest:
+    """
+    Request being evaluated by another session
+    """
+
+    __slots__ = ("done", "state")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.state = None
+
+    def wait(self):
+        """
+        Returns the state evaluated for the request, or None if its evaluation failed
+        """
+        self.done.wait()
+        return self.state
+
+
+class RequestCoalescer:
+    """
+    Requests that sessions of this process are evaluating, by key. `lead(key)` returns None if no session
+    is evaluating `key`; the caller evaluates it then and must call `finish(key, state)` (with None
+    if the evaluation failed). Otherwise it returns the PendingRequest of the session that is.
+    Sessions evaluate their requests synchronously, so a pending request is always finished
+    by another thread.
+    """
+
+    def __init__(self):
+        self._pending = {}
+        self._lock = threading.Lock()
+        self.coalesced = 0
+
+    def lead(self, key):
+        with self._lock:
+            pending = self._pending.get(key)
+            if pending is None:
+                self._pending[key] = PendingRequest()
+                return None
+            self.coalesced += 1
+            return pending
+
+    def finish(self, key, state):
+        with self._lock:
+            pending = self._pending.pop(key)
+        pending.state = state
+        pending.done.set()
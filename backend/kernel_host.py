@@ -0,0 +1,378 @@
+"""
+Kernel host daemon: starts benchmark kernels on request of remote sessions and relays their datagrams
+over TCP (see remote.py for the framing).
+
+    python -m compiler_gym.envs.gcc_multienv.backend.kernel_host --key-file KEY --bench-root DIR --port 7700
+
+Sessions must prove they know the key in '--key-file' (the same file is given to sessions with
+'kernel_host_key'). Kernels are always started from '--kernel-bin', with the command line built by the host
+out of a fixed set of kernel parameters, and only for benchmarks under one of the '--bench-root' directories.
+Build and run strings of benchmarks are still executed by the kernel, so the key must only be given to
+trusted clients. The daemon listens on localhost unless '--host' says otherwise.
+
+Benchmark paths sent by sessions must exist on the kernel host (e.g. on a shared filesystem),
+'--path-map FROM=TO' rewrites path prefixes that differ between hosts.
+"""
+
+import argparse
+import errno
+import hmac
+import json
+import logging
+import os
+import select
+import socket
+import socketserver
+import threading
+from collections import deque
+from pathlib import Path
+
+from compiler_gym.envs.gcc_multienv.backend.kernel_pool import (
+    KernelPool,
+    kernel_command,
+    request_passes,
+)
+from compiler_gym.envs.gcc_multienv.backend.remote import (
+    challenge_response,
+    read_key,
+    recv_frame,
+    send_frame,
+)
+from compiler_gym.envs.gcc_multienv.backend.staging import STAGING_MODES
+
+# How often relay threads check whether their session detached and whether the kernel is alive
+RELAY_POLL_SEC = 0.2
+
+# How many times a kernel is restarted for the same unanswered request before the session gets an error
+RESTART_LIMIT = 3
+
+# Kernel parameters sessions may set (see kernel_pool.kernel_command), and whether they are lists of strings
+ALLOWED_PARAMS = {
+    "embedding_length": False,
+    "build_string": False,
+    "run_strings": True,
+    "plugin_path": False,
+    "repeats": False,
+}
+
+
+def _check_string(name, value):
+    if not isinstance(value, str) or "\0" in value:
+        raise ValueError(f"Invalid {name}")
+
+
+def _check_name(name, value):
+    """
+    Kernel and function names become socket names and parts of kernel directory paths
+    """
+    _check_string(name, value)
+    if value == "" or "/" in value or ".." in value:
+        raise ValueError(f"Invalid {name} {value!r}")
+
+
+def _check_params(params):
+    if not isinstance(params, dict):
+        raise ValueError("Invalid kernel parameters")
+    for name, value in params.items():
+        if name not in ALLOWED_PARAMS:
+            raise ValueError(f"Kernel parameter {name!r} is not allowed")
+        for item in value if ALLOWED_PARAMS[name] else [value]:
+            _check_string(name, item)
+    for name in ("embedding_length", "repeats"):
+        if name in params and not params[name].isdigit():
+            raise ValueError(f"Invalid {name} {params[name]!r}")
+
+
+class _Attachment:
+    """
+    Kernel socket of one remote session, bound to the function socket name the kernel expects.
+    Datagrams sent to the kernel are kept until they are answered, and sent again if the kernel dies
+    (at most RESTART_LIMIT times without an answer, then they are dropped and RuntimeError is raised)
+    """
+
+    def __init__(self, server, request):
+        self.server = server
+        self.kernel_name = request["kernel_name"]
+        self.fun_name = request["fun_name"]
+        _check_name("kernel name", self.kernel_name)
+        _check_name("function name", self.fun_name)
+        self.params = request["params"]
+        _check_params(self.params)
+        self.bench_path = server.bench_path(request["bench_path"])
+        mode, copy_patterns = request["staging"]
+        if mode not in STAGING_MODES:
+            raise ValueError(f"Unknown staging mode {mode!r}")
+        for pattern in copy_patterns:
+            _check_string("staging copy pattern", pattern)
+        self.staging = (mode, tuple(copy_patterns))
+        instance = request["instance"]
+        if instance is not None and (type(instance) is not int or instance < 0):
+            raise ValueError(f"Invalid kernel instance {instance!r}")
+
+        self.pending = deque()
+        self.restarts = 0
+        self.lock = threading.Lock()
+        self.handle = None
+        self.soc = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM, 0)
+        try:
+            slot = 0
+            while True:
+                try:
+                    self.soc.bind(f"\0{self.kernel_name}:{self.fun_name}_{slot}")
+                    break
+                except OSError as e:
+                    if e.errno != errno.EADDRINUSE:
+                        raise
+                    slot += 1
+            self.instance = instance if instance is not None else slot
+            self.acquire()
+        except BaseException:
+            self.soc.close()
+            raise
+
+    def acquire(self):
+        self.handle = self.server.kernel_pool.acquire(
+            self.soc,
+            self.kernel_name,
+            self.instance,
+            self.bench_path,
+            kernel_command(
+                self.server.kernel_bin, self.kernel_name, self.params, self.instance
+            ),
+            self.staging,
+        )
+
+    def readable(self):
+        return select.select([self.soc], [], [], 0)[0] != []
+
+    def send(self, msg):
+        with self.lock:
+            self.pending.append(bytes(msg))
+            try:
+                self.soc.send(msg)
+                return
+            except OSError as e:
+                if e.errno not in (errno.ECONNREFUSED, errno.ENOTCONN):
+                    raise
+            # Responses the kernel sent before it died are relayed first (see check)
+            if not self.readable():
+                self.restart()
+
+    def answered(self):
+        with self.lock:
+            self.restarts = 0
+            if self.pending:
+                self.pending.popleft()
+
+    def check(self):
+        """
+        Restart the kernel if it died with requests pending.
+        Called when no responses are queued on the socket
+        """
+        with self.lock:
+            if self.pending and not self.handle[0].alive() and not self.readable():
+                self.restart()
+
+    def restart(self):
+        address = self.handle[0].address[1:]
+        if self.restarts >= RESTART_LIMIT:
+            failed = request_passes(self.pending[0]) if self.pending else None
+            self.pending.clear()
+            self.restarts = 0
+            raise RuntimeError(
+                f"Benchmark kernel {address} died {RESTART_LIMIT + 1} times on request {failed}"
+            )
+        self.restarts += 1
+        logging.warning("Benchmark kernel %s is dead, restarting it", address)
+        self.server.kernel_pool.wait_exit(self.handle)
+        self.server.kernel_pool.release(self.handle)
+        self.handle = None
+        self.acquire()
+        for msg in self.pending:
+            self.soc.send(msg)
+
+    def close(self):
+        if self.handle is not None:
+            self.server.kernel_pool.release(self.handle)
+            self.handle = None
+        self.soc.close()
+
+
+class _SessionHandler(socketserver.BaseRequestHandler):
+    """
+    One TCP connection, attached to one session at a time
+    """
+
+    def setup(self):
+        self.request.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.send_lock = threading.Lock()
+        self.attachment = None
+        self.relay = None
+        self.detached = threading.Event()
+
+    def send_frame(self, kind, payload=b""):
+        with self.send_lock:
+            send_frame(self.request, kind, payload)
+
+    def authenticate(self):
+        challenge = os.urandom(32)
+        self.send_frame(b"C", challenge)
+        kind, payload = recv_frame(self.request, limit=1024)
+        expected = challenge_response(self.server.key, challenge)
+        if kind != b"H" or not hmac.compare_digest(bytes(payload), expected):
+            logging.warning(
+                "Rejected unauthenticated client %s:%d", *self.client_address[:2]
+            )
+            return False
+        return True
+
+    def handle(self):
+        try:
+            if not self.authenticate():
+                return
+            while True:
+                kind, payload = recv_frame(self.request)
+                if kind == b"D" and self.attachment is not None:
+                    try:
+                        self.attachment.send(payload)
+                    except RuntimeError as e:
+                        logging.error("%s", e)
+                        self.send_frame(b"E", str(e).encode("utf-8"))
+                elif kind == b"A":
+                    self.detach()
+                    try:
+                        self.attach(json.loads(bytes(payload)))
+                    except Exception as e:
+                        logging.exception("Failed to attach session")
+                        self.send_frame(b"E", str(e).encode("utf-8"))
+                elif kind == b"R":
+                    self.detach()
+        except (ConnectionError, OSError):
+            pass
+        finally:
+            self.detach()
+
+    def attach(self, request):
+        self.attachment = _Attachment(self.server, request)
+        self.detached.clear()
+        self.relay = threading.Thread(
+            target=self.relay_responses, args=(self.attachment,), daemon=True
+        )
+        self.relay.start()
+        self.send_frame(
+            b"O", json.dumps({"instance": self.attachment.instance}).encode("utf-8")
+        )
+
+    def detach(self):
+        if self.attachment is None:
+            return
+        self.detached.set()
+        self.relay.join()
+        self.attachment.close()
+        self.attachment = None
+        self.relay = None
+
+    def relay_responses(self, attachment):
+        buffer = bytearray(1 << 20)
+        attachment.soc.settimeout(RELAY_POLL_SEC)
+        while not self.detached.is_set():
+            try:
+                nbytes = attachment.soc.recv_into(buffer)
+            except socket.timeout:
+                try:
+                    attachment.check()
+                except RuntimeError as e:
+                    # Kernel keeps dying, the session gets an error instead of waiting
+                    logging.error("%s", e)
+                    try:
+                        self.send_frame(b"E", str(e).encode("utf-8"))
+                    except OSError:
+                        return
+                except Exception:
+                    logging.exception("Failed to restart benchmark kernel")
+                    # Session gets an error instead of waiting
+                    self.request.shutdown(socket.SHUT_RDWR)
+                    return
+                continue
+            except OSError:
+                return
+            if nbytes != 0:
+                attachment.answered()
+            try:
+                self.send_frame(b"D", bytes(buffer[:nbytes]))
+            except OSError:
+                return
+
+
+class KernelHostServer(socketserver.ThreadingTCPServer):
+    """
+    TCP server relaying remote sessions to kernels of this host.
+    Sessions are authenticated with `key`, kernels are started from `kernel_bin` and only for benchmarks
+    under `bench_roots`
+    """
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(
+        self, address, key, kernel_bin, bench_roots, kernel_pool=None, path_map=()
+    ):
+        super().__init__(address, _SessionHandler)
+        self.key = key
+        self.kernel_bin = str(kernel_bin)
+        self.bench_roots = [Path(root).resolve() for root in bench_roots]
+        self.kernel_pool = kernel_pool if kernel_pool is not None else KernelPool()
+        self.path_map = list(path_map)
+
+    def map_path(self, path):
+        for source, target in self.path_map:
+            if path.startswith(source):
+                return target + path[len(source) :]
+        return path
+
+    def bench_path(self, path):
+        """
+        Benchmark directory of this host for benchmark path sent by a session
+        """
+        _check_string("benchmark path", path)
+        resolved = Path(self.map_path(path)).resolve()
+        if not any(resolved.is_relative_to(root) for root in self.bench_roots):
+            raise ValueError(
+                f"Benchmark {path} is not under a benchmark root of the host"
+            )
+        if not resolved.is_dir():
+            raise ValueError(f"Benchmark {path} does not exist on the host")
+        return resolved
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=7700)
+    parser.add_argument("--key-file", required=True)
+    parser.add_argument(
+        "--kernel-bin",
+        default=os.path.join(
+            os.path.dirname(os.path.abspath(__file__)), "../kernel/gcc-multienv-kernel"
+        ),
+    )
+    parser.add_argument("--bench-root", action="append", required=True)
+    parser.add_argument("--kernel-idle-timeout", type=float, default=600)
+    parser.add_argument("--path-map", action="append", default=[])
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    server = KernelHostServer(
+        (args.host, args.port),
+        read_key(args.key_file),
+        args.kernel_bin,
+        args.bench_root,
+        KernelPool(args.kernel_idle_timeout),
+        [mapping.split("=", 1) for mapping in args.path_map],
+    )
+    logging.info("Serving benchmark kernels on %s:%d", args.host, args.port)
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,431 @@
+"""
+Startup, readiness and lifecycle tracking of benchmark kernels.
+Kernels are started in background threads, so sessions can get kernels started
+ahead of time and wait for readiness instead of spinning on the kernel socket.
+Kernels are reference counted by sessions, dead kernels are restarted and idle ones are reaped
+"""
+
+import fcntl
+import logging
+import os
+import signal
+import socket
+import threading
+from pathlib import Path
+from shutil import rmtree
+from subprocess import Popen, TimeoutExpired
+from time import monotonic, sleep
+
+from compiler_gym.envs.gcc_multienv.backend.measurement import RERUN_PREFIX
+from compiler_gym.envs.gcc_multienv.backend.shared_memory import SHM_PREFIX
+from compiler_gym.envs.gcc_multienv.backend.staging import materialize
+
+
+def kernel_address(bench_name, instance):
+    return f"\0{bench_name}:backend_{instance}"
+
+
+def kernel_directory(bench_name, instance):
+    return f"/tmp/{bench_name}:backend_{instance}"
+
+
+def kernel_command(kernel_bin, bench_name, params, instance=None):
+    """
+    Benchmark kernel command line. `params` may have 'embedding_length', 'build_string',
+    'run_strings' (list), 'plugin_path' and 'repeats' strings.
+    """
+    args = [kernel_bin]
+    if "embedding_length" in params:
+        args.append(f"-e {params['embedding_length']}")
+    if "build_string" in params:
+        args.append(f"-b{params['build_string']}")
+    args += [f"-r{run_string}" for run_string in params.get("run_strings", [])]
+    if "plugin_path" in params:
+        args.append(f"-p{params['plugin_path']}")
+    args.append(f"-n{bench_name}")
+    if instance is not None:
+        args.append(f"-i{instance}")
+    if "repeats" in params:
+        args += ["--repeats", params["repeats"]]
+    return args
+
+
+def request_passes(msg):
+    """
+    Readable form of a kernel request: the pass list, or 'baseline' for the baseline request
+    """
+    msg = bytes(msg)
+    if msg.startswith(SHM_PREFIX):
+        msg = msg[len(SHM_PREFIX) :]
+    if msg.startswith(RERUN_PREFIX):
+        msg = msg[len(RERUN_PREFIX) :]
+    if msg == bytes(1):
+        return "baseline"
+    if msg == b"?":
+        return "[]"
+    return str(msg.decode("utf-8", "replace").split("\n")[:-1])
+
+
+def read_sysctl(name, default):
+    """
+    Integer value of kernel parameter `name` (e.g. 'net/unix/max_dgram_qlen'), or `default` if it cannot be read
+    """
+    try:
+        with open(f"/proc/sys/{name}") as f:
+            return int(f.read().split()[0])
+    except (OSError, ValueError, IndexError):
+        return default
+
+
+def wait_for_kernel(address, process=None, timeout=600):
+    """
+    Wait until benchmark kernel binds its socket. The socket is probed with exponential backoff
+    (so waiting sessions do not steal CPU from kernel builds).
+    Raises RuntimeError if kernel `process` exits and TimeoutError if it is not ready in `timeout` seconds.
+    """
+    probe = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM, 0)
+    deadline = monotonic() + timeout
+    delay = 0.001
+    try:
+        while True:
+            try:
+                probe.connect(address)
+                return
+            except ConnectionRefusedError:
+                pass
+            if process is not None and process.poll() is not None:
+                raise RuntimeError(
+                    f"Benchmark kernel {address[1:]} exited with code {process.returncode}"
+                )
+            if monotonic() > deadline:
+                raise TimeoutError(f"Benchmark kernel {address[1:]} is not ready")
+            sleep(delay)
+            delay = min(delay * 2, 0.05)
+    finally:
+        probe.close()
+
+
+def _pid_alive(pid):
+    """
+    Check if process exists and is not a zombie (kernels that died are zombies until the service
+    that started them polls them)
+    """
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    try:
+        with open(f"/proc/{pid}/stat") as f:
+            return f.read().rsplit(")", 1)[1].split()[0] != "Z"
+    except (FileNotFoundError, IndexError):
+        return True
+
+
+def _read_pid(path):
+    try:
+        return int(path.read_text())
+    except (FileNotFoundError, ValueError):
+        return None
+
+
+class _FileLock:
+    """
+    flock() on a file next to the kernel directory.
+    Lock files are never removed, so all processes always lock the same inode
+    """
+
+    def __init__(self, path, operation):
+        self.path = path
+        self.operation = operation
+        self.fd = None
+
+    def __enter__(self):
+        self.fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o666)
+        try:
+            fcntl.flock(self.fd, self.operation)
+        except BaseException:
+            os.close(self.fd)
+            raise
+        return self
+
+    def __exit__(self, *args):
+        os.close(self.fd)
+
+
+class _Kernel:
+    def __init__(self, bench_name, instance):
+        self.address = kernel_address(bench_name, instance)
+        self.directory = Path(kernel_directory(bench_name, instance))
+        self.users_lock = f"{self.directory}.users.lock"
+        self.start_lock = f"{self.directory}.start.lock"
+        self.refs = 0
+        self.idle_since = monotonic()
+        self.reset(owned=False, local=False)
+
+    def reset(self, owned, local):
+        """
+        `owned` kernels are reaped by this process, `local` ones are started by it
+        """
+        self.owned = owned
+        self.local = local
+        self.process = None
+        self.pid = None
+        self.error = None
+        self.ready = threading.Event()
+
+    def alive(self):
+        """
+        Kernel is considered alive while it is starting or its process exists
+        """
+        if self.process is not None:
+            return self.process.poll() is None
+        if self.pid is not None:
+            return _pid_alive(self.pid)
+        if self.local:
+            return self.error is None
+        return _directory_alive(self.directory, self.address)
+
+
+def _directory_alive(directory, address):
+    """
+    Check if kernel directory belongs to a running kernel (or a kernel being started by a running service).
+    Directories without pid files are checked by probing kernel socket.
+    """
+    kernel_pid = _read_pid(directory / ".kernel_pid")
+    if kernel_pid is not None:
+        return _pid_alive(kernel_pid)
+    owner_pid = _read_pid(directory / ".owner")
+    if owner_pid is not None:
+        return _pid_alive(owner_pid)
+    try:
+        wait_for_kernel(address, timeout=0)
+    except TimeoutError:
+        return False
+    return True
+
+
+class KernelPool:
+    """
+    Benchmark kernels used by sessions of this service process.
+
+    Kernel working directory holds pid files of the service that started the kernel ('.owner')
+    and of the kernel itself ('.kernel_pid'). Decisions to start, restart or remove a kernel are made
+    under an exclusive flock on '<directory>.start.lock', so service processes never race on them.
+    Every attached session holds a shared flock on '<directory>.users.lock', and kernels are only
+    reaped when nobody (in any process) holds it. Locks are released by the OS if a process crashes.
+
+    Kernels that are left without sessions for `idle_timeout` seconds are terminated and their
+    directories removed by a background reaper thread. Kernels whose owner process exited are
+    adopted by the next process that attaches to them.
+
+    Kernels started by the pool are pinned to `cpus` (all CPUs if None).
+    """
+
+    def __init__(self, idle_timeout=600):
+        self.idle_timeout = idle_timeout
+        self.cpus = None
+        self._kernels = {}
+        self._lock = threading.Lock()
+        self._reaper = None
+
+    def start(self, bench_name, instance, bench_path, args, staging=("copy", ())):
+        """
+        Make sure kernel is running: start it in background with command line `args` and benchmark files
+        from `bench_path` (materialized according to `staging` (mode, copy patterns)), unless a live kernel
+        already exists. Stale directories left by dead kernels are removed first.
+        """
+        key = (bench_name, instance)
+        while True:
+            with self._lock:
+                kernel = self._kernels.get(key)
+                if kernel is not None and kernel.alive():
+                    return kernel
+                if kernel is None:
+                    kernel = _Kernel(bench_name, instance)
+                    self._kernels[key] = kernel
+            # Threads of this process lock the file through their own descriptors, so they wait for each other too
+            with _FileLock(kernel.start_lock, fcntl.LOCK_EX):
+                with self._lock:
+                    reaped = self._kernels.get(key) is not kernel
+                if reaped:
+                    continue
+                if kernel.alive():
+                    return kernel  # Started by another thread meanwhile
+                if kernel.directory.is_dir():
+                    if self._started_elsewhere(kernel) and _directory_alive(
+                        kernel.directory, kernel.address
+                    ):
+                        kernel.reset(owned=False, local=False)
+                        self._adopt(kernel)
+                        return kernel
+                    logging.info("Removing stale kernel directory %s", kernel.directory)
+                    rmtree(kernel.directory, ignore_errors=True)
+
+                kernel.reset(owned=True, local=True)
+                os.makedirs(kernel.directory)
+                (kernel.directory / ".owner").write_text(str(os.getpid()))
+            break
+        kernel.idle_since = monotonic()
+        with self._lock:
+            self._start_reaper()
+        threading.Thread(
+            target=self._run, args=(kernel, bench_path, args, staging), daemon=True
+        ).start()
+        return kernel
+
+    def _started_elsewhere(self, kernel):
+        """
+        Check if the kernel in the directory was started (or is being started) by another process or pool
+        and not by this pool. Pid files are read every time, as others may have restarted the kernel
+        after the one this pool knows about died
+        """
+        kernel_pid = _read_pid(kernel.directory / ".kernel_pid")
+        if kernel_pid is not None:
+            return kernel_pid != kernel.pid
+        return not kernel.local or _read_pid(kernel.directory / ".owner") != os.getpid()
+
+    def _adopt(self, kernel):
+        """
+        Take ownership of a live kernel started by a service process that no longer exists
+        """
+        kernel.pid = _read_pid(kernel.directory / ".kernel_pid")
+        owner_pid = _read_pid(kernel.directory / ".owner")
+        if kernel.pid is not None and (owner_pid is None or not _pid_alive(owner_pid)):
+            (kernel.directory / ".owner").write_text(str(os.getpid()))
+            kernel.owned = True
+            with self._lock:
+                self._start_reaper()
+
+    def _run(self, kernel, bench_path, args, staging):
+        try:
+            materialize(bench_path, kernel.directory, *staging)
+            kernel.process = Popen(args, cwd=kernel.directory)
+            kernel.pid = kernel.process.pid
+            if self.cpus is not None:
+                os.sched_setaffinity(kernel.pid, self.cpus)
+            (kernel.directory / ".kernel_pid").write_text(str(kernel.pid))
+            wait_for_kernel(kernel.address, kernel.process)
+            logging.info("Benchmark kernel %s is ready", kernel.address[1:])
+        except Exception as e:
+            kernel.error = e
+        finally:
+            kernel.ready.set()
+
+    def acquire(
+        self, soc, bench_name, instance, bench_path, args, staging=("copy", ())
+    ):
+        """
+        Start kernel if needed, register a session using it and connect `soc` to the kernel as soon as it is ready.
+        Returns a handle for `release`.
+        """
+        kernel = self.start(bench_name, instance, bench_path, args, staging)
+        users = _FileLock(kernel.users_lock, fcntl.LOCK_SH).__enter__()
+        with self._lock:
+            kernel.refs += 1
+        try:
+            self.connect(soc, kernel)
+        except BaseException:
+            self.release((kernel, users))
+            raise
+        return kernel, users
+
+    def connect(self, soc, kernel):
+        if kernel.local:
+            kernel.ready.wait()
+            if kernel.error is not None:
+                raise kernel.error
+        else:
+            wait_for_kernel(kernel.address)
+        soc.connect(kernel.address)
+
+    def wait_exit(self, handle, timeout=10):
+        """
+        Wait until the process of a kernel that stopped answering exits. Kernels close their socket before
+        they exit, and a kernel that is still exiting would be taken for alive and reused by `start`.
+        Kernels that do not exit in `timeout` seconds are killed
+        """
+        kernel = handle[0]
+        if kernel.process is not None:
+            try:
+                kernel.process.wait(timeout)
+            except TimeoutExpired:
+                kernel.process.kill()
+                kernel.process.wait()
+            return
+        if kernel.pid is None:
+            return
+        deadline = monotonic() + timeout
+        delay = 0.001
+        killed = False
+        while _pid_alive(kernel.pid):
+            if not killed and monotonic() > deadline:
+                killed = True
+                try:
+                    os.kill(kernel.pid, signal.SIGKILL)
+                except (ProcessLookupError, PermissionError):
+                    return
+            sleep(delay)
+            delay = min(delay * 2, 0.05)
+
+    def release(self, handle):
+        """
+        Unregister a session, the kernel becomes idle when it has no sessions left
+        """
+        kernel, users = handle
+        users.__exit__()
+        with self._lock:
+            kernel.refs -= 1
+            if kernel.refs == 0:
+                kernel.idle_since = monotonic()
+
+    def _start_reaper(self):
+        if self._reaper is None:
+            self._reaper = threading.Thread(target=self._reap_idle, daemon=True)
+            self._reaper.start()
+
+    def _reap_idle(self):
+        while True:
+            sleep(min(self.idle_timeout, 30))
+            with self._lock:
+                idle = [
+                    (key, kernel)
+                    for key, kernel in self._kernels.items()
+                    if kernel.owned
+                    and kernel.refs == 0
+                    and monotonic() - kernel.idle_since > self.idle_timeout
+                ]
+            for key, kernel in idle:
+                self._reap(key, kernel)
+
+    def _reap(self, key, kernel):
+        with self._lock:
+            if self._kernels.get(key) is not kernel or kernel.refs != 0:
+                return
+        with _FileLock(kernel.start_lock, fcntl.LOCK_EX):
+            try:
+                users = _FileLock(kernel.users_lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                users.__enter__()
+            except BlockingIOError:
+                kernel.idle_since = monotonic()  # Used by other processes
+                return
+            try:
+                with self._lock:
+                    if self._kernels.get(key) is not kernel or kernel.refs != 0:
+                        return
+                    # Sessions that come meanwhile start a new kernel once the directory is removed
+                    del self._kernels[key]
+                logging.info("Reaping idle benchmark kernel %s", kernel.address[1:])
+                if kernel.process is not None:
+                    kernel.process.terminate()
+                    try:
+                        kernel.process.wait(5)
+                    except TimeoutExpired:
+                        kernel.process.kill()
+                        kernel.process.wait()
+                elif kernel.pid is not None and _pid_alive(kernel.pid):
+                    os.kill(kernel.pid, signal.SIGTERM)
+                rmtree(kernel.directory, ignore_errors=True)
+            finally:
+                users.__exit__()
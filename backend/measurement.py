@@ -0,0 +1,92 @@
+"""
+Sequential runtime estimation: benchmark runs are repeated only until
+the confidence interval of the mean runtime is narrow enough
+"""
+
+import math
+
+# Kernels set feature bits in an int32 after the build and run seconds of their responses
+# (KERNEL_SHM of backend.shared_memory is another one)
+KERNEL_RERUN = 1
+
+# Request prefix asking the kernel to run the binary built for the pass list again
+# (building it only if it is not the last one built for the session). Kernels without
+# KERNEL_RERUN feature would take it as part of the pass list
+RERUN_PREFIX = b"!"
+
+# Two-sided 95% Student t quantiles for 1..30 degrees of freedom
+_T95 = [
+    12.706,
+    4.303,
+    3.182,
+    2.776,
+    2.571,
+    2.447,
+    2.365,
+    2.306,
+    2.262,
+    2.228,
+    2.201,
+    2.179,
+    2.160,
+    2.145,
+    2.131,
+    2.120,
+    2.110,
+    2.101,
+    2.093,
+    2.086,
+    2.080,
+    2.074,
+    2.069,
+    2.064,
+    2.060,
+    2.056,
+    2.052,
+    2.048,
+    2.045,
+    2.042,
+]
+
+
+class RuntimeEstimate:
+    """
+    Running mean and variance (Welford) of runtime samples reported by the kernel
+    """
+
+    def __init__(self):
+        self.n = 0
+        self.mean = 0.0
+        self.mean_percent = 0.0
+        self._m2 = 0.0
+
+    def add(self, runtime_sec, runtime_percent):
+        self.n += 1
+        delta = runtime_sec - self.mean
+        self.mean += delta / self.n
+        self._m2 += delta * (runtime_sec - self.mean)
+        self.mean_percent += (runtime_percent - self.mean_percent) / self.n
+
+    @property
+    def variance(self):
+        """
+        Sample variance of runtime_sec (NaN with less than two samples)
+        """
+        if self.n < 2:
+            return math.nan
+        return self._m2 / (self.n - 1)
+
+    def half_width(self):
+        """
+        Half-width of 95% confidence interval of the mean
+        """
+        if self.n < 2:
+            return math.inf
+        t = _T95[self.n - 2] if self.n - 1 <= len(_T95) else 1.96
+        return t * math.sqrt(self.variance / self.n)
+
+    def converged(self, tolerance):
+        """
+        True if the confidence interval half-width is within `tolerance` of the mean
+        """
+        return self.half_width() <= tolerance * abs(self.mean)
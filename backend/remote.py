@@ -0,0 +1,212 @@
+"""
+Remote benchmark kernels.
+Sessions reach kernels on other hosts through a kernel host daemon (see kernel_host.py) over TCP.
+Kernel datagrams are carried in length-prefixed frames, and TCP connections are pooled by the service
+process, so attaching a session to a remote kernel does not need a new connection.
+
+Connections are authenticated with a key shared by the kernel host and the service: the host sends
+a random challenge, and the session must answer with its HMAC-SHA256 under the key before anything else.
+
+Frame is a 4 byte big-endian length of the rest, a type byte and the payload. Types are:
+    C   challenge (host -> session): random bytes, the first frame of every connection
+    H   challenge response (session -> host): HMAC-SHA256 of the challenge under the key
+    A   attach (session -> host): JSON with kernel name, function socket name, benchmark path,
+        staging and kernel parameters (see kernel_pool.kernel_command), and optionally the kernel instance to use
+    O   attached (host -> session): JSON with the kernel instance
+    E   error (host -> session): message, in reply to attach or when the kernel keeps dying on a request
+    D   datagram to or from the kernel
+    R   release (session -> host): detach from the kernel, the connection may be attached again
+"""
+
+import hashlib
+import hmac
+import json
+import select
+import socket
+import struct
+import threading
+
+HEADER = struct.Struct(">I")
+
+
+def read_key(path):
+    """
+    Read kernel host key from file (surrounding whitespace is ignored)
+    """
+    with open(path, "rb") as f:
+        key = f.read().strip()
+    if key == b"":
+        raise ValueError(f"Kernel host key file {path} is empty")
+    return key
+
+
+def challenge_response(key, challenge):
+    return hmac.new(key, bytes(challenge), hashlib.sha256).digest()
+
+
+def send_frame(soc, kind, payload=b""):
+    soc.sendall(HEADER.pack(len(payload) + 1) + kind + payload)
+
+
+def _recv_exactly(soc, view):
+    while len(view) > 0:
+        nbytes = soc.recv_into(view)
+        if nbytes == 0:
+            raise ConnectionError("Connection closed")
+        view = view[nbytes:]
+
+
+def recv_frame(soc, buffer=None, limit=None):
+    """
+    Receive a frame. Returns (type, payload), where payload is received into `buffer` (and is a view of it)
+    if it fits there, or is new bytes otherwise. Frames longer than `limit` bytes break the connection
+    """
+    header = bytearray(HEADER.size + 1)
+    _recv_exactly(soc, memoryview(header))
+    length = HEADER.unpack_from(header)[0] - 1
+    if limit is not None and length > limit:
+        raise ConnectionError(f"Frame of {length} bytes is too long")
+    kind = bytes(header[HEADER.size :])
+    if buffer is not None and length <= len(buffer):
+        payload = memoryview(buffer)[:length]
+    else:
+        payload = memoryview(bytearray(length))
+    _recv_exactly(soc, payload)
+    return kind, payload
+
+
+def _alive(soc):
+    """
+    Check that the kernel host has not closed or reset an idle connection. Pending data (responses
+    for the previous user of the connection) is left in place, attaching drops it
+    """
+    try:
+        return soc.recv(1, socket.MSG_PEEK | socket.MSG_DONTWAIT) != b""
+    except BlockingIOError:
+        return True
+    except OSError:
+        return False
+
+
+class RemoteConnectionPool:
+    """
+    Idle (authenticated) TCP connections to kernel hosts, reused by sessions of this process.
+    Connections the host has closed (e.g. it was restarted) are dropped instead of reused
+    """
+
+    def __init__(self):
+        self._idle = {}
+        self._lock = threading.Lock()
+
+    def get(self, address, key, reuse=True):
+        """
+        Idle connection to kernel host at `address`, or a new one if there is none (or `reuse` is False)
+        """
+        while reuse:
+            with self._lock:
+                idle = self._idle.get((address, key))
+                if not idle:
+                    break
+                soc = idle.pop()
+            if _alive(soc):
+                return soc
+            soc.close()
+        soc = socket.create_connection(address)
+        try:
+            soc.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            kind, challenge = recv_frame(soc)
+            if kind != b"C":
+                raise ConnectionError(f"Kernel host {address} did not send a challenge")
+            send_frame(soc, b"H", challenge_response(key, challenge))
+        except BaseException:
+            soc.close()
+            raise
+        return soc
+
+    def put(self, address, key, soc):
+        with self._lock:
+            self._idle.setdefault((address, key), []).append(soc)
+
+
+class RemoteSocket:
+    """
+    Kernel socket of a session attached to a kernel on a kernel host.
+    Has the subset of socket methods sessions use, with datagram semantics
+    """
+
+    def __init__(self, pool, address, key):
+        self.pool = pool
+        self.address = address
+        self.key = key
+        self._soc = None
+
+    def attach(self, kernel_name, fun_name, bench_path, staging, params, instance=None):
+        """
+        Attach to a kernel on the host (it is started there if needed). Returns kernel instance number.
+        If a pooled connection breaks while attaching, it is attempted again with a new connection
+        """
+        request = {
+            "kernel_name": kernel_name,
+            "fun_name": fun_name,
+            "bench_path": str(bench_path),
+            "staging": [staging[0], list(staging[1])],
+            "params": params,
+            "instance": instance,
+        }
+        try:
+            return self._attach(request, reuse=True)
+        except ConnectionError:
+            return self._attach(request, reuse=False)
+
+    def _attach(self, request, reuse):
+        self._soc = self.pool.get(self.address, self.key, reuse)
+        try:
+            send_frame(self._soc, b"A", json.dumps(request).encode("utf-8"))
+            while True:
+                kind, payload = recv_frame(self._soc)
+                if kind == b"O":
+                    return json.loads(bytes(payload))["instance"]
+                if kind == b"E":
+                    raise RuntimeError(
+                        f"Kernel host {self.address} failed to attach: {bytes(payload).decode()}"
+                    )
+                # Datagrams for the previous user of a pooled connection are dropped
+        except BaseException:
+            self._soc.close()
+            self._soc = None
+            raise
+
+    def connect(self, address):
+        pass
+
+    def send(self, msg):
+        send_frame(self._soc, b"D", bytes(msg))
+        return len(msg)
+
+    def recv_into(self, buffer, nbytes=0, flags=0):
+        if flags & socket.MSG_DONTWAIT and not select.select([self._soc], [], [], 0)[0]:
+            raise BlockingIOError()
+        while True:
+            kind, payload = recv_frame(self._soc, buffer)
+            if kind == b"E":
+                raise RuntimeError(bytes(payload).decode("utf-8", "replace"))
+            if kind == b"D":
+                if payload.obj is not buffer:
+                    raise ValueError(
+                        f"Kernel response of {len(payload)} bytes does not fit receive buffer"
+                    )
+                return len(payload)
+
+    def close(self):
+        """
+        Detach from the kernel and return the connection to the pool
+        """
+        if self._soc is None:
+            return
+        soc, self._soc = self._soc, None
+        try:
+            send_frame(soc, b"R")
+        except OSError:
+            soc.close()
+            return
+        self.pool.put(self.address, self.key, soc)
@@ -0,0 +1,229 @@
+"""
+Placement of sessions and kernels: explicit allocation of session instance slots, and CPU affinity
+of kernels so that profiled benchmark runs get dedicated cores.
+"""
+
+import fcntl
+import hashlib
+import json
+import os
+from pathlib import Path
+from time import monotonic, sleep, time
+
+from compiler_gym.envs.gcc_multienv.backend.kernel_pool import _FileLock, _pid_alive
+
+
+def parse_cpu_list(text):
+    """
+    Parse CPU list like '0-3,8,10-11' (as in /sys/devices/system/cpu/online)
+    """
+    cpus = []
+    for part in text.split(","):
+        part = part.strip()
+        if part == "":
+            continue
+        if "-" in part:
+            first, last = part.split("-", 1)
+            cpus += range(int(first), int(last) + 1)
+        else:
+            cpus.append(int(part))
+    return cpus
+
+
+def _update_table(path, change):
+    """
+    Apply `change` to the JSON table (dict) in file `path` under an exclusive flock on '<path>.lock',
+    and write it back. Returns the result of `change`
+    """
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with _FileLock(f"{path}.lock", fcntl.LOCK_EX):
+        try:
+            table = json.loads(path.read_text())
+        except (FileNotFoundError, ValueError):
+            table = {}
+        result = change(table)
+        tmp_path = path.with_suffix(f".{os.getpid()}.tmp")
+        tmp_path.write_text(json.dumps(table))
+        os.replace(tmp_path, path)
+    return result
+
+
+class SlotTable:
+    """
+    Instance slots of session sockets, allocated through a table shared by all service processes.
+    Every key (kernel and function name) has its own JSON file mapping slots to owner pids, read and written
+    under flock. Slots of processes that exited are reused, and the lowest free slot is always taken,
+    so sessions need no probing of socket names that are in use.
+    """
+
+    def __init__(self, directory="/tmp/gcc_multienv_slots"):
+        self.directory = Path(directory)
+
+    def _update(self, key, change):
+        digest = hashlib.blake2b(key.encode("utf-8"), digest_size=16).hexdigest()
+
+        def change_owners(table):
+            owners = {int(slot): pid for slot, pid in table.items()}
+            result = change(owners)
+            table.clear()
+            table.update(owners)
+            return result
+
+        return _update_table(self.directory / f"{digest}.json", change_owners)
+
+    def allocate(self, key, skip=()):
+        """
+        Take the lowest slot that is free (and not in `skip`) for this process
+        """
+
+        def take(owners):
+            for slot, pid in list(owners.items()):
+                if pid != os.getpid() and not _pid_alive(pid):
+                    del owners[slot]
+            slot = 0
+            while slot in owners or slot in skip:
+                slot += 1
+            owners[slot] = os.getpid()
+            return slot
+
+        return self._update(key, take)
+
+    def release(self, key, slot):
+        def give_back(owners):
+            if owners.get(slot) == os.getpid():
+                del owners[slot]
+
+        self._update(key, give_back)
+
+
+class CpuScheduler:
+    """
+    Dedicated cores for profiled benchmark runs.
+
+    `measure_cpus` are split into groups of `cpus_per_run`. A kernel gets a group leased while sessions
+    wait for its runtime measuring requests, and is pinned (sched_setaffinity) to it; the rest of the time
+    kernels are pinned to the remaining `compile_cpus`, so compilation of size-only kernels and idle kernels
+    never competes with measured runs. When all groups are leased, requests queue for the next free one
+    (for at most `wait_sec` seconds).
+
+    Leases are per kernel and kept in a table ('<directory>/leases.json', read and written under flock)
+    shared by all service processes, with the holders (sessions, named '<pid>:<session id>') holding them.
+    The kernel goes back to compile cores when the last holder (of any process) releases it.
+    Holders must renew their leases at least every `lease_sec` seconds (sessions do while they wait
+    for responses). Holders that exited or stopped renewing are dropped, including other sessions of
+    the same process, so sessions that submit requests and never collect them do not keep the cores.
+    """
+
+    def __init__(
+        self,
+        measure_cpus,
+        cpus_per_run=1,
+        lease_sec=30,
+        wait_sec=600,
+        directory="/tmp/gcc_multienv_cpus",
+    ):
+        measure_cpus = list(measure_cpus)
+        available = frozenset(os.sched_getaffinity(0))
+        unavailable = sorted(frozenset(measure_cpus) - available)
+        if unavailable:
+            raise ValueError(
+                f"Measurement CPUs {unavailable} are not available to this process (available: {sorted(available)})"
+            )
+        if len(measure_cpus) < cpus_per_run:
+            raise ValueError(
+                f"{len(measure_cpus)} measurement CPUs are not enough for runs on {cpus_per_run} CPUs"
+            )
+        self.groups = [
+            frozenset(measure_cpus[i : i + cpus_per_run])
+            for i in range(0, len(measure_cpus) - cpus_per_run + 1, cpus_per_run)
+        ]
+        self.compile_cpus = available - frozenset(measure_cpus)
+        if not self.compile_cpus:
+            self.compile_cpus = available
+        self.lease_sec = lease_sec
+        self.wait_sec = wait_sec
+        self.path = Path(directory) / "leases.json"
+
+    def pin(self, pid, cpus):
+        try:
+            os.sched_setaffinity(pid, cpus)
+        except ProcessLookupError:
+            pass
+
+    def _drop(self, table, key):
+        self.pin(table[key]["pid"], self.compile_cpus)
+        del table[key]
+
+    def _expire(self, table):
+        """
+        Drop holders that exited or did not renew their leases, and leases left without holders
+        """
+        now = time()
+        for key, lease in list(table.items()):
+            for holder, expires in list(lease["holders"].items()):
+                pid = int(holder.split(":", 1)[0])
+                if expires < now or (pid != os.getpid() and not _pid_alive(pid)):
+                    del lease["holders"][holder]
+            if not lease["holders"]:
+                self._drop(table, key)
+
+    def acquire(self, key, pid, holder):
+        """
+        Lease a core group for kernel `key` with process `pid` to `holder` (waiting until one is free)
+        and pin the kernel to it. Raises TimeoutError if no group gets free in `wait_sec` seconds
+        """
+
+        def take(table):
+            self._expire(table)
+            lease = table.get(key)
+            if lease is None:
+                used = {lease["group"] for lease in table.values()}
+                free = [group for group in range(len(self.groups)) if group not in used]
+                if free == []:
+                    return False
+                lease = table[key] = {"group": free[0], "pid": None, "holders": {}}
+            lease["holders"][holder] = time() + self.lease_sec
+            if lease["pid"] != pid:
+                lease["pid"] = pid
+                self.pin(pid, self.groups[lease["group"]])
+            return True
+
+        deadline = monotonic() + self.wait_sec
+        delay = 0.001
+        while not _update_table(self.path, take):
+            if monotonic() > deadline:
+                raise TimeoutError(
+                    f"No measurement CPUs got free in {self.wait_sec} seconds"
+                )
+            sleep(delay)
+            delay = min(delay * 2, 0.05)
+
+    def renew(self, key, holder):
+        """
+        Extend the lease of kernel `key` held by `holder`. Returns False if the lease was lost
+        """
+
+        def extend(table):
+            lease = table.get(key)
+            if lease is None or holder not in lease["holders"]:
+                return False
+            lease["holders"][holder] = time() + self.lease_sec
+            return True
+
+        return _update_table(self.path, extend)
+
+    def release(self, key, holder):
+        """
+        Drop `holder` from the lease of kernel `key`. When the lease has no holders left,
+        the kernel goes back to compile cores and the group is free
+        """
+
+        def give_back(table):
+            lease = table.get(key)
+            if lease is None or holder not in lease["holders"]:
+                return
+            del lease["holders"][holder]
+            if not lease["holders"]:
+                self._drop(table, key)
+
+        _update_table(self.path, give_back)
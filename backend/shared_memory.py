@@ -0,0 +1,75 @@
+"""
+Shared memory transport of kernel responses.
+Kernels that advertise KERNEL_SHM feature (see backend.measurement) answer requests prefixed with SHM_PREFIX
+by writing the response into a memfd and sending only a small descriptor datagram (payload length)
+with the memfd attached (SCM_RIGHTS). The service maps the payload read-only, so response size
+is not limited by the datagram size and the payload is not copied through the socket.
+
+Every response gets its own memfd, which is freed when the service unmaps it; unlike a ring buffer
+this needs no flow control between kernel and service, and memfd setup is negligible next to a compilation.
+
+The GCC kernel does not implement the transport (the stub kernel of benchmarks/ does), so its sessions
+keep receiving responses in datagrams. Kernels on other hosts cannot use it
+"""
+
+import array
+import mmap
+import os
+import socket
+import struct
+
+# Feature bit of kernels that implement the transport
+KERNEL_SHM = 2
+
+# Request prefix asking the kernel to send the response through shared memory. It comes before
+# any other prefix (e.g. RERUN_PREFIX), and only kernels with KERNEL_SHM feature get it
+SHM_PREFIX = b"^"
+
+# Descriptor datagram: payload length
+DESCRIPTOR = struct.Struct("Q")
+
+
+def recv_shared(soc, buffer, flags=0):
+    """
+    Receive a datagram into `buffer`. If it carries a memfd, the payload it describes is mapped read-only.
+    Returns (payload length, mmap or None for responses sent inline).
+    """
+    fds = array.array("i")
+    nbytes, ancdata, msg_flags, _ = soc.recvmsg_into(
+        [buffer], socket.CMSG_SPACE(fds.itemsize), flags
+    )
+    for level, kind, data in ancdata:
+        if level == socket.SOL_SOCKET and kind == socket.SCM_RIGHTS:
+            fds.frombytes(data[: len(data) - len(data) % fds.itemsize])
+    if msg_flags & socket.MSG_CTRUNC:
+        for fd in fds:
+            os.close(fd)
+        raise RuntimeError("Kernel sent more than one descriptor with a response")
+    if len(fds) == 0:
+        return nbytes, None
+    try:
+        length = DESCRIPTOR.unpack_from(buffer)[0]
+        mapping = mmap.mmap(fds[0], length, mmap.MAP_SHARED, mmap.PROT_READ)
+    finally:
+        for fd in fds:
+            os.close(fd)
+    return length, mapping
+
+
+def send_shared(soc, payload, address=None):
+    """
+    Kernel side of the transport: write `payload` into a new memfd and send its descriptor
+    """
+    fd = os.memfd_create("gcc-multienv-response", os.MFD_CLOEXEC)
+    try:
+        view = memoryview(payload)
+        while len(view) > 0:
+            view = view[os.write(fd, view) :]
+        message = [DESCRIPTOR.pack(len(payload))]
+        fds = [(socket.SOL_SOCKET, socket.SCM_RIGHTS, array.array("i", [fd]))]
+        if address is None:
+            soc.sendmsg(message, fds)
+        else:
+            soc.sendmsg(message, fds, 0, address)
+    finally:
+        os.close(fd)
@@ -0,0 +1,121 @@
+"""
+Materialization of benchmark kernel working directories.
+Instead of copying the whole benchmark for every kernel instance, benchmark files are copied once
+into a staged tree in /tmp (identified by a fingerprint of benchmark contents), and kernel directories
+are populated with hardlinks or reflinks to it
+"""
+
+import fcntl
+import hashlib
+import logging
+import os
+from fnmatch import fnmatch
+from pathlib import Path
+from shutil import copy2, copystat, copytree, rmtree
+
+STAGE_ROOT = Path("/tmp/gcc_multienv_stage")
+
+FICLONE = 0x40049409
+
+STAGING_MODES = ("copy", "hardlink", "reflink")
+
+
+def tree_fingerprint(path):
+    """
+    Hash of relative paths, sizes and modification times of all files in the tree
+    """
+    digest = hashlib.sha256()
+    for root, dirs, files in os.walk(path):
+        dirs.sort()
+        for name in sorted(files):
+            file = os.path.join(root, name)
+            stat = os.stat(file)
+            digest.update(
+                f"{os.path.relpath(file, path)}\0{stat.st_size}\0{stat.st_mtime_ns}\n".encode(
+                    "utf-8"
+                )
+            )
+    return digest.hexdigest()[:16]
+
+
+def stage_benchmark(bench_path):
+    """
+    Returns staged copy of the benchmark, creating it if needed.
+    Staged trees of older versions of the same benchmark are removed (kernel directories
+    that link to them keep their files).
+    """
+    bench_path = Path(bench_path).resolve()
+    prefix = (
+        bench_path.name
+        + "-"
+        + hashlib.sha256(str(bench_path).encode("utf-8")).hexdigest()[:8]
+    )
+    stage = STAGE_ROOT / f"{prefix}-{tree_fingerprint(bench_path)}"
+    if stage.is_dir():
+        return stage
+
+    STAGE_ROOT.mkdir(parents=True, exist_ok=True)
+    lock_fd = os.open(STAGE_ROOT / f"{prefix}.lock", os.O_RDWR | os.O_CREAT, 0o666)
+    try:
+        fcntl.flock(lock_fd, fcntl.LOCK_EX)
+        if stage.is_dir():
+            return stage
+        logging.info("Staging benchmark %s to %s", bench_path, stage)
+        tmp_stage = STAGE_ROOT / f".{stage.name}.{os.getpid()}"
+        copytree(bench_path, tmp_stage, dirs_exist_ok=True)
+        os.rename(tmp_stage, stage)
+        for old_stage in STAGE_ROOT.glob(f"{prefix}-*"):
+            if old_stage != stage:
+                rmtree(old_stage, ignore_errors=True)
+    finally:
+        os.close(lock_fd)
+    return stage
+
+
+def _reflink(src, dst):
+    with open(src, "rb") as src_file, open(dst, "wb") as dst_file:
+        fcntl.ioctl(dst_file.fileno(), FICLONE, src_file.fileno())
+    copystat(src, dst)
+
+
+def _link_function(mode, copy_patterns):
+    def link(src, dst):
+        if os.path.lexists(dst):
+            os.unlink(dst)  # Never write through an existing link into the staged tree
+        if any(fnmatch(os.path.basename(src), pattern) for pattern in copy_patterns):
+            return copy2(src, dst)
+        try:
+            if mode == "hardlink":
+                os.link(src, dst)
+            else:
+                _reflink(src, dst)
+        except OSError:
+            if os.path.lexists(dst):
+                os.unlink(dst)
+            return copy2(src, dst)
+        return dst
+
+    return link
+
+
+def materialize(bench_path, directory, mode="copy", copy_patterns=()):
+    """
+    Populate kernel working directory with benchmark files.
+
+    'copy' copies the benchmark as is. 'hardlink' and 'reflink' link files of the staged tree instead,
+    falling back to copying where links are not supported. Hardlinked files are shared between all
+    kernel instances, so files that the benchmark build modifies in place must be listed in
+    `copy_patterns` (globs matched against file names) to get private copies. Reflinks are copy-on-write
+    and safe for any file.
+    """
+    if mode not in STAGING_MODES:
+        raise ValueError(f"Unknown staging mode {mode}")
+    if mode == "copy":
+        copytree(bench_path, directory, dirs_exist_ok=True)
+        return
+    copytree(
+        stage_benchmark(bench_path),
+        directory,
+        dirs_exist_ok=True,
+        copy_function=_link_function(mode, copy_patterns),
+    )
@@ -0,0 +1,160 @@
+"""
+Record and replay of kernel traces.
+Requests sessions send to benchmark kernels and the raw responses they get are recorded into a trace file,
+and replayed later without starting kernels, so collected data serves as a simulator for offline training
+"""
+
+import logging
+import socket
+from collections import deque
+from time import time
+
+from compiler_gym.envs.gcc_multienv.backend.shared_memory import SHM_PREFIX
+from compiler_gym.envs.gcc_multienv.cache.database import SharedDatabase
+
+
+class TraceMissError(LookupError):
+    """
+    Replayed session sent a request that is not in the trace
+    """
+
+
+def _create_tables(conn):
+    conn.execute("""CREATE TABLE IF NOT EXISTS exchanges (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            bench_name TEXT,
+            fun_name TEXT,
+            context TEXT,
+            request BLOB,
+            response BLOB,
+            time REAL
+        )""")
+    conn.execute(
+        "CREATE INDEX IF NOT EXISTS exchanges_request ON exchanges (context, request)"
+    )
+
+
+class TraceStore:
+    """
+    On-disk (sqlite) trace of kernel exchanges: every row is a request exactly as sent to the kernel
+    (pass list, or bytes(1) for the baseline) and the raw response datagram, with benchmark name, function name
+    and session context (see GccMultienvCompilationSession.trace_context) they belong to.
+    Repeated requests (e.g. runtime samples) are all kept, in the order they were received.
+
+    Stores of all sessions using the same file share one connection (see SharedDatabase)
+    """
+
+    def __init__(self, path, context, bench_name="", fun_name=""):
+        self._db = SharedDatabase.open(path, _create_tables)
+        self.path = self._db.path
+        self.context = "\0".join(context)
+        self.bench_name = bench_name
+        self.fun_name = fun_name
+
+    def put(self, request, response):
+        self._db.execute(
+            "INSERT INTO exchanges (bench_name, fun_name, context, request, response, time) VALUES (?, ?, ?, ?, ?, ?)",
+            (
+                self.bench_name,
+                self.fun_name,
+                self.context,
+                bytes(request),
+                bytes(response),
+                time(),
+            ),
+        )
+
+    def responses(self, request):
+        """
+        All recorded responses to `request` in this context, oldest first
+        """
+        rows = self._db.execute(
+            "SELECT response FROM exchanges WHERE context = ? AND request = ? ORDER BY id",
+            (self.context, bytes(request)),
+        )
+        return [bytes(row[0]) for row in rows]
+
+
+class RecordingSocket:
+    """
+    Kernel socket that records every answered request into a TraceStore.
+    The kernel answers requests in the order they were sent, so responses are matched with
+    sent requests first in, first out (empty probe packets are skipped)
+    """
+
+    def __init__(self, soc, store):
+        self._soc = soc
+        self.store = store
+        self._pending = deque()
+
+    def __getattr__(self, name):
+        return getattr(self._soc, name)
+
+    def connect(self, address):
+        # Requests sent to a previous (dead) kernel are never answered
+        self._pending.clear()
+        self._soc.connect(address)
+
+    def send(self, msg):
+        nbytes = self._soc.send(msg)
+        # Responses are recorded whole whichever way they were sent, so the transport prefix is not recorded
+        msg = bytes(msg)
+        if msg.startswith(SHM_PREFIX):
+            msg = msg[len(SHM_PREFIX) :]
+        self._pending.append(msg)
+        return nbytes
+
+    def recv_into(self, buffer, nbytes=0, flags=0):
+        received = self._soc.recv_into(buffer, nbytes, flags)
+        if received != 0:
+            self.record(memoryview(buffer)[:received])
+        return received
+
+    def record(self, response):
+        """
+        Record `response` as the answer to the oldest pending request
+        (used directly for responses that are not received with `recv_into`)
+        """
+        if self._pending:
+            self.store.put(self._pending.popleft(), response)
+
+
+class ReplaySocket:
+    """
+    Stand-in for the kernel socket that answers requests from a TraceStore instead of a kernel.
+    Repeated requests get the recorded responses in turn (cycling when they run out).
+    Requests that were never recorded raise TraceMissError and are counted in `misses`
+    """
+
+    def __init__(self, store):
+        self.store = store
+        self.misses = 0
+        self._ready = deque()
+        self._served = {}
+
+    def connect(self, address):
+        pass
+
+    def close(self):
+        pass
+
+    def send(self, msg):
+        msg = bytes(msg)
+        responses = self.store.responses(msg)
+        if responses == []:
+            self.misses += 1
+            logging.warning("Request is not in trace %s: %r", self.store.path, msg)
+            raise TraceMissError(f"Request is not in trace {self.store.path}: {msg!r}")
+        served = self._served.get(msg, 0)
+        self._served[msg] = served + 1
+        self._ready.append(responses[served % len(responses)])
+        return len(msg)
+
+    def recv_into(self, buffer, nbytes=0, flags=0):
+        if not self._ready:
+            if flags & socket.MSG_DONTWAIT:
+                raise BlockingIOError()
+            raise TraceMissError("No replayed response is pending")
+        response = self._ready.popleft()
+        memoryview(buffer)[: len(response)] = response
+        return len(response)
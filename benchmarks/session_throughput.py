@@ -0,0 +1,153 @@
+#! /usr/bin/env python3
+"""
+End to end throughput benchmark of GccMultienvCompilationSession against the stub kernel
+(see stub_kernel.py), measuring service side overhead without GCC and real benchmarks.
+
+Sessions are created in this process and stepped round robin with random legal actions
+(from the 'action_mask' observation); every step also requests size, runtime and embedding
+observations. Invalid sequences are restarted with 'another_try'. Reports steps per second,
+step and reset latencies, resident memory per session and mean per-phase step timings.
+
+Run it from the service directory (the shuffler library is loaded relative to it):
+    cd compiler_gym/envs/gcc_multienv/service && python ../benchmarks/session_throughput.py
+"""
+
+import argparse
+import importlib.util
+import os
+import random
+import statistics
+import sys
+import tempfile
+from pathlib import Path
+from time import perf_counter
+
+from compiler_gym.datasets import Benchmark
+from compiler_gym.service.proto import Event
+
+BENCHMARKS_DIR = Path(__file__).resolve().parent
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--sessions", type=int, default=8)
+    parser.add_argument("--steps", type=int, default=2000)
+    parser.add_argument("--build-sec", type=float, default=0.0)
+    parser.add_argument("--run-sec", type=float, default=0.0)
+    parser.add_argument("--graph-len", type=int, default=64)
+    parser.add_argument("--size-only", action="store_true")
+    parser.add_argument(
+        "--uri-params",
+        default="",
+        help="Extra benchmark URI parameters, e.g. 'runtime_tolerance=0.01&'",
+    )
+    parser.add_argument(
+        "--service",
+        default=str(BENCHMARKS_DIR.parent / "service" / "gcc_multienv_service.py"),
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    return parser.parse_args()
+
+
+def load_session_class(path):
+    spec = importlib.util.spec_from_file_location("gcc_multienv_service", path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module.GccMultienvCompilationSession
+
+
+def rss_bytes():
+    with open("/proc/self/statm") as f:
+        return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+
+
+def percentile(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+def report(name, values):
+    if values == []:
+        return
+    print(
+        f"{name:>14}: mean {statistics.mean(values) * 1e3:.3f} ms, "
+        f"p50 {percentile(values, 0.5) * 1e3:.3f} ms, "
+        f"p95 {percentile(values, 0.95) * 1e3:.3f} ms"
+    )
+
+
+def main():
+    args = parse_args()
+    os.environ["STUB_KERNEL_BUILD_SEC"] = str(args.build_sec)
+    os.environ["STUB_KERNEL_RUN_SEC"] = str(args.run_sec)
+    os.environ["STUB_KERNEL_GRAPH_LEN"] = str(args.graph_len)
+
+    session_class = load_session_class(args.service)
+    from compiler_gym.envs.gcc_multienv.metrics import PHASES
+
+    spaces = {space.name: space for space in session_class.observation_spaces}
+    action_space = session_class.action_spaces[0]
+    rng = random.Random(args.seed)
+
+    with tempfile.TemporaryDirectory() as work:
+        bench_dir = Path(work) / "bench"
+        bench_dir.mkdir()
+        (bench_dir / "main.c").write_text("int main() { return 0; }\n")
+        uri = (
+            "multienv"
+            + str(bench_dir)
+            + "/?"
+            + ("" if args.size_only else "run_string=./a.out&")
+            + ("size_only=1&" if args.size_only else "")
+            + args.uri_params
+            + f"kernel_bin={BENCHMARKS_DIR / 'stub_kernel.py'}&"
+            + f"bench_name=stub-{os.getpid()}&"
+        )
+
+        sessions = []
+        reset_latencies = []
+        rss_before = rss_bytes()
+        for i in range(args.sessions):
+            benchmark = Benchmark.from_file_contents(uri + f"fun_name=fun{i}", None)
+            start = perf_counter()
+            sessions.append(session_class(Path(work), action_space, benchmark))
+            reset_latencies.append(perf_counter() - start)
+        memory_per_session = (rss_bytes() - rss_before) / max(1, args.sessions)
+
+        step_latencies = []
+        retry_latencies = []
+        phase_totals = [0.0] * len(PHASES)
+        start = perf_counter()
+        for step in range(args.steps):
+            session = sessions[step % len(sessions)]
+            mask = session.get_observation(spaces["action_mask"]).int64_tensor.value
+            legal = [i for i, flag in enumerate(mask) if flag]
+            step_start = perf_counter()
+            end_of_session = session.apply_action(Event(int64_value=rng.choice(legal)))[
+                2
+            ]
+            for name in ("size", "runtime_sec", "embedding"):
+                session.get_observation(spaces[name])
+            step_latencies.append(perf_counter() - step_start)
+            timings = session.get_observation(spaces["timings"]).double_tensor.value
+            phase_totals = [a + b for a, b in zip(phase_totals, timings)]
+            if end_of_session:
+                retry_start = perf_counter()
+                session.apply_action(Event(string_value="another_try"))
+                retry_latencies.append(perf_counter() - retry_start)
+        elapsed = perf_counter() - start
+
+        print(f"{args.steps} steps of {args.sessions} sessions in {elapsed:.3f} s")
+        print(f"{'steps/sec':>14}: {args.steps / elapsed:.1f}")
+        report("step", step_latencies)
+        report("session start", reset_latencies)
+        report("another_try", retry_latencies)
+        print(f"{'memory':>14}: {memory_per_session / 1024:.1f} KiB per session")
+        for name, total in zip(PHASES, phase_totals):
+            print(f"{name:>14}: {total / max(1, args.steps) * 1e3:.3f} ms per step")
+
+        del sessions
+
+
+if __name__ == "__main__":
+    sys.exit(main())
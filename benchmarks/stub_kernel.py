@@ -0,0 +1,171 @@
+#! /usr/bin/env python3
+"""
+Stub benchmark kernel speaking the gcc-multienv-kernel datagram protocol, without GCC or a benchmark.
+Used by the throughput benchmarks to measure service side overhead.
+
+The kernel binds '\\0<name>:backend_<instance>' and answers every request (bytes(1) for the baseline,
+'?' for the empty pass list or newline separated passes) with an int32 embedding length in bytes,
+the embedding (47 autophase values, cfg length, cfg and value flow graph data), the 'ddi' profiling
+trailer (runtime_percent, runtime_sec, size), build and run seconds ('dd') and the feature bits ('i').
+Requests prefixed with '!' run the binary built for the pass list again, building it only if it is not
+the last one built for the session (KERNEL_RERUN feature, see backend.measurement).
+Responses to requests prefixed with '^' of at least STUB_KERNEL_SHM_MIN bytes (0 by default) are sent
+through shared memory (KERNEL_SHM feature, see backend.shared_memory).
+Responses are deterministic functions of the pass list. Sessions are probed with empty packets
+and the kernel exits when it has had no sessions for STUB_KERNEL_IDLE_SEC.
+
+Behaviour is configured with environment variables:
+    STUB_KERNEL_BUILD_SEC   time spent "compiling" each request (0 by default)
+    STUB_KERNEL_RUN_SEC     time spent "running" the benchmark, if there are run strings (0 by default)
+    STUB_KERNEL_GRAPH_LEN   number of ints in each of the cfg and value flow graphs (64 by default)
+    STUB_KERNEL_IDLE_SEC    lifetime without sessions (10 by default)
+    STUB_KERNEL_SHM_MIN     smallest response sent through shared memory
+    STUB_KERNEL_FEATURES    feature bits the kernel implements and advertises (all of them by default,
+                            0 behaves like the GCC kernel)
+    STUB_KERNEL_CRASH_ON    pass on which the kernel exits without answering (none by default)
+"""
+
+import argparse
+import errno
+import hashlib
+import os
+import random
+import socket
+import struct
+from time import monotonic, sleep
+
+AUTOPHASE_LEN = 47
+KERNEL_RERUN = 1
+KERNEL_SHM = 2
+PROBE_INTERVAL = 1.0
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("-e", dest="embedding_length", type=int, default=None)
+    parser.add_argument("-b", dest="build_string", default=None)
+    parser.add_argument("-r", dest="run_strings", action="append", default=[])
+    parser.add_argument("-p", dest="plugin_path", default=None)
+    parser.add_argument("-n", dest="name", required=True)
+    parser.add_argument("-i", dest="instance", type=int, default=0)
+    parser.add_argument("--repeats", type=int, default=1)
+    return parser.parse_args()
+
+
+def graph(rng, length):
+    """
+    Random edge list (pairs of node indices) of `length` ints
+    """
+    nodes = max(2, length // 4)
+    edges = []
+    for _ in range(length // 2):
+        edges += [rng.randrange(nodes), rng.randrange(nodes)]
+    return edges
+
+
+def response(request, measure_runtime, build_sec, run_sec, graph_len, features):
+    seed = hashlib.blake2b(request, digest_size=8).digest()
+    rng = random.Random(seed)
+    cfg = graph(rng, graph_len)
+    val_flow = graph(rng, graph_len)
+    embedding = (
+        [rng.randrange(100) for _ in range(AUTOPHASE_LEN)] + [len(cfg)] + cfg + val_flow
+    )
+    size = 1000 + rng.randrange(1000)
+    if measure_runtime:
+        # Deterministic mean with 1% measurement noise
+        runtime_sec = (0.5 + rng.random()) * (1 + 0.01 * random.random())
+        runtime_percent = rng.random() * 100
+    else:
+        runtime_sec = runtime_percent = 0.0
+    return (
+        struct.pack("i", 4 * len(embedding))
+        + struct.pack(f"{len(embedding)}i", *embedding)
+        + struct.pack("ddi", runtime_percent, runtime_sec, size)
+        + struct.pack("dd", build_sec, run_sec)
+        + struct.pack("i", features)
+    )
+
+
+def main():
+    args = parse_args()
+    build_sec = float(os.environ.get("STUB_KERNEL_BUILD_SEC", "0"))
+    run_sec = float(os.environ.get("STUB_KERNEL_RUN_SEC", "0"))
+    if args.run_strings == []:
+        run_sec = 0.0
+    graph_len = int(os.environ.get("STUB_KERNEL_GRAPH_LEN", "64"))
+    idle_sec = float(os.environ.get("STUB_KERNEL_IDLE_SEC", "10"))
+    shm_min = int(os.environ.get("STUB_KERNEL_SHM_MIN", "0"))
+    crash_on = os.environ.get("STUB_KERNEL_CRASH_ON", "").encode("utf-8")
+    features = int(
+        os.environ.get("STUB_KERNEL_FEATURES", str(KERNEL_RERUN | KERNEL_SHM))
+    )
+
+    soc = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM, 0)
+    soc.bind(f"\0{args.name}:backend_{args.instance}")
+    soc.settimeout(PROBE_INTERVAL)
+
+    sessions = set()
+    built = {}  # session address -> the last pass list built for it
+    last_probe = last_seen = monotonic()
+    while True:
+        try:
+            request, address = soc.recvfrom(65536)
+        except socket.timeout:
+            request = None
+        now = monotonic()
+        if request is not None and request != b"":
+            sessions.add(address)
+            last_seen = now
+            shm = features & KERNEL_SHM and request.startswith(b"^")
+            if shm:
+                request = request[1:]
+            rerun = features & KERNEL_RERUN and request.startswith(b"!")
+            if rerun:
+                request = request[1:]
+            build = not rerun or built.get(address) != request
+            built[address] = request
+            spent = run_sec * args.repeats + (build_sec if build else 0.0)
+            if spent > 0:
+                sleep(spent)
+            if crash_on and crash_on in request.split(b"\n"):
+                os._exit(1)
+            payload = response(
+                request,
+                args.run_strings != [],
+                build_sec if build else 0.0,
+                run_sec,
+                graph_len,
+                features,
+            )
+            try:
+                if shm and len(payload) >= shm_min:
+                    from compiler_gym.envs.gcc_multienv.backend.shared_memory import (
+                        send_shared,
+                    )
+
+                    send_shared(soc, payload, address)
+                else:
+                    soc.sendto(payload, address)
+            except OSError as e:
+                if e.errno not in (errno.ECONNREFUSED, errno.ENOENT):
+                    raise
+                sessions.discard(address)
+                built.pop(address, None)
+
+        if now - last_probe >= PROBE_INTERVAL:
+            last_probe = now
+            for address in list(sessions):
+                try:
+                    soc.sendto(b"", address)
+                except OSError:
+                    sessions.discard(address)
+                    built.pop(address, None)
+            if sessions:
+                last_seen = now
+            elif now - last_seen > idle_sec:
+                return
+
+
+if __name__ == "__main__":
+    main()
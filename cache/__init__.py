@@ -0,0 +1,11 @@
+from compiler_gym.envs.gcc_multienv.cache.database import SharedDatabase
+from compiler_gym.envs.gcc_multienv.cache.embedding_cache import EmbeddingCache
+from compiler_gym.envs.gcc_multienv.cache.prefix_trie import PrefixTrieCache
+from compiler_gym.envs.gcc_multienv.cache.result_cache import ResultCache
+
+__all__ = [
+    "EmbeddingCache",
+    "PrefixTrieCache",
+    "ResultCache",
+    "SharedDatabase",
+]
@@ -0,0 +1,86 @@
+"""
+sqlite databases shared by all sessions of a service process and by any number of service processes
+"""
+
+import atexit
+import os
+import sqlite3
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+
+
+class SharedDatabase:
+    """
+    Connection to an sqlite database file, opened with `SharedDatabase.open`, which keeps one instance
+    per file for the whole process. All threads use the connection under `lock`.
+
+    The database is in WAL mode, so any number of processes can share the file: readers never block,
+    and concurrent writers are serialized by sqlite itself. Statements are committed as they are executed
+    (use `transaction` to group them), and commits are not synced to disk, so the latest writes may be
+    lost on power failure, but never corrupt the database.
+    """
+
+    _instances = {}
+    _instances_lock = threading.Lock()
+
+    def __init__(self, path):
+        self.path = path
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(
+            str(self.path), timeout=60, isolation_level=None, check_same_thread=False
+        )
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self._set_up = set()
+
+    @classmethod
+    def open(cls, path, setup=None):
+        """
+        Returns the database of file `path`, creating it on first use. `setup` (called with the connection)
+        creates tables and indices, it is called once per process for every file it is used with
+        """
+        path = Path(os.path.abspath(path))
+        with cls._instances_lock:
+            database = cls._instances.get(path)
+            if database is None:
+                database = cls._instances[path] = cls(path)
+        if setup is not None:
+            with database.lock:
+                if setup not in database._set_up:
+                    setup(database.conn)
+                    database._set_up.add(setup)
+        return database
+
+    def execute(self, sql, parameters=()):
+        """
+        Execute statement and return all rows it produced
+        """
+        with self.lock:
+            return self.conn.execute(sql, parameters).fetchall()
+
+    @contextmanager
+    def transaction(self):
+        """
+        Hold `lock` and run statements executed on the yielded connection in one transaction
+        """
+        with self.lock:
+            self.conn.execute("BEGIN")
+            try:
+                yield self.conn
+            except BaseException:
+                self.conn.execute("ROLLBACK")
+                raise
+            self.conn.execute("COMMIT")
+
+    @classmethod
+    def close_all(cls):
+        with cls._instances_lock:
+            for database in cls._instances.values():
+                with database.lock:
+                    database.conn.close()
+            cls._instances.clear()
+
+
+atexit.register(SharedDatabase.close_all)
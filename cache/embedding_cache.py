@@ -0,0 +1,125 @@
+"""
+Memoization of flow2vec graph embeddings.
+Different pass sequences often produce identical IR, and therefore identical graphs
+dumped by the plugin, so embeddings are looked up by a hash of the raw graph data
+"""
+
+import hashlib
+import os
+import struct
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+
+from compiler_gym.envs.gcc_multienv.cache.database import SharedDatabase
+
+
+def _create_tables(conn):
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS embeddings (key BLOB PRIMARY KEY, vector BLOB, used REAL) WITHOUT ROWID"
+    )
+    columns = [row[1] for row in conn.execute("PRAGMA table_info(embeddings)")]
+    if "used" not in columns:
+        conn.execute("ALTER TABLE embeddings ADD COLUMN used REAL")
+    conn.execute("CREATE INDEX IF NOT EXISTS embeddings_used ON embeddings (used)")
+
+
+class EmbeddingCache:
+    """
+    LRU cache of up to `capacity` embedding vectors in memory, optionally backed by an sqlite file
+    (`spill_to`) shared between processes. Vectors are written through to the file, and looked up
+    there when they are missing in memory.
+
+    The file keeps up to `max_rows` vectors: every `TRIM_INTERVAL` writes, vectors that were least
+    recently written or read from the file are deleted from it.
+    """
+
+    TRIM_INTERVAL = 1024
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.hits = 0
+        self.misses = 0
+        self._vectors = OrderedDict()
+        self._lock = threading.Lock()
+        self._db = None
+        self.max_rows = None
+        self._writes = 0
+
+    def spill_to(self, path, max_rows=1 << 20):
+        """
+        Back the cache with sqlite file `path`, which keeps at most `max_rows` vectors.
+        A cache spills to one file only, so other paths are rejected once it is set
+        """
+        with self._lock:
+            if self._db is None:
+                self._db = SharedDatabase.open(path, _create_tables)
+            elif self._db.path != Path(os.path.abspath(path)):
+                raise ValueError(
+                    f"Embeddings already spill to {self._db.path}, not to {path}"
+                )
+            self.max_rows = max_rows
+
+    def key(self, graph, dim):
+        """
+        Hash of raw graph data (any buffer, e.g. int32 memoryview) and embedding dimension
+        """
+        digest = hashlib.blake2b(graph, digest_size=16)
+        digest.update(struct.pack("i", dim))
+        return digest.digest()
+
+    def get(self, key):
+        with self._lock:
+            vector = self._vectors.get(key)
+            if vector is not None:
+                self._vectors.move_to_end(key)
+                self.hits += 1
+                return vector
+            if self._db is not None:
+                rows = self._db.execute(
+                    "SELECT vector FROM embeddings WHERE key = ?", (key,)
+                )
+                if rows != []:
+                    self._db.execute(
+                        "UPDATE embeddings SET used = ? WHERE key = ?",
+                        (time.time(), key),
+                    )
+                    vector = struct.unpack(f"{len(rows[0][0]) // 8}d", rows[0][0])
+                    self._remember(key, vector)
+                    self.hits += 1
+                    return vector
+            self.misses += 1
+            return None
+
+    def put(self, key, vector):
+        vector = tuple(vector)
+        with self._lock:
+            self._remember(key, vector)
+            if self._db is not None:
+                self._db.execute(
+                    "INSERT OR IGNORE INTO embeddings VALUES (?, ?, ?)",
+                    (key, struct.pack(f"{len(vector)}d", *vector), time.time()),
+                )
+                self._writes += 1
+                if self._writes % self.TRIM_INTERVAL == 0:
+                    self._trim()
+        return vector
+
+    def _trim(self):
+        """
+        Delete the least recently used vectors beyond `max_rows` from the file
+        """
+        with self._db.transaction() as conn:
+            (rows,) = conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()
+            if rows > self.max_rows:
+                conn.execute(
+                    "DELETE FROM embeddings WHERE key IN (SELECT key FROM embeddings ORDER BY used LIMIT ?)",
+                    (rows - self.max_rows,),
+                )
+
+    def _remember(self, key, vector):
+        self._vectors[key] = vector
+        self._vectors.move_to_end(key)
+        while len(self._vectors) > self.capacity:
+            self._vectors.popitem(last=False)
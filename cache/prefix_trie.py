@@ -0,0 +1,94 @@
+"""
+In-memory trie of pass list prefixes with LRU eviction.
+Episodes share most of their prefixes (all of them start from the empty list),
+so states reached once are served from here on every revisit
+"""
+
+import threading
+from collections import OrderedDict
+
+
+class _Node:
+    __slots__ = ("parent", "key", "children", "value", "nbytes")
+
+    def __init__(self, parent, key):
+        self.parent = parent
+        self.key = key
+        self.children = {}
+        self.value = None
+        self.nbytes = 0
+
+
+class PrefixTrieCache:
+    """
+    Trie keyed by pass list elements, storing one value per node.
+    Values are evicted in least recently used order once their total (caller-estimated) size
+    exceeds `budget` bytes, and nodes left without value and children are pruned.
+    """
+
+    def __init__(self, budget):
+        self.budget = budget
+        self.used = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._root = _Node(None, None)
+        self._lru = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, path):
+        """
+        Returns value stored for the path or None
+        """
+        with self._lock:
+            node = self._root
+            for key in path:
+                node = node.children.get(key)
+                if node is None:
+                    break
+            if node is None or node.value is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._lru.move_to_end(node)
+            return node.value
+
+    def put(self, path, value, nbytes):
+        """
+        Store value for the path, evicting least recently used values if the budget is exceeded
+        """
+        if nbytes > self.budget:
+            return
+        with self._lock:
+            node = self._root
+            for key in path:
+                child = node.children.get(key)
+                if child is None:
+                    child = _Node(node, key)
+                    node.children[key] = child
+                node = child
+            if node.value is not None:
+                self.used -= node.nbytes
+            node.value = value
+            node.nbytes = nbytes
+            self.used += nbytes
+            self._lru[node] = None
+            self._lru.move_to_end(node)
+            while self.used > self.budget:
+                self._evict(self._lru.popitem(last=False)[0])
+
+    def _evict(self, node):
+        self.used -= node.nbytes
+        self.evictions += 1
+        node.value = None
+        node.nbytes = 0
+        while node is not self._root and node.value is None and not node.children:
+            del node.parent.children[node.key]
+            node = node.parent
+
+    def stats(self):
+        """
+        Returns (hits, misses, evictions, bytes used)
+        """
+        with self._lock:
+            return self.hits, self.misses, self.evictions, self.used
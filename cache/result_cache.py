@@ -0,0 +1,90 @@
+"""
+Persistent content-addressed store of benchmark kernel results.
+Lets sessions skip the kernel round-trip for pass sequences that were already
+evaluated for the same benchmark function (by this or any other service process)
+"""
+
+import hashlib
+
+from compiler_gym.envs.gcc_multienv.cache.database import SharedDatabase
+
+
+def _create_tables(conn):
+    conn.execute("""CREATE TABLE IF NOT EXISTS results (
+            key BLOB PRIMARY KEY,
+            size INTEGER,
+            runtime_sec REAL,
+            runtime_percent REAL,
+            embedding BLOB,
+            runtime_var REAL
+        ) WITHOUT ROWID""")
+    columns = [row[1] for row in conn.execute("PRAGMA table_info(results)")]
+    if "runtime_var" not in columns:
+        conn.execute("ALTER TABLE results ADD COLUMN runtime_var REAL")
+
+
+class ResultCache:
+    """
+    On-disk (sqlite) store of kernel responses, keyed by a hash of the session context (benchmark directory
+    and a fingerprint of its files, function name, build/run strings, plugin and repeats) and the (indented)
+    pass list sent to the kernel.
+    Values are function size, runtime_sec, runtime_percent and raw embedding bytes exactly as
+    relayed by the kernel, so cached and live responses are decoded the same way.
+
+    Caches of all sessions using the same file share one connection (see SharedDatabase).
+    """
+
+    def __init__(self, path, context):
+        """
+        `path` is the database file, `context` is a sequence of strings identifying
+        the benchmark function and how it is built and run (it is prepended to every key)
+        """
+        self._db = SharedDatabase.open(path, _create_tables)
+        self.path = self._db.path
+        self._context = "\0".join(context).encode("utf-8")
+
+    def key(self, pass_list):
+        """
+        Hash of the session context and the pass list
+        """
+        digest = hashlib.sha256(self._context)
+        digest.update(b"\1")
+        digest.update("\n".join(pass_list).encode("utf-8"))
+        return digest.digest()
+
+    def get(self, pass_list):
+        """
+        Returns (embedding bytes, (runtime_percent, runtime_sec, size, runtime_var)) or None if the pass list was never evaluated
+        """
+        rows = self._db.execute(
+            "SELECT embedding, runtime_percent, runtime_sec, size, runtime_var FROM results WHERE key = ?",
+            (self.key(pass_list),),
+        )
+        if rows == []:
+            return None
+        row = rows[0]
+        return bytes(row[0]), (row[1], row[2], row[3], row[4])
+
+    def put(self, pass_list, embedding_msg, prof_data):
+        """
+        Store kernel response for the pass list. First writer wins, as all writers
+        store results of the same compilation, except that results measured with several
+        samples (with runtime variance) replace single sample ones.
+        `prof_data` is (runtime_percent, runtime_sec, size) with optional runtime variance
+        """
+        self._db.execute(
+            """INSERT INTO results VALUES (?, ?, ?, ?, ?, ?)
+            ON CONFLICT (key) DO UPDATE SET
+                runtime_sec = excluded.runtime_sec,
+                runtime_percent = excluded.runtime_percent,
+                runtime_var = excluded.runtime_var
+            WHERE results.runtime_var IS NULL AND excluded.runtime_var IS NOT NULL""",
+            (
+                self.key(pass_list),
+                prof_data[2],
+                prof_data[1],
+                prof_data[0],
+                bytes(embedding_msg),
+                prof_data[3] if len(prof_data) > 3 else None,
+            ),
+        )
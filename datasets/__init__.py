@@ -1,6 +1,11 @@
+from compiler_gym.envs.gcc_multienv.datasets.catalog import BenchmarkCatalog
 from compiler_gym.envs.gcc_multienv.datasets.multienv_kernel import MultienvDataset
+from compiler_gym.envs.gcc_multienv.datasets.sampler import AliasTable, BenchmarkSampler
 
 __all__ = [
+    "AliasTable",
+    "BenchmarkCatalog",
+    "BenchmarkSampler",
     "MultienvDataset",
     ]
 
@@ -0,0 +1,172 @@
+"""
+Persistent index of benchmark_info.txt files, so that benchmark directories
+are not rescanned and reparsed by every worker on startup
+"""
+
+import json
+import os
+from pathlib import Path
+
+from compiler_gym.envs.gcc_multienv.cache.database import SharedDatabase
+
+# Index updates are written in batches of this many rows
+WRITE_BATCH = 500
+
+
+def parse_benchmark_info(text):
+    """
+    Parses contents of benchmark_info.txt into a dict with 'build', 'run', 'embedding_length',
+    'bench_repeats' and 'functions' entries ('run' and 'functions' are lists, missing entries are None)
+    """
+    lines = [x.strip() for x in text.splitlines()]
+    info = {}
+    for key in ("build", "embedding_length", "bench_repeats"):
+        if f"{key}:" in lines:
+            info[key] = lines[lines.index(f"{key}:") + 1]
+        else:
+            info[key] = None
+    info["run"] = [lines[i + 1] for i, e in enumerate(lines) if e == "run:"]
+    if "functions:" in lines:
+        info["functions"] = lines[lines.index("functions:") + 1 :]
+    else:
+        info["functions"] = None
+    return info
+
+
+def _create_tables(conn):
+    conn.execute("""CREATE TABLE IF NOT EXISTS dirs (
+            path TEXT PRIMARY KEY,
+            mtime_ns INTEGER,
+            subdirs TEXT,
+            has_info INTEGER
+        )""")
+    conn.execute("""CREATE TABLE IF NOT EXISTS benchmarks (
+            path TEXT PRIMARY KEY,
+            mtime_ns INTEGER,
+            info TEXT
+        )""")
+
+
+class BenchmarkCatalog:
+    """
+    sqlite index of parsed benchmark_info.txt files and of the scanned directory tree.
+
+    For every directory the index keeps its mtime, subdirectories and whether it has benchmark_info.txt,
+    so rescans only list directories whose entries changed. benchmark_info.txt files are reparsed only
+    when their mtime changes. The index file can be shared by any number of processes (see SharedDatabase).
+    """
+
+    def __init__(self, path):
+        self._db = SharedDatabase.open(path, _create_tables)
+        self.path = self._db.path
+
+    def indexed(self, root):
+        """
+        Returns list of (benchmark_info.txt path, parsed info) stored in the index for `root`, without touching the files
+        """
+        prefix = str(root).rstrip("/") + "/"
+        rows = self._db.execute(
+            "SELECT path, info FROM benchmarks WHERE substr(path, 1, ?) = ? ORDER BY path",
+            (len(prefix), prefix),
+        )
+        return [(Path(path), json.loads(info)) for path, info in rows]
+
+    def scan(self, root):
+        """
+        Generator of (benchmark_info.txt path, parsed info) for all benchmarks under `root`, updating the index.
+        Results are yielded as soon as they are found. Once the scan is complete, benchmarks and directories
+        that no longer exist are removed from the index.
+        """
+        root = Path(root)
+        seen_dirs = set()
+        seen_benchmarks = set()
+        dir_rows = []
+        benchmark_rows = []
+        stack = [root]
+        while stack:
+            directory = stack.pop()
+            try:
+                mtime_ns = os.stat(directory).st_mtime_ns
+            except FileNotFoundError:
+                continue
+            seen_dirs.add(str(directory))
+            rows = self._db.execute(
+                "SELECT mtime_ns, subdirs, has_info FROM dirs WHERE path = ?",
+                (str(directory),),
+            )
+            if rows != [] and rows[0][0] == mtime_ns:
+                subdirs, has_info = json.loads(rows[0][1]), bool(rows[0][2])
+            else:
+                subdirs = []
+                has_info = False
+                with os.scandir(directory) as entries:
+                    for entry in entries:
+                        if entry.is_dir(follow_symlinks=False):
+                            subdirs.append(entry.name)
+                        elif entry.name == "benchmark_info.txt":
+                            has_info = True
+                subdirs.sort(reverse=True)
+                dir_rows.append(
+                    (str(directory), mtime_ns, json.dumps(subdirs), int(has_info))
+                )
+
+            if has_info:
+                file = directory / "benchmark_info.txt"
+                info = self._benchmark(file, benchmark_rows)
+                if info is not None:
+                    seen_benchmarks.add(str(file))
+                    yield file, info
+
+            if len(dir_rows) + len(benchmark_rows) >= WRITE_BATCH:
+                self._write(dir_rows, benchmark_rows)
+
+            stack.extend(directory / name for name in subdirs)
+
+        prefix = str(root).rstrip("/") + "/"
+        with self._db.transaction() as conn:
+            self._write_rows(conn, dir_rows, benchmark_rows)
+            for table, seen in (("dirs", seen_dirs), ("benchmarks", seen_benchmarks)):
+                stale = [
+                    path
+                    for (path,) in conn.execute(
+                        f"SELECT path FROM {table} WHERE path = ? OR substr(path, 1, ?) = ?",
+                        (str(root), len(prefix), prefix),
+                    )
+                    if path not in seen
+                ]
+                conn.executemany(
+                    f"DELETE FROM {table} WHERE path = ?", [(path,) for path in stale]
+                )
+
+    def _benchmark(self, file, benchmark_rows):
+        """
+        Returns parsed info, appending the index row to `benchmark_rows` if it changed
+        """
+        try:
+            mtime_ns = os.stat(file).st_mtime_ns
+        except FileNotFoundError:
+            return None
+        rows = self._db.execute(
+            "SELECT mtime_ns, info FROM benchmarks WHERE path = ?", (str(file),)
+        )
+        if rows != [] and rows[0][0] == mtime_ns:
+            return json.loads(rows[0][1])
+        info = parse_benchmark_info(file.read_text())
+        benchmark_rows.append((str(file), mtime_ns, json.dumps(info)))
+        return info
+
+    def _write(self, dir_rows, benchmark_rows):
+        with self._db.transaction() as conn:
+            self._write_rows(conn, dir_rows, benchmark_rows)
+
+    @staticmethod
+    def _write_rows(conn, dir_rows, benchmark_rows):
+        """
+        Write pending rows in the current transaction and clear the lists
+        """
+        conn.executemany("INSERT OR REPLACE INTO dirs VALUES (?, ?, ?, ?)", dir_rows)
+        conn.executemany(
+            "INSERT OR REPLACE INTO benchmarks VALUES (?, ?, ?)", benchmark_rows
+        )
+        dir_rows.clear()
+        benchmark_rows.clear()
@@ -6,9 +6,14 @@ files and creates benchmark objects from them
 from compiler_gym.datasets import Benchmark, Dataset, BenchmarkUri
 from typing import Iterable
 from pathlib import Path
-import os
 from itertools import chain
 import random
+import threading
+from compiler_gym.envs.gcc_multienv.datasets.catalog import (
+    BenchmarkCatalog,
+    parse_benchmark_info,
+)
+from compiler_gym.envs.gcc_multienv.datasets.sampler import BenchmarkSampler
 
 
 class MultienvDataset(Dataset):
@@ -22,6 +27,16 @@ class MultienvDataset(Dataset):
         self._paths = []
         self.benches = []
         self._plugin = None
+        self._result_cache = None
+        self._embedding_cache = None
+        self._baseline_cache = None
+        self._staging = None
+        self._size_only = False
+        self._catalog = None
+        self._scan_thread = None
+        self._scanned = threading.Event()
+        self._random = random.Random()
+        self._sampler = None
 
     @property
     def path(self):
@@ -39,49 +54,139 @@ class MultienvDataset(Dataset):
     def plugin(self, value):
         self._plugin = Path(value)
 
+    @property
+    def result_cache(self):
+        return self._result_cache
+
+    @result_cache.setter
+    def result_cache(self, value):
+        self._result_cache = Path(value)
+
+    @property
+    def embedding_cache(self):
+        return self._embedding_cache
+
+    @embedding_cache.setter
+    def embedding_cache(self, value):
+        self._embedding_cache = Path(value)
+
+    @property
+    def baseline_cache(self):
+        return self._baseline_cache
+
+    @baseline_cache.setter
+    def baseline_cache(self, value):
+        self._baseline_cache = Path(value)
+
+    @property
+    def staging(self):
+        return self._staging
+
+    @staging.setter
+    def staging(self, value):
+        self._staging = value
+
+    @property
+    def catalog(self):
+        return self._catalog
+
+    @catalog.setter
+    def catalog(self, value):
+        self._catalog = BenchmarkCatalog(value)
+
+    @property
+    def size_only(self):
+        return self._size_only
+
+    @size_only.setter
+    def size_only(self, value):
+        self._size_only = bool(value)
+
     def parse_benchmarks(self):
         """
         Recursively parses benchmark_info.txt files in directories listed in self._paths
+
+        If the dataset has a catalog, benchmarks are taken from the catalog index right away,
+        and the index is refreshed by a background scan that replaces the list when it is complete.
+        With an empty index, benchmarks are added to the list as the scan finds them.
         """
         if self._paths == []:
             self.benches == [""]
             return
-        else:
+        elif self._catalog is None:
             self.benches = []
             for path in self._paths:
                 for file in chain(
                     path.glob("**/benchmark_info.txt"),
                 ):
                     self.parse_file(file)
+        elif self._scan_thread is None or not self._scan_thread.is_alive():
+            self.benches = [
+                uri
+                for path in self._paths
+                for file, info in self._catalog.indexed(path)
+                for uri in self.make_uris(file, info)
+            ]
+            self._scanned.clear()
+            self._scan_thread = threading.Thread(target=self.scan_catalog, daemon=True)
+            self._scan_thread.start()
+
+    def scan_catalog(self):
+        benches = []
+        live = self.benches == []
+        try:
+            for path in self._paths:
+                for file, info in self._catalog.scan(path):
+                    uris = self.make_uris(file, info)
+                    benches += uris
+                    if live:
+                        self.benches += uris
+            self.benches = benches
+        finally:
+            self._scanned.set()
+
+    def iter_benchmark_uris(self) -> Iterable[str]:
+        """
+        Lazily yields benchmark URIs while scanning the directories (updating the catalog, if there is one)
+        """
+        for path in self._paths:
+            if self._catalog is None:
+                for file in path.glob("**/benchmark_info.txt"):
+                    yield from self.make_uris(
+                        file, parse_benchmark_info(file.read_text())
+                    )
+            else:
+                for file, info in self._catalog.scan(path):
+                    yield from self.make_uris(file, info)
 
     def parse_file(self, file: Path):
         """
         Parses one benchmark_info.txt file and creates a BenchmarkUri from its contents
         """
+        self.benches += self.make_uris(file, parse_benchmark_info(file.read_text()))
+
+    def make_uris(self, file: Path, info):
+        """
+        Creates BenchmarkUris for all functions of the benchmark from parsed benchmark_info.txt
+        """
         uri_dataset = "multienv"
         uri_path = str(file.resolve().parent) + "/"
-        lines = [x.strip() for x in file.read_text().splitlines()]
-        if "build:" in lines:
-            uri_build = "build_string=" + lines[lines.index("build:") + 1] + "&"
+        if info["build"] != None:
+            uri_build = "build_string=" + info["build"] + "&"
         else:
             uri_build = ""
 
-        run_indices = [i for i, e in enumerate(lines) if e == "run:"]
         uri_run = ""
-        for ind in run_indices:
-            uri_run += "run_string=" + lines[ind + 1] + "&"
+        for run in info["run"]:
+            uri_run += "run_string=" + run + "&"
 
-        if "embedding_length:" in lines:
-            uri_embedding_length = (
-                "embedding_length=" + lines[lines.index("embedding_length:") + 1] + "&"
-            )
+        if info["embedding_length"] != None:
+            uri_embedding_length = "embedding_length=" + info["embedding_length"] + "&"
         else:
             uri_embedding_length = ""
 
-        if "bench_repeats:" in lines:
-            uri_bench_repeats = (
-                "bench_repeats=" + lines[lines.index("bench_repeats:") + 1] + "&"
-            )
+        if info["bench_repeats"] != None:
+            uri_bench_repeats = "bench_repeats=" + info["bench_repeats"] + "&"
         else:
             uri_bench_repeats = ""
 
@@ -90,11 +195,36 @@ class MultienvDataset(Dataset):
         else:
             uri_plugin = ""
 
+        if self._result_cache != None:
+            uri_result_cache = "result_cache=" + str(self._result_cache) + "&"
+        else:
+            uri_result_cache = ""
+
+        if self._embedding_cache != None:
+            uri_embedding_cache = "embedding_cache=" + str(self._embedding_cache) + "&"
+        else:
+            uri_embedding_cache = ""
+
+        if self._baseline_cache != None:
+            uri_baseline_cache = "baseline_cache=" + str(self._baseline_cache) + "&"
+        else:
+            uri_baseline_cache = ""
+
+        if self._staging != None:
+            uri_staging = "staging=" + self._staging + "&"
+        else:
+            uri_staging = ""
+
+        if self._size_only:
+            uri_size_only = "size_only=1&"
+        else:
+            uri_size_only = ""
+
         uri_bench_name = "bench_name=" + str(file.parts[-2]) + "&"
 
-        if "functions:" in lines:
-            index = lines.index("functions:") + 1
-            for line in lines[index:]:
+        benches = []
+        if info["functions"] != None:
+            for line in info["functions"]:
                 bench = (
                     uri_dataset
                     + uri_path
@@ -104,23 +234,76 @@ class MultienvDataset(Dataset):
                     + uri_embedding_length
                     + uri_bench_repeats
                     + uri_plugin
+                    + uri_result_cache
+                    + uri_embedding_cache
+                    + uri_baseline_cache
+                    + uri_staging
+                    + uri_size_only
                     + uri_bench_name
                 )
                 bench += "fun_name=" + line
-                self.benches.append(bench)
+                benches.append(bench)
         else:
             print(f"No function data found for bench {file.parent}")
+        return benches
 
     def benchmark_uris(self) -> Iterable[str]:
         if self.benches == []:
             self.parse_benchmarks()
+        if self._catalog is not None:
+            self._scanned.wait()
         return self.benches
 
     def benchmark_from_parsed_uri(self, uri: BenchmarkUri) -> Benchmark:
         return Benchmark.from_file_contents(uri, None)
 
+    def sampler(
+        self,
+        rank=0,
+        world_size=1,
+        weights=None,
+        seed=None,
+        shard_by="benchmark",
+        default_weight=1.0,
+    ) -> BenchmarkSampler:
+        """
+        Create sampler over this worker's shard of the benchmarks (see BenchmarkSampler)
+        and use it for all further `random_benchmark` calls
+        """
+        self._sampler = BenchmarkSampler(
+            self.benchmark_uris(),
+            rank=rank,
+            world_size=world_size,
+            weights=weights,
+            seed=seed,
+            shard_by=shard_by,
+            default_weight=default_weight,
+        )
+        return self._sampler
+
     def random_benchmark(self, random_state=None) -> Benchmark:
-        random.seed(random_state)
+        """
+        Pick a benchmark with the installed sampler, or uniformly with dataset's own RNG.
+        `random_state` may be a numpy Generator (used instead of the RNG) or a seed for the RNG
+        (sampler's RNG if there is a sampler)
+        """
+        if self._sampler is not None:
+            if hasattr(random_state, "integers"):
+                uri = self._sampler.sample(random_state)
+            else:
+                if random_state is not None:
+                    self._sampler.seed(random_state)
+                uri = self._sampler.sample()
+            return Benchmark.from_file_contents(uri, None)
         if self.benches == []:
             self.parse_benchmarks()
-        return Benchmark.from_file_contents(random.choice(self.benches), None)
+        while self.benches == [] and self._catalog is not None:
+            if self._scanned.wait(0.1) and self.benches == []:
+                raise LookupError("No benchmarks found")
+        if hasattr(random_state, "integers"):
+            index = int(random_state.integers(len(self.benches)))
+        else:
+            if random_state is not None:
+                self._random.seed(random_state)
+            index = int(self._random.random() * len(self.benches))
+        return Benchmark.from_file_contents(self.benches[index], None)
@@ -0,0 +1,75 @@
+"""
+Bulk precomputation of function baselines.
+Starts an environment for every benchmark function of the dataset, so that its baseline gets into
+the baseline cache, and environments started later skip the baseline build and profiling.
+
+    python -m compiler_gym.envs.gcc_multienv.datasets.precompute --baseline-cache baselines.db DIR...
+"""
+
+import argparse
+import logging
+import sys
+import threading
+
+import compiler_gym
+from compiler_gym.envs.gcc_multienv.datasets.multienv_kernel import MultienvDataset
+
+
+def precompute_baselines(uris, jobs=1, env_id="gcc_multienv-v0"):
+    """
+    Reset an environment on every benchmark URI (which should have 'baseline_cache' set) with `jobs` environments
+    in parallel. Returns list of URIs that failed.
+    """
+    uris = iter(list(uris))
+    lock = threading.Lock()
+    failed = []
+
+    def worker():
+        with compiler_gym.make(env_id) as env:
+            while True:
+                with lock:
+                    uri = next(uris, None)
+                if uri is None:
+                    return
+                try:
+                    env.reset(benchmark=uri)
+                except Exception as e:
+                    logging.error("Failed to get baseline of %s: %s", uri, e)
+                    with lock:
+                        failed.append(uri)
+
+    threads = [threading.Thread(target=worker) for _ in range(jobs)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return failed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("paths", nargs="+", help="Benchmark directories")
+    parser.add_argument("--baseline-cache", required=True)
+    parser.add_argument("--plugin")
+    parser.add_argument("--catalog")
+    parser.add_argument("--size-only", action="store_true")
+    parser.add_argument("--jobs", type=int, default=1)
+    args = parser.parse_args()
+
+    dataset = MultienvDataset()
+    dataset.path = args.paths
+    dataset.baseline_cache = args.baseline_cache
+    dataset.size_only = args.size_only
+    if args.plugin is not None:
+        dataset.plugin = args.plugin
+    if args.catalog is not None:
+        dataset.catalog = args.catalog
+
+    uris = list(dataset.benchmark_uris())
+    failed = precompute_baselines(uris, args.jobs)
+    print(f"Baselines of {len(uris) - len(failed)} of {len(uris)} functions are cached")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
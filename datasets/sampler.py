@@ -0,0 +1,125 @@
+"""
+Benchmark sampling for parallel workers: deterministic sharding of benchmark URIs
+between workers and weighted sampling with an alias table
+"""
+
+import random
+
+
+class AliasTable:
+    """
+    Vose's alias method: O(n) construction, O(1) sampling of indices proportionally to `weights`
+    """
+
+    def __init__(self, weights):
+        n = len(weights)
+        if n == 0:
+            raise ValueError("No weights to sample from")
+        total = float(sum(weights))
+        if total <= 0 or any(w < 0 for w in weights):
+            raise ValueError("Weights must be non-negative with positive sum")
+        self.prob = [w * n / total for w in weights]
+        self.alias = list(range(n))
+        small = [i for i, p in enumerate(self.prob) if p < 1]
+        large = [i for i, p in enumerate(self.prob) if p >= 1]
+        while small and large:
+            s = small.pop()
+            l = large.pop()
+            self.alias[s] = l
+            self.prob[l] -= 1 - self.prob[s]
+            if self.prob[l] < 1:
+                small.append(l)
+            else:
+                large.append(l)
+        for i in small + large:
+            self.prob[i] = 1.0
+
+    def sample(self, rng):
+        i = int(rng.random() * len(self.prob))
+        if rng.random() < self.prob[i]:
+            return i
+        return self.alias[i]
+
+
+def shard_key(uri, shard_by="benchmark"):
+    """
+    Part of the URI that decides the shard: benchmark directory (so every benchmark, and its kernels,
+    is used by one worker) or the whole URI (single functions are spread between workers)
+    """
+    if shard_by == "benchmark":
+        return uri.split("?")[0]
+    elif shard_by == "function":
+        return uri
+    raise ValueError(f"Unknown shard_by value {shard_by}")
+
+
+def shard(uris, rank, world_size, shard_by="benchmark"):
+    """
+    URIs of worker `rank` of `world_size`. Distinct shard keys are sorted and dealt round robin, so shards
+    differ in size by at most one key and none is empty while there are at least `world_size` keys.
+    The assignment does not depend on URI order, so all workers that see the same URIs agree on it
+    without communication
+    """
+    keys = sorted({shard_key(uri, shard_by) for uri in uris})
+    mine = set(keys[rank::world_size])
+    return [uri for uri in uris if shard_key(uri, shard_by) in mine]
+
+
+class BenchmarkSampler:
+    """
+    Samples benchmark URIs of one worker's shard, with its own RNG.
+    `weights` is a dict or a function mapping URI to non-negative weight (e.g. baseline runtime_percent);
+    URIs missing from a dict get `default_weight`.
+    """
+
+    def __init__(
+        self,
+        uris,
+        rank=0,
+        world_size=1,
+        weights=None,
+        seed=None,
+        shard_by="benchmark",
+        default_weight=1.0,
+    ):
+        if not 0 <= rank < world_size:
+            raise ValueError(f"Rank {rank} is out of range for world size {world_size}")
+        uris = list(uris)
+        self.uris = shard(uris, rank, world_size, shard_by)
+        if self.uris == []:
+            if uris == []:
+                raise LookupError("No benchmarks to sample from")
+            # Fewer benchmarks than workers: workers without a shard of their own sample from all of them
+            self.uris = uris
+        self.rank = rank
+        self.rng = random.Random()
+        if seed is not None:
+            self.seed(seed)
+
+        if weights is None:
+            self.table = None
+        else:
+            if isinstance(weights, dict):
+                weight_list = [weights.get(uri, default_weight) for uri in self.uris]
+            else:
+                weight_list = [weights(uri) for uri in self.uris]
+            self.table = AliasTable(weight_list)
+
+    def seed(self, seed):
+        """
+        Reseed sampler's RNG (workers get different sequences for the same seed)
+        """
+        self.rng.seed(f"{seed}:{self.rank}")
+
+    def sample(self, rng=None):
+        """
+        Sample a URI with sampler's RNG, or with `rng` (anything with a `random` method, e.g. a numpy Generator)
+        """
+        if rng is None:
+            rng = self.rng
+        if self.table is None:
+            return self.uris[int(rng.random() * len(self.uris))]
+        return self.uris[self.table.sample(rng)]
+
+    def __len__(self):
+        return len(self.uris)
@@ -0,0 +1,11 @@
+from compiler_gym.envs.gcc_multienv.metrics.timings import (
+    PHASES,
+    MetricsExporter,
+    StepTimings,
+)
+
+__all__ = [
+    "MetricsExporter",
+    "PHASES",
+    "StepTimings",
+]
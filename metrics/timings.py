@@ -0,0 +1,141 @@
+"""
+Per-step latency breakdown of compilation sessions and its periodic export.
+Every step is split into phases (validation, cache lookups, socket send and wait, decoding,
+embedding calculation, and kernel build and run times reported by the kernel), so slow steps
+can be attributed to the part of the pipeline that caused them
+"""
+
+import json
+import math
+import os
+import threading
+from contextlib import contextmanager
+from time import perf_counter, time
+
+# Order of phases in the timings vector
+PHASES = (
+    "step",
+    "validate",
+    "cache",
+    "send",
+    "wait",
+    "decode",
+    "embedding",
+    "kernel_build",
+    "kernel_run",
+    "attach",
+    "baseline",
+    "cpu_wait",
+)
+
+
+class StepTimings:
+    """
+    Seconds spent in every phase of the current step. Nested phases are counted in each
+    of the enclosing ones too (e.g. 'wait' is part of 'step')
+    """
+
+    def __init__(self):
+        self.current = {}
+
+    @contextmanager
+    def phase(self, name):
+        start = perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, perf_counter() - start)
+
+    def add(self, name, seconds):
+        self.current[name] = self.current.get(name, 0.0) + seconds
+
+    def vector(self):
+        return [self.current.get(name, 0.0) for name in PHASES]
+
+    def end_step(self, exporter=None):
+        """
+        Start timing a new step, passing timings of the finished one to `exporter`
+        """
+        if exporter is not None and self.current != {}:
+            exporter.record(self.current)
+        self.current = {}
+
+
+class _Histogram:
+    """
+    Counts of durations in power of two buckets of microseconds: bucket k holds durations
+    in [2^(k-1), 2^k) us (bucket 0 is everything below 1 us)
+    """
+
+    __slots__ = ("count", "total", "max", "buckets")
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.buckets = []
+
+    def add(self, seconds):
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+        micros = seconds * 1e6
+        bucket = 0 if micros < 1 else math.floor(math.log2(micros)) + 1
+        if bucket >= len(self.buckets):
+            self.buckets += [0] * (bucket + 1 - len(self.buckets))
+        self.buckets[bucket] += 1
+
+    def to_dict(self):
+        return {
+            "count": self.count,
+            "sum": self.total,
+            "max": self.max,
+            "buckets_us_log2": self.buckets,
+        }
+
+
+class MetricsExporter:
+    """
+    Histograms of phase timings of all sessions in this process. They are written as JSON to
+    '<path>.<pid>' (so processes of many environments do not overwrite each other's files)
+    at most every `interval` seconds when steps are recorded, and on `flush`
+    """
+
+    def __init__(self, path, interval=60):
+        self.path = f"{path}.{os.getpid()}"
+        self.interval = interval
+        self.steps = 0
+        self._histograms = {}
+        self._last_dump = time()
+        self._lock = threading.Lock()
+
+    def record(self, timings):
+        with self._lock:
+            self.steps += 1
+            for name, seconds in timings.items():
+                histogram = self._histograms.get(name)
+                if histogram is None:
+                    histogram = self._histograms[name] = _Histogram()
+                histogram.add(seconds)
+            if time() - self._last_dump >= self.interval:
+                self._dump()
+
+    def flush(self):
+        with self._lock:
+            self._dump()
+
+    def _dump(self):
+        self._last_dump = time()
+        data = {
+            "pid": os.getpid(),
+            "time": self._last_dump,
+            "steps": self.steps,
+            "phases": {
+                name: histogram.to_dict()
+                for name, histogram in self._histograms.items()
+            },
+        }
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(data, f)
+        os.replace(tmp_path, self.path)
@@ -17,21 +17,85 @@ from compiler_gym.service.proto import (
     Int64Tensor,
     DoubleSequenceSpace,
     DoubleTensor,
+    SpaceSequenceSpace,
 )
 from compiler_gym.service.runtime import create_and_run_compiler_gym_service
-from shutil import copytree, copy2, rmtree
 from compiler_gym.datasets import BenchmarkUri, Benchmark
 from subprocess import *
 from time import *
 from compiler_gym.envs.gcc_multienv.shuffler import *
 from compiler_gym.envs.gcc_multienv.embedding import *
-import os, sys
+from compiler_gym.envs.gcc_multienv.cache import (
+    EmbeddingCache,
+    PrefixTrieCache,
+    ResultCache,
+)
+from compiler_gym.envs.gcc_multienv.backend import (
+    KERNEL_RERUN,
+    KERNEL_SHM,
+    RERUN_PREFIX,
+    SHM_PREFIX,
+    CpuScheduler,
+    KernelPool,
+    RecordingSocket,
+    RemoteConnectionPool,
+    RemoteSocket,
+    ReplaySocket,
+    RequestCoalescer,
+    RuntimeEstimate,
+    SlotTable,
+    TraceMissError,
+    TraceStore,
+    kernel_command,
+    parse_cpu_list,
+    read_key,
+    read_sysctl,
+    recv_shared,
+    request_passes,
+    tree_fingerprint,
+)
+from compiler_gym.envs.gcc_multienv.validation import (
+    ActionMask,
+    PassTree,
+    shuffler_check,
+)
+from compiler_gym.envs.gcc_multienv.metrics import PHASES, MetricsExporter, StepTimings
+import os
 import re
 import socket
+import select
 import errno
 import struct
 import hashlib
 import base64
+import copy
+import math
+import itertools
+from collections import deque
+
+
+class LazyEmbedding:
+    """
+    Embedding vector that is calculated from raw kernel data only when it is first requested,
+    so that sessions that never observe embeddings do not pay for flow2vec
+    """
+
+    __slots__ = ("raw", "properties", "vector")
+
+    def __init__(self, raw, properties):
+        self.raw = bytes(raw)
+        self.properties = properties
+        self.vector = None
+
+    def get(self, session):
+        raw = self.raw
+        if self.vector is None and raw is not None:
+            with session.timings.phase("embedding"):
+                self.vector = session.calc_embedding(memoryview(raw).cast("i")) + list(
+                    self.properties
+                )
+            self.raw = None
+        return self.vector
 
 
 class GccMultienvCompilationSession(CompilationSession):
@@ -40,6 +104,58 @@ class GccMultienvCompilationSession(CompilationSession):
     actions_lib = setuplib("../shuffler/libactions.so")
     action_list2 = get_list_by_list_num(actions_lib, 2)
 
+    # Validated prefixes of pass sequences, shared by all sessions
+    pass_tree = PassTree(shuffler_check(actions_lib, 2))
+
+    # Legal actions of list2 for given properties, from the constraints of the list
+    action_mask = ActionMask(action_list2, "../lists/constraints2.txt")
+
+    # Datagrams a socket queues at once, and bytes of unread datagrams a kernel may have sent (its send buffer).
+    # Both are shared by all sessions of a kernel, so a session keeps at most half of them in flight
+    DGRAM_QUEUE_LEN = read_sysctl("net/unix/max_dgram_qlen", 10)
+    DGRAM_QUEUE_BYTES = read_sysctl("net/core/wmem_default", 212992)
+
+    # How often sessions waiting for a response check that the kernel is alive
+    KERNEL_CHECK_SEC = 1.0
+
+    # How many times the kernel is restarted for the same unanswered request before the session gives up
+    KERNEL_RESTART_LIMIT = 3
+
+    # Key of the baseline in state and result caches (cannot clash with pass lists)
+    BASELINE_KEY = "\0baseline"
+
+    # Process-wide memo of flow2vec embeddings of raw graphs
+    embedding_cache = EmbeddingCache(65536)
+
+    # Benchmark kernels started by this service process
+    kernel_pool = KernelPool()
+
+    # Connections to kernel hosts of remote kernels
+    remote_pool = RemoteConnectionPool()
+
+    # Fingerprints of benchmark files by benchmark directory and its modification time (see `bench_fingerprint`)
+    bench_fingerprints = {}
+
+    # Protocol features last advertised by kernels of each (kernel host, kernel name), see `recv_state`
+    known_kernel_features = {}
+
+    # Instance slots of session sockets, shared by all service processes
+    slot_table = SlotTable()
+
+    # Dedicated cores for runtime measurement, set up with 'measure_cpus' (see __init__)
+    cpu_scheduler = None
+    # Numbers of sessions of this process, which name them as holders of measurement core leases
+    session_ids = itertools.count()
+
+    # Process-wide cache of states reached by sessions, shared between sessions (and resets)
+    state_cache = PrefixTrieCache(256 * 1024 * 1024)
+
+    # States sessions of this process are waiting for from kernels, so that other sessions wait for them too
+    coalescer = RequestCoalescer()
+
+    # Histograms of step timings of all sessions, exported to 'metrics_file' (see __init__)
+    metrics = None
+
     action_spaces = [
         ActionSpace(
             name="list2",
@@ -151,6 +267,120 @@ class GccMultienvCompilationSession(CompilationSession):
                 double_value=0.0,
             ),
         ),
+        ObservationSpace(
+            name="runtime_variance",
+            space=Space(
+                double_value=DoubleRange(min=0),
+            ),
+            deterministic=False,
+            platform_dependent=True,
+            default_observation=Event(
+                double_value=0,
+            ),
+        ),
+        ObservationSpace(
+            name="base_runtime_variance",
+            space=Space(
+                double_value=DoubleRange(min=0),
+            ),
+            deterministic=False,
+            platform_dependent=True,
+            default_observation=Event(
+                double_value=0,
+            ),
+        ),
+        ObservationSpace(
+            name="batch_results",
+            space=Space(
+                space_sequence=SpaceSequenceSpace(
+                    length_range=Int64Range(min=0),
+                    space=Space(
+                        double_sequence=DoubleSequenceSpace(
+                            length_range=Int64Range(min=0)
+                        ),
+                    ),
+                ),
+            ),
+            deterministic=False,
+            platform_dependent=True,
+            default_observation=Event(
+                event_list=ListEvent(event=[]),
+            ),
+        ),
+        ObservationSpace(
+            name="request_ids",
+            space=Space(
+                int64_sequence=Int64SequenceSpace(length_range=Int64Range(min=0)),
+            ),
+            deterministic=False,
+            platform_dependent=False,
+            default_observation=Event(
+                int64_tensor=Int64Tensor(shape=[0], value=[]),
+            ),
+        ),
+        ObservationSpace(
+            name="completed_results",
+            space=Space(
+                space_sequence=SpaceSequenceSpace(
+                    length_range=Int64Range(min=0),
+                    space=Space(
+                        double_sequence=DoubleSequenceSpace(
+                            length_range=Int64Range(min=0)
+                        ),
+                    ),
+                ),
+            ),
+            deterministic=False,
+            platform_dependent=True,
+            default_observation=Event(
+                event_list=ListEvent(event=[]),
+            ),
+        ),
+        ObservationSpace(
+            name="timings",
+            space=Space(
+                double_sequence=DoubleSequenceSpace(
+                    length_range=Int64Range(min=len(PHASES), max=len(PHASES))
+                ),
+            ),
+            deterministic=False,
+            platform_dependent=True,
+            default_observation=Event(
+                double_tensor=DoubleTensor(
+                    shape=[len(PHASES)], value=[0.0] * len(PHASES)
+                )
+            ),
+        ),
+        ObservationSpace(
+            name="action_mask",
+            space=Space(
+                int64_sequence=Int64SequenceSpace(
+                    length_range=Int64Range(
+                        min=len(action_list2), max=len(action_list2)
+                    )
+                ),
+            ),
+            deterministic=True,
+            platform_dependent=False,
+            default_observation=Event(
+                int64_tensor=Int64Tensor(
+                    shape=[len(action_list2)], value=[1] * len(action_list2)
+                )
+            ),
+        ),
+        ObservationSpace(
+            name="state_cache_stats",
+            space=Space(
+                int64_sequence=Int64SequenceSpace(
+                    length_range=Int64Range(min=4, max=4)
+                ),
+            ),
+            deterministic=False,
+            platform_dependent=False,
+            default_observation=Event(
+                int64_tensor=Int64Tensor(shape=[4], value=[0] * 4)
+            ),
+        ),
     ]
 
     def __init__(
@@ -165,24 +395,182 @@ class GccMultienvCompilationSession(CompilationSession):
 
         self.EMBED_LEN_MULTIPLIER = 200
 
+        # Kernel responses are received into this buffer, which is reused between steps
+        self.recv_buf = bytearray(4 + 1024 * self.EMBED_LEN_MULTIPLIER + 24)
+        self.recv_view = memoryview(self.recv_buf)
+        # The last response: `recv_view`, or a view of the shared memory `mapping` it was sent in
+        self.response_view = self.recv_view
+        self.mapping = None
+        # Size of the largest datagram received from the kernel, to estimate how much requests in flight
+        # take of socket buffers (see `pipeline_full`)
+        self.response_bytes = 0
+
         self.baseline_size = None
         self.baseline_runtime_sec = None
         self.baseline_runtime_percent = None
         self.baseline_embedding = None
+        self.baseline_runtime_variance = None
+        self.runtime_variance = None
         self._lists_valid = True
         self.pass_list = []
         self.indented_pass_list = []
         self.current_action_space = self.action_spaces[0]
         self.embedding = None
+        self.batch_results = []
+        self.next_request_id = 0
+        # (request ids, indented pass list, properties) in kernel order
+        self.in_flight = deque()
+        self.completed = {}  # Request id -> state
+        self.request_ids = []
+        self.completed_results = []
         self.orig_properties = None
         self.custom_properties = None
+        self.timings = StepTimings()
 
         self.bench_name = " ".join(self.parsed_bench.params["bench_name"])
         self.fun_name = " ".join(self.parsed_bench.params["fun_name"])
 
-        self.soc = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM, 0)
-        self.instance = 0
-        avail_length = 107 - len(self.bench_name) - len(str(self.instance)) - 2
+        # In size-only mode kernels only compile the benchmark, and runtime observations are NaN.
+        # Such kernels are not shared with sessions that measure runtime
+        self.size_only = self.parsed_bench.params.get("size_only", ["0"])[0] not in (
+            "0",
+            "false",
+        )
+        self.kernel_name = self.bench_name + ("~size" if self.size_only else "")
+
+        # Everything that identifies kernel response for a given pass list, except where the benchmark is
+        # (traces are replayed on hosts that may not have the benchmark, see attach_backend)
+        self.trace_context = (
+            self.kernel_name,
+            self.fun_name,
+            " ".join(self.parsed_bench.params.get("build_string", [])),
+            *self.parsed_bench.params.get("run_string", []),
+            *self.parsed_bench.params.get("embedding_length", []),
+            "plugin_path=" + "".join(self.parsed_bench.params.get("plugin_path", [])),
+            "bench_repeats="
+            + "".join(self.parsed_bench.params.get("bench_repeats", [])),
+        )
+        # Benchmarks of the same name in different directories are cached separately. Result and baseline caches
+        # outlive benchmark files, so their keys also have a fingerprint of the files, and edited benchmarks
+        # are cached separately (the state cache lives with the process, whose kernels keep their copies of the files)
+        self.cache_context = (*self.trace_context, str(self.parsed_bench.path))
+        if (
+            "result_cache" in self.parsed_bench.params
+            or "baseline_cache" in self.parsed_bench.params
+        ):
+            self.cache_context += (self.bench_fingerprint(),)
+
+        # With 'kernel_host=<host>:<port>' the kernel runs on a kernel host (see attach_backend),
+        # 'kernel_host_key=<path>' is the file with the key the kernel host authenticates sessions with
+        self.kernel_host = None
+        if "kernel_host" in self.parsed_bench.params:
+            host, port = self.parsed_bench.params["kernel_host"][0].rsplit(":", 1)
+            self.kernel_host = (host, int(port))
+            if "kernel_host_key" not in self.parsed_bench.params:
+                raise ValueError("'kernel_host' needs 'kernel_host_key'")
+            self.kernel_host_key = read_key(
+                self.parsed_bench.params["kernel_host_key"][0]
+            )
+
+        # With 'transport=shm' kernels that advertise KERNEL_SHM feature send responses through shared memory
+        # (see backend.shared_memory), which removes the limit on response size. Other kernels (the GCC kernel
+        # is one) keep sending datagrams. Remote kernels cannot share memory with the session
+        transport = self.parsed_bench.params.get("transport", ["dgram"])[0]
+        if transport not in ("dgram", "shm"):
+            raise ValueError(f"Unknown transport {transport!r}")
+        if transport == "shm" and self.kernel_host is not None:
+            raise ValueError("'transport=shm' cannot be used with 'kernel_host'")
+        self.shared_memory = (
+            transport == "shm" and "replay_trace" not in self.parsed_bench.params
+        )
+
+        # Protocol features the kernel advertises in its responses (see `recv_state`). Features kernels
+        # of this name advertised to earlier sessions are used until the kernel answers this session
+        self.kernel_features = self.known_kernel_features.get(
+            (self.kernel_host, self.kernel_name), 0
+        )
+
+        self.result_cache = None
+        if "result_cache" in self.parsed_bench.params:
+            self.result_cache = ResultCache(
+                self.parsed_bench.params["result_cache"][0], self.cache_context
+            )
+
+        # Baselines are kept in the result cache, or in their own 'baseline_cache' file
+        self.baseline_cache = self.result_cache
+        if "baseline_cache" in self.parsed_bench.params:
+            self.baseline_cache = ResultCache(
+                self.parsed_bench.params["baseline_cache"][0], self.cache_context
+            )
+
+        self.runtime_tolerance = None
+        if "runtime_tolerance" in self.parsed_bench.params:
+            self.runtime_tolerance = float(
+                self.parsed_bench.params["runtime_tolerance"][0]
+            )
+        self.runtime_max_samples = int(
+            self.parsed_bench.params.get("runtime_max_samples", ["10"])[0]
+        )
+        self.runtime_budget_sec = float(
+            self.parsed_bench.params.get("runtime_budget_sec", ["inf"])[0]
+        )
+        # Runtimes are measured with several samples only by `request`, so single sample results
+        # (e.g. of batches) are neither cached nor served from caches. With at most one sample
+        # runtimes are measured as without tolerance
+        self.adaptive_sampling = (
+            self.runtime_tolerance is not None
+            and not self.size_only
+            and self.runtime_max_samples > 1
+        )
+
+        # With 'embedding_cache=<path>' embeddings are spilled to that file, which keeps
+        # up to 'embedding_cache_rows' vectors (1048576 by default). All sessions of a process use one file
+        if "embedding_cache" in self.parsed_bench.params:
+            self.embedding_cache.spill_to(
+                self.parsed_bench.params["embedding_cache"][0],
+                int(
+                    self.parsed_bench.params.get("embedding_cache_rows", ["1048576"])[0]
+                ),
+            )
+
+        if "state_cache_budget" in self.parsed_bench.params:
+            self.state_cache.budget = int(
+                self.parsed_bench.params["state_cache_budget"][0]
+            )
+
+        # With 'metrics_file=<path>', histograms of step phase timings of this process are written
+        # to '<path>.<pid>' every 'metrics_interval' seconds (60 by default)
+        if "metrics_file" in self.parsed_bench.params and self.metrics is None:
+            GccMultienvCompilationSession.metrics = MetricsExporter(
+                self.parsed_bench.params["metrics_file"][0],
+                float(self.parsed_bench.params.get("metrics_interval", ["60"])[0]),
+            )
+
+        self.end_on_trace_miss = (
+            self.parsed_bench.params.get("replay_miss", ["error"])[0] == "end"
+        )
+
+        # With 'measure_cpus=<cpu list>' kernels are pinned to the other CPUs, and get 'cpus_per_run' (1 by default)
+        # of the measurement CPUs for themselves while they run requests that measure runtime.
+        # Sessions wait at most 'cpu_wait_sec' (600 by default) for free measurement CPUs, and lose them
+        # if they do not wait for their responses for 'cpu_lease_sec' (30 by default)
+        if "measure_cpus" in self.parsed_bench.params and self.cpu_scheduler is None:
+            GccMultienvCompilationSession.cpu_scheduler = CpuScheduler(
+                parse_cpu_list(self.parsed_bench.params["measure_cpus"][0]),
+                int(self.parsed_bench.params.get("cpus_per_run", ["1"])[0]),
+                float(self.parsed_bench.params.get("cpu_lease_sec", ["30"])[0]),
+                float(self.parsed_bench.params.get("cpu_wait_sec", ["600"])[0]),
+            )
+            self.kernel_pool.cpus = self.cpu_scheduler.compile_cpus
+        # Requests sent to the kernel and not answered yet, in order
+        self.sent = deque()
+        # Kernel restarts since the last response
+        self.restarts = 0
+        self.cpu_lease = None
+        self.cpu_holder = f"{os.getpid()}:{next(self.session_ids)}"
+
+        self.kernel_handle = None
+        avail_length = 107 - len(self.kernel_name) - 3  # ':', '_' and instance digit
         if len(self.fun_name) > avail_length:
             name_hash = hashlib.sha256(self.fun_name.encode("utf-8")).digest()
             self.sock_fun_name = base64.b64encode(
@@ -190,26 +578,20 @@ class GccMultienvCompilationSession(CompilationSession):
             ).decode("utf-8")
         else:
             self.sock_fun_name = self.fun_name
-        while True:  # Find self instance number and bind to corresponding socket
-            try:
-                self.soc.bind(
-                    f"\0{self.bench_name}:{self.sock_fun_name}_{self.instance}"
-                )
-            except OSError as e:
-                if e.errno != errno.EADDRINUSE:
-                    raise
-                else:
-                    self.instance += 1
-                    continue
-            break
+        # Remote and replayed sessions have no local kernel socket, so they take no slot
+        self.soc, self.slot, self.instance = None, None, 0
+        if self.kernel_host is None and "replay_trace" not in self.parsed_bench.params:
+            self.soc, self.slot = self.bind_socket()
+            self.instance = self.slot
 
-        self.attach_backend()
+        with self.timings.phase("attach"):
+            self.attach_backend()
 
-        self.orig_properties, self.custom_properties = get_property_by_history(
-            self.actions_lib, self.pass_list, 2
-        )
+        self.pass_node = self.pass_tree.root
+        self.orig_properties, self.custom_properties = self.pass_node.properties
 
-        self.get_baseline()
+        with self.timings.phase("baseline"):
+            self.get_baseline()
 
         self.get_state()
 
@@ -217,9 +599,109 @@ class GccMultienvCompilationSession(CompilationSession):
         self.init_embedding = self.embedding
         self.init_runtime_sec = self.runtime_sec
         self.init_runtime_percent = self.runtime_percent
+        self.init_runtime_variance = self.runtime_variance
 
         logging.info("Started a compilation session for %s", benchmark.uri)
 
+    def bench_fingerprint(self):
+        """
+        Fingerprint of the benchmark files (see backend.tree_fingerprint), memoized by the modification time
+        of the benchmark directory. It changes when files are added, removed or replaced (as editors and
+        build tools save them), files written in place are fingerprinted again by new service processes
+        """
+        path = str(self.parsed_bench.path)
+        try:
+            key = (path, os.stat(path).st_mtime_ns)
+        except OSError:
+            key = (path, None)
+        fingerprint = self.bench_fingerprints.get(key)
+        if fingerprint is None:
+            fingerprint = self.bench_fingerprints[key] = tree_fingerprint(path)
+        return fingerprint
+
+    def bind_socket(self):
+        """
+        Create session socket bound to '<kernel name>:<function>_<instance>' name, where instance is the slot
+        allocated in `slot_table`. Names taken by sockets outside the table are skipped.
+        Returns the socket and its instance number (slot)
+        """
+        soc = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM, 0)
+        key = f"{self.kernel_name}:{self.sock_fun_name}"
+        taken = []
+        while True:
+            slot = self.slot_table.allocate(key, taken)
+            try:
+                soc.bind(f"\0{key}_{slot}")
+            except OSError as e:
+                self.slot_table.release(key, slot)
+                if e.errno != errno.EADDRINUSE:
+                    raise
+                taken.append(slot)
+                continue
+            return soc, slot
+
+    def fork(self) -> "GccMultienvCompilationSession":
+        """
+        Create a copy of the session in its current state without rebuilding anything: pass lists, properties,
+        observations and baselines are copied, and the copy attaches to the same (warm) kernel as this session.
+        The copy gets its own socket (so responses are not mixed), and starts with no requests in flight.
+        """
+        new = copy.copy(self)
+        new.pass_list = list(self.pass_list)
+        new.indented_pass_list = list(self.indented_pass_list)
+        new.batch_results = list(self.batch_results)
+        new.in_flight = deque()
+        new.completed = {}
+        new.request_ids = []
+        new.completed_results = []
+        new.next_request_id = 0
+        new.sent = deque()
+        new.restarts = 0
+        new.cpu_lease = None
+        new.cpu_holder = f"{os.getpid()}:{next(self.session_ids)}"
+        new.slot = None
+        new.timings = StepTimings()
+        new.recv_buf = bytearray(len(self.recv_buf))
+        new.recv_view = memoryview(new.recv_buf)
+        new.response_view = new.recv_view
+        new.mapping = None
+        new.kernel_handle = None
+        if isinstance(self.soc, ReplaySocket):
+            new.soc = ReplaySocket(self.soc.store)
+            return new
+
+        if self.kernel_host is not None:
+            new.soc = RemoteSocket(
+                self.remote_pool, self.kernel_host, self.kernel_host_key
+            )
+            with new.timings.phase("attach"):
+                new.soc.attach(
+                    self.kernel_name,
+                    self.sock_fun_name,
+                    self.parsed_bench.path,
+                    self.staging,
+                    self.kernel_params(),
+                    self.instance,
+                )
+            if isinstance(self.soc, RecordingSocket):
+                new.soc = RecordingSocket(new.soc, self.soc.store)
+            return new
+
+        # Socket instance number is not used: the copy talks to the kernel of this session
+        new.soc, new.slot = self.bind_socket()
+        if isinstance(self.soc, RecordingSocket):
+            new.soc = RecordingSocket(new.soc, self.soc.store)
+        with new.timings.phase("attach"):
+            new.kernel_handle = self.kernel_pool.acquire(
+                new.soc,
+                self.kernel_name,
+                self.instance,
+                self.parsed_bench.path,
+                self.kernel_args(self.instance),
+                self.staging,
+            )
+        return new
+
     def apply_action(self, action: Event) -> Tuple[bool, Optional[ActionSpace], bool]:
         """
         Parse incoming action (may be pass index from the envs action space or pass name).
@@ -227,77 +709,273 @@ class GccMultienvCompilationSession(CompilationSession):
         Check validity of pass name and of the newly formed pass sequence.
         Postprocess some passes names (append required passes for loop or indent passes with '>')
         and pass them to the benchmark kernel to get new state observations.
+
+        String actions starting with a special line evaluate several sequences separated by empty lines
+        without changing the session state: 'batch' waits for all of them (see `batch_results`),
+        'submit' only sends them to the kernel (see `request_ids`), and 'collect'/'wait' gather finished
+        (or all) submitted requests (see `completed_results`).
+
+        When replaying a trace with 'replay_miss=end', a pass sequence that is not in the trace ends
+        the episode like an invalid one (otherwise TraceMissError is raised). Either way the session stays
+        at the last pass sequence that was in the trace.
+
+        Time spent in every phase of the step is available as `timings` observation (in PHASES order)
+        until the next step, when it is passed to the metrics exporter.
         """
-        if action.string_value != "":
-            action_string = action.string_value
-        else:
-            action_string = self.action_spaces[0].space.named_discrete.name[
-                action.int64_value
-            ]
+        self.timings.end_step(self.metrics)
+        with self.timings.phase("step"):
+            if action.string_value != "":
+                action_string = action.string_value
+            else:
+                action_string = self.action_spaces[0].space.named_discrete.name[
+                    action.int64_value
+                ]
 
-        actions_list = []
-        if "\n" not in action_string:
-            actions_list = [action_string]
-        else:
-            actions_list = action_string.split("\n")
+            actions_list = []
+            if "\n" not in action_string:
+                actions_list = [action_string]
+            else:
+                actions_list = action_string.split("\n")
 
-        if actions_list[0] == "another_try":
-            self._lists_valid = True
-            self.pass_list = []
-            self.indented_pass_list = []
-            self.current_action_space = self.action_spaces[0]
-            self.orig_properties, self.custom_properties = get_property_by_history(
-                self.actions_lib, self.pass_list, 2
+            if actions_list[0] == "another_try":
+                self._lists_valid = True
+                self.pass_list = []
+                self.indented_pass_list = []
+                self.current_action_space = self.action_spaces[0]
+                self.pass_node = self.pass_tree.root
+                self.orig_properties, self.custom_properties = self.pass_node.properties
+                self.size = self.init_size
+                self.embedding = self.init_embedding
+                self.runtime_sec = self.init_runtime_sec
+                self.runtime_percent = self.init_runtime_percent
+                self.runtime_variance = self.init_runtime_variance
+                return True, None, False
+
+            if actions_list[0] == "batch":
+                self.evaluate_batch(actions_list[1:])
+                return False, None, False
+
+            if actions_list[0] == "submit":
+                self.request_ids = [
+                    self.submit(candidate)
+                    for candidate in self.parse_candidates(actions_list[1:])
+                ]
+                return False, None, False
+
+            if actions_list[0] in ("collect", "wait"):
+                if actions_list[0] == "wait":
+                    self.drain_requests()
+                else:
+                    self.poll_requests()
+                self.completed_results = list(self.completed.items())
+                self.completed = {}
+                return False, None, False
+
+            saved = (
+                list(self.pass_list),
+                list(self.indented_pass_list),
+                self.pass_node,
+                self.orig_properties,
+                self.custom_properties,
             )
-            self.size = self.init_size
-            self.embedding = self.init_embedding
-            self.runtime_sec = self.init_runtime_sec
-            self.runtime_percent = self.init_runtime_percent
-            return True, None, False
+            for action_string in actions_list:
+                if not self.push_pass(action_string):
+                    return True, None, True
 
-        for action_string in actions_list:
-            logging.info("Applying action %s", action_string)
+            try:
+                self.get_state()
+            except TraceMissError:
+                (
+                    self.pass_list,
+                    self.indented_pass_list,
+                    self.pass_node,
+                    self.orig_properties,
+                    self.custom_properties,
+                ) = saved
+                if not self.end_on_trace_miss:
+                    raise
+                return True, None, True
 
-            if (
-                re.match(
-                    "none_pass",
-                    action_string[1:] if action_string[0] == ">" else action_string,
-                )
-                != None
-            ):
-                continue
+            return False, None, False
+
+    def push_pass(self, action_string):
+        """
+        Append pass to `pass_list` and its postprocessed form to `indented_pass_list`.
+        Returns False (leaving `pass_list` unchanged) if the pass makes the sequence invalid.
+        Validity and properties come from `pass_tree`, so every prefix is checked by the shuffler only once.
+        """
+        logging.info("Applying action %s", action_string)
 
-            list_num = get_pass_list(
-                self.actions_lib,
+        if (
+            re.match(
+                "none_pass",
                 action_string[1:] if action_string[0] == ">" else action_string,
             )
-            if list_num != 2:
-                raise ValueError(f"Unknown pass {action_string}")
+            != None
+        ):
+            return True
 
-            self.orig_properties, self.custom_properties = get_property_by_history(
-                self.actions_lib, self.pass_list, 2
-            )
+        list_num = get_pass_list(
+            self.actions_lib,
+            action_string[1:] if action_string[0] == ">" else action_string,
+        )
+        if list_num != 2:
+            raise ValueError(f"Unknown pass {action_string}")
 
-            self.pass_list.append(action_string)
+        self.orig_properties, self.custom_properties = self.pass_node.properties
 
-            self._lists_valid = True
-            if valid_pass_seq(self.actions_lib, self.pass_list, 2) != 0:
-                self._lists_valid = False
-                self.pass_list.pop()
-                return True, None, True
+        with self.timings.phase("validate"):
+            node = self.pass_tree.advance(self.pass_node, action_string)
+        self._lists_valid = node.valid
+        if not node.valid:
+            return False
+        self.pass_node = node
+        self.pass_list.append(action_string)
 
-            if action_string == "fix_loops":
-                self.indented_pass_list.append("fix_loops")
-                self.indented_pass_list.append("loop")
-                self.indented_pass_list.append(">loopinit")
-            elif in_loop(self.actions_lib, self.custom_properties):
-                self.indented_pass_list.append(">" + action_string)
+        if action_string == "fix_loops":
+            self.indented_pass_list.append("fix_loops")
+            self.indented_pass_list.append("loop")
+            self.indented_pass_list.append(">loopinit")
+        elif in_loop(self.actions_lib, self.custom_properties):
+            self.indented_pass_list.append(">" + action_string)
+        else:
+            self.indented_pass_list.append(action_string)
+        return True
+
+    def parse_candidates(self, actions_list):
+        """
+        Split `actions_list` into candidate pass sequences (separated by empty lines), and validate and
+        postprocess each of them without changing the session state.
+        Returns list of (indented pass list, properties) tuples, None for invalid sequences.
+        """
+        candidates = [[]]
+        for action_string in actions_list:
+            if action_string == "":
+                candidates.append([])
             else:
-                self.indented_pass_list.append(action_string)
+                candidates[-1].append(action_string)
 
-        self.get_state()
+        saved = (
+            self.pass_list,
+            self.indented_pass_list,
+            self.pass_node,
+            self.orig_properties,
+            self.custom_properties,
+            self._lists_valid,
+        )
+        parsed = []
+        for candidate in candidates:
+            self.pass_list = []
+            self.indented_pass_list = []
+            self.pass_node = self.pass_tree.root
+            self.orig_properties, self.custom_properties = self.pass_node.properties
+            if all(self.push_pass(action_string) for action_string in candidate):
+                parsed.append((self.indented_pass_list, self.properties()))
+            else:
+                parsed.append(None)
+        (
+            self.pass_list,
+            self.indented_pass_list,
+            self.pass_node,
+            self.orig_properties,
+            self.custom_properties,
+            self._lists_valid,
+        ) = saved
+        return parsed
+
+    def submit(self, candidate):
+        """
+        Start evaluation of a parsed candidate without waiting for the kernel.
+        Returns request id (-1 for invalid candidate), the state is put into `completed` when it is ready.
+
+        Requests are sent to the kernel right away, so it compiles them back to back while the environment
+        does other work. The kernel answers requests in the order they were sent; to avoid both sides
+        blocking on full socket queues, responses that are ready are collected before every send,
+        and the session waits for responses while the window of requests in flight is full (see `pipeline_full`).
+        """
+        if candidate is None:
+            return -1
+        indented_pass_list, properties = candidate
+        request_id = self.next_request_id
+        self.next_request_id += 1
+
+        state = self.lookup_state(indented_pass_list, properties)
+        if state is not None:
+            self.completed[request_id] = state
+            return request_id
+
+        for request in self.in_flight:
+            if request[1] == indented_pass_list:
+                request[0].append(request_id)
+                return request_id
+
+        self.poll_requests()
+        while self.pipeline_full():
+            self.recv_request()
+        self.send(self.encode_pass_list(indented_pass_list))
+        self.in_flight.append(([request_id], indented_pass_list, properties))
+        return request_id
+
+    def recv_request(self, flags=0):
+        """
+        Receive response for the oldest request in flight.
+        Returns False if `flags` has MSG_DONTWAIT and the response is not ready yet.
+        """
+        response = self.recv_state(flags)
+        if response is None:
+            return False
+        request_ids, indented_pass_list, properties = self.in_flight.popleft()
+        state = self.store_state(
+            indented_pass_list,
+            properties,
+            *response,
+            cache=not self.adaptive_sampling,
+        )
+        for request_id in request_ids:
+            self.completed[request_id] = state
+        return True
 
-        return False, None, False
+    def pipeline_full(self):
+        """
+        Check if another request in flight could fill the kernel socket queue (DGRAM_QUEUE_LEN), or make
+        unread responses take more than the kernel send buffer (DGRAM_QUEUE_BYTES). Both are shared with
+        other sessions of the kernel, so only half of each is used. A single request is always allowed
+        """
+        if not self.in_flight:
+            return False
+        return (
+            len(self.in_flight) >= self.DGRAM_QUEUE_LEN // 2
+            or (len(self.in_flight) + 1) * self.response_bytes
+            > self.DGRAM_QUEUE_BYTES // 2
+        )
+
+    def poll_requests(self):
+        """
+        Collect all responses the kernel already sent, without blocking
+        """
+        while self.in_flight and self.recv_request(socket.MSG_DONTWAIT):
+            pass
+
+    def drain_requests(self):
+        """
+        Wait for all requests in flight
+        """
+        while self.in_flight:
+            self.recv_request()
+
+    def evaluate_batch(self, actions_list):
+        """
+        Evaluate several candidate pass sequences (separated by empty lines in `actions_list`)
+        without changing the session state, and store their states in `batch_results`
+        (None for invalid sequences).
+        """
+        request_ids = [
+            self.submit(candidate) for candidate in self.parse_candidates(actions_list)
+        ]
+        self.drain_requests()
+        self.batch_results = [
+            self.completed.pop(request_id, None) for request_id in request_ids
+        ]
 
     def get_observation(self, observation_space: ObservationSpace) -> Event:
         """
@@ -316,16 +994,72 @@ class GccMultienvCompilationSession(CompilationSession):
             return Event(double_value=self.baseline_runtime_percent)
         elif observation_space.name == "base_size":
             return Event(int64_value=self.baseline_size)
+        elif observation_space.name == "runtime_variance":
+            return Event(double_value=self.runtime_variance)
+        elif observation_space.name == "base_runtime_variance":
+            return Event(double_value=self.baseline_runtime_variance)
         elif observation_space.name == "embedding":
+            embedding = self.embedding.get(self)
             return Event(
-                double_tensor=DoubleTensor(
-                    shape=[len(self.embedding)], value=self.embedding
-                )
+                double_tensor=DoubleTensor(shape=[len(embedding)], value=embedding)
             )
         elif observation_space.name == "base_embedding":
+            embedding = self.baseline_embedding.get(self)
             return Event(
-                double_tensor=DoubleTensor(
-                    shape=[len(self.baseline_embedding)], value=self.baseline_embedding
+                double_tensor=DoubleTensor(shape=[len(embedding)], value=embedding)
+            )
+        elif observation_space.name == "batch_results":
+            return Event(
+                event_list=ListEvent(
+                    event=[
+                        (
+                            Event(
+                                double_tensor=DoubleTensor(
+                                    shape=[3 + len(state[3].get(self))],
+                                    value=[*state[:3], *state[3].get(self)],
+                                )
+                            )
+                            if state is not None
+                            else Event(
+                                double_tensor=DoubleTensor(shape=[3], value=[0.0] * 3)
+                            )
+                        )
+                        for state in self.batch_results
+                    ]
+                )
+            )
+        elif observation_space.name == "request_ids":
+            return Event(
+                int64_tensor=Int64Tensor(
+                    shape=[len(self.request_ids)], value=self.request_ids
+                )
+            )
+        elif observation_space.name == "completed_results":
+            return Event(
+                event_list=ListEvent(
+                    event=[
+                        Event(
+                            double_tensor=DoubleTensor(
+                                shape=[4 + len(state[3].get(self))],
+                                value=[request_id, *state[:3], *state[3].get(self)],
+                            )
+                        )
+                        for request_id, state in self.completed_results
+                    ]
+                )
+            )
+        elif observation_space.name == "timings":
+            timings = self.timings.vector()
+            return Event(
+                double_tensor=DoubleTensor(shape=[len(timings)], value=timings)
+            )
+        elif observation_space.name == "action_mask":
+            mask = self.action_mask(self.pass_node.properties)
+            return Event(int64_tensor=Int64Tensor(shape=[len(mask)], value=mask))
+        elif observation_space.name == "state_cache_stats":
+            return Event(
+                int64_tensor=Int64Tensor(
+                    shape=[4], value=list(self.state_cache.stats())
                 )
             )
         elif observation_space.name == "passes":
@@ -342,44 +1076,226 @@ class GccMultienvCompilationSession(CompilationSession):
         else:
             raise KeyError(observation_space.name)
 
-    def padded_recv(self, size):
+    def padded_recv(self, flags=0):
         """
         Benchmark kernel occasionaly sends empty packets as a way to check if environment exists or not.
         Because of this, all the receives should be ready to discard such packet, as they are meaningless for
         the environment.
+
+        Data is received into `recv_buf` (or mapped from shared memory), and `response_view` is set to it.
+        The function returns its length (0 if `flags` has MSG_DONTWAIT and there is no data).
         """
-        while True:
-            data = self.soc.recv(size)
-            if data != bytes(0):
-                return data
+        self.release_mapping()
+        with self.timings.phase("wait"):
+            while True:
+                if not flags & socket.MSG_DONTWAIT and not self.wait_readable():
+                    continue
+                try:
+                    if self.shared_memory:
+                        nbytes, self.mapping = recv_shared(
+                            self.soc, self.recv_buf, flags
+                        )
+                    else:
+                        nbytes = self.soc.recv_into(self.recv_buf, 0, flags)
+                except BlockingIOError:
+                    return 0
+                if nbytes != 0:
+                    break
+        if self.mapping is not None:
+            self.response_view = memoryview(self.mapping)
+        else:
+            self.response_bytes = max(self.response_bytes, nbytes)
+        if self.shared_memory and isinstance(self.soc, RecordingSocket):
+            self.soc.record(self.response_view[:nbytes])
+        return nbytes
+
+    def wait_readable(self):
+        """
+        Wait up to KERNEL_CHECK_SEC for data on the kernel socket. If there is none and the kernel
+        died, it is restarted and unanswered requests are sent again. Returns whether there is data.
+        Only kernels of the kernel pool are checked (the kernel host restarts remote kernels itself)
+        """
+        if self.kernel_handle is None:
+            return True
+        self.renew_cpus()
+        if select.select([self.soc], [], [], self.KERNEL_CHECK_SEC)[0]:
+            return True
+        # A dead kernel sends nothing more, so if there is still no data, none of the requests were answered
+        if (
+            not self.kernel_handle[0].alive()
+            and not select.select([self.soc], [], [], 0)[0]
+        ):
+            self.restart_kernel()
+        return False
+
+    def release_mapping(self):
+        """
+        Unmap shared memory of the previous response. Views of it must not be used after the next receive,
+        if some still exist the mapping is left to the garbage collector.
+        """
+        if self.mapping is None:
+            return
+        view, mapping = self.response_view, self.mapping
+        self.response_view = self.recv_view
+        self.mapping = None
+        try:
+            view.release()
+            mapping.close()
+        except BufferError:
+            pass
 
     def get_baseline(self):
         """
         Get the baseline of the current function, to fill
         `baseline_size`, `baseline_runtime_sec` and `baseline_runtime_percent` fields
+
+        Baseline never changes for a function, so it is taken from the state cache (for sessions of this process)
+        or from the baseline cache ('baseline_cache=<path>' or 'result_cache=<path>' in benchmark URI) when
+        it is there, and the kernel is only asked for it once.
         """
         logging.debug("Getting baseline")
-        self.soc.send(bytes(1))  # Send empty list (plugin will use default passes)
-        logging.debug("Sent first list")
-        data_msg = self.padded_recv(4 + 1024 * self.EMBED_LEN_MULTIPLIER + 24)
-        logging.debug("Got embedding and profiling data")
-        emb_len = struct.unpack("i", data_msg[:4])[0]
-        logging.debug(f"Message (len={len(data_msg)} {data_msg}")
-        logging.debug(f"Embedding length {emb_len}")
-        embedding_msg = data_msg[4 : emb_len + 4]
-        embedding = [x[0] for x in struct.iter_unpack("i", embedding_msg)]
-        logging.debug(f"Embedding int length {len(embedding)}")
-        self.baseline_embedding = self.calc_embedding(embedding) + [
-            self.orig_properties,
-            self.custom_properties,
-        ]
-        prof_data = data_msg[emb_len + 4 :]
-        prof_data = struct.unpack("ddi", prof_data)
-        self.baseline_size = prof_data[2]
-        self.baseline_runtime_percent = prof_data[0]
-        self.baseline_runtime_sec = prof_data[1]
+        state = self.state_cache.get([self.cache_context, self.BASELINE_KEY])
+        if state is not None and not self.sampled_enough(state[4]):
+            state = None
+        if state is None and self.baseline_cache is not None:
+            cached = self.baseline_cache.get([self.BASELINE_KEY])
+            if cached is not None and self.sampled_enough(cached[1][3]):
+                logging.debug("Got baseline from baseline cache")
+                state = self.store_baseline(*cached, persist=False)
+        if state is None:
+            state = self.coalesce(
+                (self.cache_context, self.BASELINE_KEY),
+                lambda: self.store_baseline(
+                    *self.request(bytes(1))
+                ),  # Send empty list (plugin will use default passes)
+            )
+        (
+            self.baseline_size,
+            self.baseline_runtime_sec,
+            self.baseline_runtime_percent,
+            self.baseline_embedding,
+            self.baseline_runtime_variance,
+        ) = state
         logging.debug("Got all baseline")
 
+    def store_baseline(self, embedding_msg, prof_data, persist=True):
+        """
+        Make state tuple out of baseline kernel response and put it into the state and baseline caches
+        """
+        prof_data = self.runtime_data(prof_data)
+        if persist and self.baseline_cache is not None:
+            self.baseline_cache.put([self.BASELINE_KEY], embedding_msg, prof_data)
+        state = (
+            prof_data[2],
+            prof_data[1],
+            prof_data[0],
+            LazyEmbedding(embedding_msg, self.properties()),
+            prof_data[3],
+        )
+        self.state_cache.put(
+            [self.cache_context, self.BASELINE_KEY],
+            state,
+            len(embedding_msg) + 256,
+        )
+        return state
+
+    def request(self, msg):
+        """
+        Send single request to the kernel and receive response (see `recv_state`).
+
+        With 'runtime_tolerance=<relative tolerance>' in benchmark URI, the request is repeated until the
+        95% confidence interval of the mean runtime_sec is within tolerance of the mean, or
+        'runtime_max_samples' (10 by default) responses are received, or 'runtime_budget_sec' seconds pass.
+        Profiling data then holds mean runtimes and runtime_sec sample variance as the fourth element.
+
+        Kernels that advertise KERNEL_RERUN feature run the binary they have built for the first sample
+        again for the next samples. Other kernels (the GCC kernel is one) get the request again,
+        so every sample costs a build of the benchmark too.
+        """
+        self.send(msg)
+        embedding_msg, prof_data = self.recv_state()
+        if not self.adaptive_sampling:
+            return embedding_msg, prof_data
+
+        # Receive buffer is reused for the next samples
+        embedding_msg = bytes(embedding_msg)
+        estimate = RuntimeEstimate()
+        estimate.add(prof_data[1], prof_data[0])
+        deadline = monotonic() + self.runtime_budget_sec
+        if self.kernel_features & KERNEL_RERUN:
+            msg = RERUN_PREFIX + msg
+        while (
+            not estimate.converged(self.runtime_tolerance)
+            and estimate.n < self.runtime_max_samples
+            and monotonic() < deadline
+        ):
+            self.send(msg)
+            sample = self.recv_state()[1]
+            estimate.add(sample[1], sample[0])
+        logging.debug(
+            "Runtime measured with %d samples, variance %f",
+            estimate.n,
+            estimate.variance,
+        )
+        return embedding_msg, (
+            estimate.mean_percent,
+            estimate.mean,
+            prof_data[2],
+            estimate.variance,
+        )
+
+    def runtime_data(self, prof_data):
+        """
+        Normalize profiling data to (runtime_percent, runtime_sec, size, runtime variance),
+        with NaN for values that were not measured
+        """
+        if self.size_only:
+            return (math.nan, math.nan, prof_data[2], math.nan)
+        if len(prof_data) < 4 or prof_data[3] is None:
+            return (*prof_data[:3], math.nan)
+        return prof_data
+
+    def recv_state(self, flags=0):
+        """
+        Receive kernel response and split it into raw embedding bytes and profiling data
+        (runtime_percent, runtime_sec, size).
+        Embedding bytes are a view into `response_view`, valid until the next receive.
+        Returns None if `flags` has MSG_DONTWAIT and there is no response yet.
+
+        Kernels may append build and run seconds (two doubles) after the profiling data,
+        they are added to 'kernel_build' and 'kernel_run' timings. These may be followed by int32
+        bit set of protocol features the kernel implements (e.g. KERNEL_RERUN).
+        """
+        nbytes = self.padded_recv(flags)
+        if nbytes == 0:
+            return None
+        self.restarts = 0
+        if self.sent:
+            self.sent.popleft()
+        if not self.sent:
+            self.release_cpus()
+        with self.timings.phase("decode"):
+            logging.debug("Got embedding and profiling data")
+            response = self.response_view
+            emb_len = struct.unpack_from("i", response)[0]
+            logging.debug("Message length %d, embedding length %d", nbytes, emb_len)
+            embedding_msg = response[4 : emb_len + 4]
+            prof_data = struct.unpack_from("ddi", response, emb_len + 4)
+            trailer_end = emb_len + 4 + struct.calcsize("ddi")
+            if nbytes >= trailer_end + struct.calcsize("dd"):
+                build_sec, run_sec = struct.unpack_from("dd", response, trailer_end)
+                self.timings.add("kernel_build", build_sec)
+                self.timings.add("kernel_run", run_sec)
+            features_end = trailer_end + struct.calcsize("dd")
+            if nbytes >= features_end + struct.calcsize("i"):
+                (self.kernel_features,) = struct.unpack_from(
+                    "i", response, features_end
+                )
+                self.known_kernel_features[(self.kernel_host, self.kernel_name)] = (
+                    self.kernel_features
+                )
+        return embedding_msg, prof_data
+
     def get_state(self):
         """
         To get the result of compiling with current pass list the environment sends it to the kernel and
@@ -387,32 +1303,120 @@ class GccMultienvCompilationSession(CompilationSession):
         and data needed to calculate the embedding vector.
         """
         logging.debug("Getting state")
-        if self.indented_pass_list == []:
-            self.soc.send(
-                "?".encode("utf-8")
-            )  # Send '?' as pass list to get empty list stats
-        else:
-            list_msg = ("\n".join(self.indented_pass_list) + "\n").encode("utf-8")
-            self.soc.send(list_msg)
-        data_msg = self.padded_recv(4 + 1024 * self.EMBED_LEN_MULTIPLIER + 24)
-        logging.debug("Got embedding and profiling data")
-        emb_len = struct.unpack("i", data_msg[:4])[0]
-        logging.debug(f"Message (len={len(data_msg)} {data_msg}")
-        logging.debug(f"Embedding length {emb_len}")
-        embedding_msg = data_msg[4 : emb_len + 4]
-        embedding = [x[0] for x in struct.iter_unpack("i", embedding_msg)]
-        logging.debug(f"Embedding int length {len(embedding)}")
-        self.embedding = self.calc_embedding(embedding) + [
-            self.orig_properties,
-            self.custom_properties,
-        ]
-        prof_data = data_msg[emb_len + 4 :]
-        prof_data = struct.unpack("ddi", prof_data)
-        self.size = prof_data[2]
-        self.runtime_percent = prof_data[0]
-        self.runtime_sec = prof_data[1]
+        state = self.lookup_state(self.indented_pass_list, self.properties())
+        if state is None:
+            self.drain_requests()
+            state = self.coalesce(
+                (self.cache_context, *self.indented_pass_list),
+                lambda: self.store_state(
+                    self.indented_pass_list,
+                    self.properties(),
+                    *self.request(self.encode_pass_list(self.indented_pass_list)),
+                ),
+            )
+        (
+            self.size,
+            self.runtime_sec,
+            self.runtime_percent,
+            self.embedding,
+            self.runtime_variance,
+        ) = state
         logging.debug("Got all state")
 
+    def coalesce(self, key, evaluate):
+        """
+        Returns state `evaluate()` gets from the kernel. If another session of this process is already
+        waiting for the state of the same `key` (context and pass list), this session waits for it instead
+        of sending the same request (see backend.coalescing). States that failed or do not suit this session
+        (see `sampled_enough`) are evaluated again.
+        Pipelined requests (see `submit`) are not coalesced, as their responses may be collected much later
+        """
+        pending = self.coalescer.lead(key)
+        if pending is not None:
+            with self.timings.phase("wait"):
+                state = pending.wait()
+            if state is not None and self.sampled_enough(state[4]):
+                logging.debug("Got state requested by another session")
+                return state
+            return evaluate()
+
+        state = None
+        try:
+            state = evaluate()
+        finally:
+            self.coalescer.finish(key, state)
+        return state
+
+    def properties(self):
+        return self.orig_properties, self.custom_properties
+
+    def encode_pass_list(self, indented_pass_list):
+        if len(indented_pass_list) == 0:
+            return "?".encode("utf-8")  # Send '?' as pass list to get empty list stats
+        return ("\n".join(indented_pass_list) + "\n").encode("utf-8")
+
+    def lookup_state(self, indented_pass_list, properties):
+        """
+        States already reached by any session of this process are served from the prefix trie state cache.
+        Otherwise, if the session has a result cache, pass lists that were already evaluated for this function
+        are served from it without contacting the kernel.
+        Returns state tuple (size, runtime_sec, runtime_percent, embedding, runtime variance) or None.
+        With adaptive sampling, states measured with a single sample (no variance) are not used.
+        """
+        with self.timings.phase("cache"):
+            state = self.state_cache.get([self.cache_context, *indented_pass_list])
+            if state is not None and self.sampled_enough(state[4]):
+                logging.debug("Got state from state cache")
+                return state
+            if self.result_cache is not None:
+                cached = self.result_cache.get(indented_pass_list)
+                if cached is not None and self.sampled_enough(cached[1][3]):
+                    logging.debug("Got state from result cache")
+                    return self.store_state(
+                        indented_pass_list, properties, *cached, persist=False
+                    )
+        return None
+
+    def sampled_enough(self, variance):
+        """
+        Check if runtime measured with given variance (None or NaN for single samples) may be used by this session
+        """
+        return not self.adaptive_sampling or (
+            variance is not None and not math.isnan(variance)
+        )
+
+    def store_state(
+        self,
+        indented_pass_list,
+        properties,
+        embedding_msg,
+        prof_data,
+        persist=True,
+        cache=True,
+    ):
+        """
+        Make state tuple out of kernel response and put it into the caches (unless `cache` is False).
+        Embedding is kept raw until it is requested (see LazyEmbedding).
+        """
+        prof_data = self.runtime_data(prof_data)
+        state = (
+            prof_data[2],
+            prof_data[1],
+            prof_data[0],
+            LazyEmbedding(embedding_msg, properties),
+            prof_data[3],
+        )
+        if not cache:
+            return state
+        if persist and self.result_cache is not None:
+            self.result_cache.put(indented_pass_list, embedding_msg, prof_data)
+        self.state_cache.put(
+            [self.cache_context, *indented_pass_list],
+            state,
+            len(embedding_msg) + 256,
+        )
+        return state
+
     def attach_backend(self):
         """
         We use benchmark kernel working directory a kind of synchronization mechanism that lets environments
@@ -420,111 +1424,315 @@ class GccMultienvCompilationSession(CompilationSession):
 
 
         Environment attempts creating working directory for its benchmark kernel, and if creation fails - connects to already existing kernel.
-        If the directory was successfully created, this function uses BenchmarkUri to create startup (command line) option for the kernel, and
-        runs the benchmark kernel script.
-        """
-        kernel_dir = f"/tmp/{self.bench_name}:backend_{self.instance}"
+        If the directory was successfully created, the kernel is started with command line options made from BenchmarkUri.
+        Directories of dead kernels are removed and the kernel is started again.
 
-        try:
-            os.makedirs(kernel_dir)
+        Kernels are shared by sessions of all service processes and are restarted if they die.
+        Kernels left without sessions for 'kernel_idle_timeout' seconds (600 by default) are stopped
+        and their directories removed.
 
-            if "embedding_length" in self.parsed_bench.params:
-                embedding_length = (
-                    f"""-e {self.parsed_bench.params["embedding_length"][0]}"""
-                )
-            else:
-                embedding_length = ""
+        With 'size_only=1' the kernel is started without run strings, so it only compiles the benchmark
+        (such kernels are named '<bench_name>~size' and not shared with runtime-measuring sessions).
+
+        Benchmark files are copied to kernel directory, or with 'staging=hardlink' or 'staging=reflink'
+        linked to a staged copy shared by all instances ('staging_copy=<glob>' lists files
+        the build writes to, which are always copied).
+
+        With 'prewarm_kernels=N' in benchmark URI, kernels for the next N instances are started in background,
+        so that new environments for the same benchmark find their kernels already running.
 
-            if "build_string" in self.parsed_bench.params:
-                build_string = (
-                    f"""-b{" ".join(self.parsed_bench.params["build_string"])}"""
+        With 'record_trace=<path>' every request answered by the kernel is recorded with the raw response
+        into a trace file. With 'replay_trace=<path>' no kernel is started, and requests are answered
+        from the trace (see backend.trace).
+
+        With 'kernel_host=<host>:<port>' the kernel is started by the kernel host daemon on that host
+        (see backend.kernel_host), and datagrams are relayed over a pooled TCP connection.
+        The kernel host builds the kernel command line with its own kernel executable ('kernel_bin' is ignored),
+        picks the instance number, and restarts and reaps its kernels itself.
+        """
+        if "replay_trace" in self.parsed_bench.params:
+            self.soc = ReplaySocket(
+                TraceStore(
+                    self.parsed_bench.params["replay_trace"][0],
+                    self.trace_context,
+                    self.bench_name,
+                    self.fun_name,
                 )
-            else:
-                build_string = ""
+            )
+            return
 
-            build_string = build_string.replace("lstdc", "lstdc++")
+        self.staging = (
+            self.parsed_bench.params.get("staging", ["copy"])[0],
+            self.parsed_bench.params.get("staging_copy", []),
+        )
 
-            run_arr = []
-            if "run_string" in self.parsed_bench.params:
-                for rstr in self.parsed_bench.params["run_string"]:
-                    run_string = f"""-r{rstr}"""
-                    run_arr.append(run_string)
+        if self.kernel_host is not None:
+            self.soc = RemoteSocket(
+                self.remote_pool, self.kernel_host, self.kernel_host_key
+            )
+            self.instance = self.soc.attach(
+                self.kernel_name,
+                self.sock_fun_name,
+                self.parsed_bench.path,
+                self.staging,
+                self.kernel_params(),
+            )
 
-            if "bench_repeats" in self.parsed_bench.params:
-                bench_repeats = [
-                    f"--repeats",
-                    f"{self.parsed_bench.params['bench_repeats'][0]}",
-                ]
-            else:
-                bench_repeats = ""
+        if "record_trace" in self.parsed_bench.params:
+            self.soc = RecordingSocket(
+                self.soc,
+                TraceStore(
+                    self.parsed_bench.params["record_trace"][0],
+                    self.trace_context,
+                    self.bench_name,
+                    self.fun_name,
+                ),
+            )
 
-            if "plugin_path" in self.parsed_bench.params:
-                plugin_path = (
-                    f"""-p{"".join(self.parsed_bench.params["plugin_path"])}"""
+        if self.kernel_host is not None:
+            return
+
+        if "kernel_idle_timeout" in self.parsed_bench.params:
+            self.kernel_pool.idle_timeout = float(
+                self.parsed_bench.params["kernel_idle_timeout"][0]
+            )
+
+        # Start kernel if needed, wait for it to set up socket and connect to it
+        self.kernel_handle = self.kernel_pool.acquire(
+            self.soc,
+            self.kernel_name,
+            self.instance,
+            self.parsed_bench.path,
+            self.kernel_args(self.instance),
+            self.staging,
+        )
+
+        if "prewarm_kernels" in self.parsed_bench.params:
+            for instance in range(
+                self.instance + 1,
+                self.instance + 1 + int(self.parsed_bench.params["prewarm_kernels"][0]),
+            ):
+                self.kernel_pool.start(
+                    self.kernel_name,
+                    instance,
+                    self.parsed_bench.path,
+                    self.kernel_args(instance),
+                    self.staging,
                 )
-            else:
-                plugin_path = ""
 
-            name_string = f"-n{self.bench_name}"
-            instance_num = f"-i{self.instance}"
+    def send(self, msg):
+        """
+        Send request to the benchmark kernel. If the kernel is dead, it is restarted,
+        and requests that were not answered are sent to the new kernel again
+        (unless responses of the dead kernel are still to be received, see `wait_readable`).
 
-            # Copy benchmark files to kernel directory
-            copytree(self.parsed_bench.path, kernel_dir, dirs_exist_ok=True)
+        Measurement cores are leased after the request is sent, so the kernel builds the benchmark
+        on compile cores while the session waits for the lease, and runs it on the leased ones.
+        If the lease takes longer than the build, the run is not on dedicated cores. Reruns of built
+        binaries (see `request`) build nothing, so their cores are leased before sending them.
+        """
+        if msg.startswith(RERUN_PREFIX):
+            self.lease_cpus()
+        if self.shared_memory and self.kernel_features & KERNEL_SHM:
+            msg = SHM_PREFIX + msg
+        try:
+            with self.timings.phase("send"):
+                self.soc.send(msg)
+        except OSError as e:
+            if e.errno not in (errno.ECONNREFUSED, errno.ENOTCONN):
+                if not self.sent:
+                    self.release_cpus()
+                raise
+            # The new kernel gets the request with the other unanswered ones
+            self.sent.append(msg)
+            if not select.select([self.soc], [], [], 0)[0]:
+                self.restart_kernel()
+        except TraceMissError:
+            if not self.sent:
+                self.release_cpus()
+            raise
+        else:
+            self.sent.append(msg)
+        self.lease_cpus()
 
-            kernel_bin = os.path.join(
-                os.path.dirname(os.path.abspath(__file__)),
-                "../kernel/gcc-multienv-kernel",
+    def restart_kernel(self):
+        """
+        Start the kernel again and resend unanswered requests. If the kernel dies KERNEL_RESTART_LIMIT times
+        without answering (e.g. it crashes on the oldest request every time), unanswered requests are dropped
+        and RuntimeError is raised instead (the next request starts the kernel again)
+        """
+        if self.restarts >= self.KERNEL_RESTART_LIMIT:
+            failed = request_passes(self.sent[0]) if self.sent else None
+            self.sent.clear()
+            self.in_flight.clear()
+            self.restarts = 0
+            self.release_cpus()
+            raise RuntimeError(
+                f"Benchmark kernel {self.kernel_name}:backend_{self.instance} died "
+                f"{self.KERNEL_RESTART_LIMIT + 1} times on request {failed}"
             )
-            popen_args = [
-                kernel_bin,
-                embedding_length,
-                build_string,
-                *run_arr,
-                plugin_path,
-                name_string,
-                instance_num,
-                *bench_repeats,
-            ]
-
-            # Start kernel process
-            Popen(list(filter(None, popen_args)), cwd=kernel_dir)
-
-            # Wait for it to set up socket and connect to it
-            while True:
-                try:
-                    self.soc.connect(f"\0{self.bench_name}:backend_{self.instance}")
-                except ConnectionRefusedError:
-                    continue
-                return
+        self.restarts += 1
+        logging.warning(
+            "Benchmark kernel %s:backend_%d is dead, restarting it",
+            self.kernel_name,
+            self.instance,
+        )
+        self.kernel_pool.wait_exit(self.kernel_handle)
+        self.kernel_pool.release(self.kernel_handle)
+        self.kernel_handle = None
+        self.kernel_handle = self.kernel_pool.acquire(
+            self.soc,
+            self.kernel_name,
+            self.instance,
+            self.parsed_bench.path,
+            self.kernel_args(self.instance),
+            self.staging,
+        )
+        if self.cpu_lease is not None:
+            self.release_cpus()
+            self.lease_cpus()
+        for msg in self.sent:
+            self.soc.send(msg)
 
-        except FileExistsError:
-            while True:
-                try:
-                    self.soc.connect(f"\0{self.bench_name}:backend_{self.instance}")
-                except ConnectionRefusedError:
-                    continue
-                return
+    def lease_cpus(self):
+        """
+        Get dedicated measurement cores for the kernel, if the session has none, for requests that measure
+        runtime (waits while all of them are leased). The lease is held until all requests are answered,
+        and renewed while the session waits for them
+        """
+        if (
+            self.cpu_lease is not None
+            or self.cpu_scheduler is None
+            or self.size_only
+            or self.kernel_handle is None
+            or self.kernel_handle[0].pid is None
+        ):
+            return
+        kernel = self.kernel_handle[0]
+        with self.timings.phase("cpu_wait"):
+            self.cpu_scheduler.acquire(kernel.address, kernel.pid, self.cpu_holder)
+        self.cpu_lease = kernel.address
+        self.cpu_renewed = monotonic()
+
+    def renew_cpus(self):
+        """
+        Renew the lease of measurement cores (at most every third of the lease time),
+        and lease them again if it was lost
+        """
+        if (
+            self.cpu_lease is None
+            or monotonic() - self.cpu_renewed < self.cpu_scheduler.lease_sec / 3
+        ):
+            return
+        self.cpu_renewed = monotonic()
+        if not self.cpu_scheduler.renew(self.cpu_lease, self.cpu_holder):
+            logging.warning("Lease of measurement CPUs expired, leasing them again")
+            self.cpu_lease = None
+            self.lease_cpus()
+
+    def release_cpus(self):
+        if self.cpu_lease is not None:
+            self.cpu_scheduler.release(self.cpu_lease, self.cpu_holder)
+            self.cpu_lease = None
+
+    def __del__(self):
+        """
+        Let the kernel pool know this session no longer uses the kernel, and export timings of the last step
+        """
+        if getattr(self, "timings", None) is not None and self.metrics is not None:
+            self.timings.end_step(self.metrics)
+            self.metrics.flush()
+        if getattr(self, "cpu_lease", None) is not None:
+            self.release_cpus()
+        if getattr(self, "kernel_handle", None) is not None:
+            self.kernel_pool.release(self.kernel_handle)
+            self.kernel_handle = None
+        if getattr(self, "slot", None) is not None:
+            self.slot_table.release(
+                f"{self.kernel_name}:{self.sock_fun_name}", self.slot
+            )
+            self.slot = None
+        if (
+            getattr(self, "kernel_host", None) is not None
+            and getattr(self, "soc", None) is not None
+        ):
+            self.soc.close()  # Connection goes back to the pool
+
+    def kernel_params(self):
+        """
+        Benchmark kernel parameters from BenchmarkUri (see backend.kernel_command)
+        """
+        params = {}
+        if "embedding_length" in self.parsed_bench.params:
+            params["embedding_length"] = self.parsed_bench.params["embedding_length"][0]
+
+        if "build_string" in self.parsed_bench.params:
+            params["build_string"] = " ".join(
+                self.parsed_bench.params["build_string"]
+            ).replace("lstdc", "lstdc++")
+
+        # Kernel does not run the benchmark without run strings
+        if not self.size_only:
+            params["run_strings"] = self.parsed_bench.params.get("run_string", [])
+            if "bench_repeats" in self.parsed_bench.params:
+                params["repeats"] = self.parsed_bench.params["bench_repeats"][0]
+
+        if "plugin_path" in self.parsed_bench.params:
+            params["plugin_path"] = "".join(self.parsed_bench.params["plugin_path"])
+
+        return params
+
+    def kernel_args(self, instance):
+        """
+        Create benchmark kernel command line from BenchmarkUri.
+        'kernel_bin=<path>' replaces the kernel executable (e.g. with the stub kernel of benchmarks/)
+        """
+        kernel_bin = self.parsed_bench.params.get(
+            "kernel_bin",
+            [
+                os.path.join(
+                    os.path.dirname(os.path.abspath(__file__)),
+                    "../kernel/gcc-multienv-kernel",
+                )
+            ],
+        )[0]
+        return kernel_command(
+            kernel_bin, self.kernel_name, self.kernel_params(), instance
+        )
 
     def calc_embedding(self, embedding):
         """
         Calculate actual embedding vector from the control and value flow graphs
         that we got from the bench backend
         (bench backend just relays embedding that it gets from plugin).
+        `embedding` is an int32 memoryview over the raw kernel response.
 
         After embedding vector calculation we append (not in this function) current state properties
         (to give our compilation process the Markov property and also to prevent actor from choosing actions
         that will break the compiler)
         """
-        autophase = embedding[:47]
+        autophase = embedding[:47].tolist()
         cfg_len = embedding[47]
         cfg = embedding[48 : 48 + cfg_len]
         val_flow = embedding[48 + cfg_len :]
 
-        cfg_embedding = list(get_flow2vec_embed(cfg, 25))
-        val_flow_embedding = list(get_flow2vec_embed(val_flow, 25))
+        cfg_embedding = self.flow2vec(cfg, 25)
+        val_flow_embedding = self.flow2vec(val_flow, 25)
 
         return autophase + cfg_embedding + val_flow_embedding
 
+    def flow2vec(self, graph, dim):
+        """
+        flow2vec embedding of the raw graph data, memoized in `embedding_cache`
+        """
+        key = self.embedding_cache.key(graph, dim)
+        vector = self.embedding_cache.get(key)
+        if vector is None:
+            vector = self.embedding_cache.put(
+                key, get_flow2vec_embed(graph.tolist(), dim)
+            )
+        return list(vector)
+
 
 if __name__ == "__main__":
     create_and_run_compiler_gym_service(GccMultienvCompilationSession)
@@ -0,0 +1,112 @@
+"""
+Tests of the prefix trie state cache, the result cache and the embedding cache
+"""
+
+import sys
+
+import pytest
+
+from compiler_gym.envs.gcc_multienv.cache import (
+    EmbeddingCache,
+    PrefixTrieCache,
+    ResultCache,
+)
+
+
+def test_prefix_trie_evicts_least_recently_used_under_budget():
+    cache = PrefixTrieCache(budget=300)
+    cache.put([], "root", 100)
+    cache.put(["a"], "a", 100)
+    cache.put(["a", "b"], "ab", 100)
+    assert cache.get(["a"]) == "a"
+    assert cache.get(["a", "c"]) is None
+
+    # The least recently used value ('root') is evicted
+    cache.put(["c"], "c", 100)
+    assert cache.get([]) is None
+    assert [cache.get(path) for path in (["a"], ["a", "b"], ["c"])] == [
+        "a",
+        "ab",
+        "c",
+    ]
+    assert cache.stats() == (4, 2, 1, 300)
+
+    # Replacing a value updates the used bytes, values over budget are not stored
+    cache.put(["c"], "c2", 50)
+    assert cache.used == 250
+    cache.put(["d"], "d", 301)
+    assert cache.get(["d"]) is None and cache.used == 250
+
+
+def test_prefix_trie_prunes_evicted_leaves():
+    cache = PrefixTrieCache(budget=100)
+    cache.put(["a", "b", "c"], "abc", 100)
+    cache.put(["x"], "x", 100)
+    assert cache._root.children.keys() == {"x"}
+
+
+def test_result_cache_is_keyed_by_context(tmp_path):
+    path = tmp_path / "results.db"
+    cache = ResultCache(path, ("bench", "fun", "/benchmarks/bench", "fingerprint"))
+    other = ResultCache(path, ("bench", "fun", "/benchmarks/bench", "edited"))
+    cache.put(["pass1", ">pass2"], b"\1\2", (10.0, 0.5, 1000))
+    assert cache.get(["pass1", ">pass2"]) == (b"\1\2", (10.0, 0.5, 1000, None))
+    assert cache.get(["pass1"]) is None
+    assert other.get(["pass1", ">pass2"]) is None
+
+
+def test_result_cache_keeps_best_sampled_runtime(tmp_path):
+    cache = ResultCache(tmp_path / "results.db", ("bench", "fun"))
+    cache.put(["pass1"], b"", (10.0, 0.5, 1000))
+    cache.put(["pass1"], b"", (20.0, 0.6, 1000))
+    assert cache.get(["pass1"])[1] == (10.0, 0.5, 1000, None)
+
+    # Results measured with several samples replace single sample ones, but not each other
+    cache.put(["pass1"], b"", (30.0, 0.7, 1000, 0.01))
+    cache.put(["pass1"], b"", (40.0, 0.8, 1000, 0.02))
+    assert cache.get(["pass1"])[1] == (30.0, 0.7, 1000, 0.01)
+
+
+def test_embedding_cache_is_lru_and_spills(tmp_path):
+    cache = EmbeddingCache(capacity=2)
+    cache.spill_to(tmp_path / "embeddings.db")
+    keys = [cache.key(memoryview(bytes([i]) * 8).cast("i"), 4) for i in range(3)]
+    assert len(set(keys)) == 3
+    for i, key in enumerate(keys):
+        cache.put(key, [float(i)] * 4)
+    assert list(cache._vectors) == keys[1:]
+
+    # The evicted vector is read back from the file, by other caches too
+    assert cache.get(keys[0]) == (0.0,) * 4
+    other = EmbeddingCache(capacity=2)
+    other.spill_to(tmp_path / "embeddings.db")
+    assert other.get(keys[2]) == (2.0,) * 4
+    assert other.get(b"missing") is None
+    assert (other.hits, other.misses) == (1, 1)
+
+    cache.spill_to(tmp_path / "embeddings.db")
+    with pytest.raises(ValueError):
+        cache.spill_to(tmp_path / "other.db")
+
+
+def test_embedding_spill_keeps_recently_used_vectors(tmp_path, monkeypatch):
+    monkeypatch.setattr(EmbeddingCache, "TRIM_INTERVAL", 4)
+    cache = EmbeddingCache(capacity=1)
+    cache.spill_to(tmp_path / "embeddings.db", max_rows=3)
+    keys = [cache.key(memoryview(bytes([i]) * 8).cast("i"), 4) for i in range(8)]
+    for i, key in enumerate(keys[:3]):
+        cache.put(key, [float(i)] * 4)
+    # Reading the oldest vector back from the file keeps it there
+    assert cache.get(keys[0]) == (0.0,) * 4
+    cache.put(keys[3], [3.0] * 4)
+    assert cache.get(keys[1]) is None
+    assert cache.get(keys[0]) == (0.0,) * 4
+
+    for i, key in enumerate(keys[4:], 4):
+        cache.put(key, [float(i)] * 4)
+    rows = cache._db.execute("SELECT COUNT(*) FROM embeddings")[0][0]
+    assert rows == 3
+
+
+if __name__ == "__main__":
+    sys.exit(pytest.main([__file__]))
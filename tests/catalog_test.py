@@ -0,0 +1,88 @@
+"""
+Tests of the benchmark catalog index
+"""
+
+import os
+import shutil
+import sys
+
+import pytest
+
+from compiler_gym.envs.gcc_multienv.datasets import BenchmarkCatalog
+from compiler_gym.envs.gcc_multienv.datasets.catalog import parse_benchmark_info
+
+INFO = """build:
+gcc -O2 main.c
+run:
+./a.out 1
+run:
+./a.out 2
+functions:
+main
+helper
+"""
+
+
+def test_parse_benchmark_info():
+    assert parse_benchmark_info(INFO) == {
+        "build": "gcc -O2 main.c",
+        "embedding_length": None,
+        "bench_repeats": None,
+        "run": ["./a.out 1", "./a.out 2"],
+        "functions": ["main", "helper"],
+    }
+    assert parse_benchmark_info("")["functions"] is None
+
+
+def write_benchmark(directory, functions="main"):
+    directory.mkdir(parents=True, exist_ok=True)
+    (directory / "benchmark_info.txt").write_text(f"functions:\n{functions}\n")
+
+
+def scanned(catalog, root):
+    return {
+        str(path.parent.relative_to(root)): info["functions"]
+        for path, info in catalog.scan(root)
+    }
+
+
+def test_rescans_follow_changes(tmp_path):
+    root = tmp_path / "benchmarks"
+    write_benchmark(root / "a")
+    write_benchmark(root / "group" / "b")
+    (root / "group" / "empty").mkdir()
+    catalog = BenchmarkCatalog(tmp_path / "catalog.db")
+    assert scanned(catalog, root) == {"a": ["main"], "group/b": ["main"]}
+
+    # Edited benchmark info is parsed again (mtime changes), new and removed benchmarks are found
+    write_benchmark(root / "a", "main\nother")
+    info = root / "a" / "benchmark_info.txt"
+    os.utime(info, ns=(0, info.stat().st_mtime_ns + 1))
+    write_benchmark(root / "group" / "c")
+    shutil.rmtree(root / "group" / "b")
+    expected = {"a": ["main", "other"], "group/c": ["main"]}
+    assert scanned(catalog, root) == expected
+
+    # The index is served without touching benchmark files, also to other processes
+    shutil.rmtree(root)
+    other = BenchmarkCatalog(tmp_path / "catalog.db")
+    assert {
+        str(path.parent.relative_to(root)): info["functions"]
+        for path, info in other.indexed(root)
+    } == expected
+
+
+def test_indexes_of_roots_are_separate(tmp_path):
+    for name in ("root", "root2"):
+        write_benchmark(tmp_path / name / "a")
+    catalog = BenchmarkCatalog(tmp_path / "catalog.db")
+    list(catalog.scan(tmp_path / "root"))
+    list(catalog.scan(tmp_path / "root2"))
+    shutil.rmtree(tmp_path / "root2" / "a")
+    list(catalog.scan(tmp_path / "root2"))
+    assert len(catalog.indexed(tmp_path / "root")) == 1
+    assert catalog.indexed(tmp_path / "root2") == []
+
+
+if __name__ == "__main__":
+    sys.exit(pytest.main([__file__]))
@@ -0,0 +1,68 @@
+"""
+Tests of coalescing of identical requests of concurrent sessions
+"""
+
+import threading
+
+from compiler_gym.envs.gcc_multienv.backend import RequestCoalescer
+from compiler_gym.service.proto import Event
+
+from conftest import legal_walk, observe
+
+
+def test_followers_get_state_of_leader():
+    coalescer = RequestCoalescer()
+    assert coalescer.lead("key") is None
+    pending = [coalescer.lead("key") for _ in range(3)]
+    assert coalescer.coalesced == 3
+    assert coalescer.lead("other") is None
+
+    states = []
+    threads = [
+        threading.Thread(target=lambda p=p: states.append(p.wait())) for p in pending
+    ]
+    for thread in threads:
+        thread.start()
+    coalescer.finish("key", "state")
+    for thread in threads:
+        thread.join()
+    assert states == ["state"] * 3
+
+    # Finished keys are evaluated again by the next session
+    assert coalescer.lead("key") is None
+
+
+def test_followers_of_failed_request_get_none():
+    coalescer = RequestCoalescer()
+    coalescer.lead("key")
+    pending = coalescer.lead("key")
+    coalescer.finish("key", None)
+    assert pending.wait() is None
+
+
+def test_concurrent_sessions_share_kernel_requests(
+    make_session, uncached, session_class, monkeypatch
+):
+    monkeypatch.setenv("STUB_KERNEL_BUILD_SEC", "0.2")
+    monkeypatch.setattr(session_class, "coalescer", RequestCoalescer())
+    sessions = [make_session() for _ in range(2)]
+    walk = legal_walk(session_class, 3)
+    barrier = threading.Barrier(len(sessions))
+
+    def step(session):
+        barrier.wait()
+        session.apply_action(Event(string_value="\n".join(walk)))
+
+    threads = [threading.Thread(target=step, args=(s,)) for s in sessions]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert session_class.coalescer.coalesced >= 1
+    # Followers got the very state of the leader, runtime included
+    first, second = (
+        (s.size, s.runtime_sec, observe(s, "embedding").double_tensor.value)
+        for s in sessions
+    )
+    assert first == second
@@ -0,0 +1,108 @@
+"""
+Fixtures of gcc_multienv tests. Sessions are created in the test process and talk to the stub kernel
+of benchmarks/ (see benchmarks/stub_kernel.py), so they need neither GCC nor real benchmarks
+"""
+
+import importlib.util
+import os
+import random
+from pathlib import Path
+
+import pytest
+
+PACKAGE_DIR = Path(__file__).resolve().parent.parent
+STUB_KERNEL = PACKAGE_DIR / "benchmarks" / "stub_kernel.py"
+
+
+@pytest.fixture(scope="session")
+def session_class():
+    """
+    GccMultienvCompilationSession, loaded from the service directory (the shuffler library and constraint
+    lists are found relative to it, so tests run there)
+    """
+    pytest.importorskip("compiler_gym.envs.gcc_multienv.shuffler")
+    pytest.importorskip("compiler_gym.envs.gcc_multienv.embedding")
+    cwd = os.getcwd()
+    os.chdir(PACKAGE_DIR / "service")
+    spec = importlib.util.spec_from_file_location(
+        "gcc_multienv_service", PACKAGE_DIR / "service" / "gcc_multienv_service.py"
+    )
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    yield module.GccMultienvCompilationSession
+    os.chdir(cwd)
+
+
+@pytest.fixture
+def make_session(session_class, tmp_path, request):
+    """
+    Function that starts a session on a stub kernel benchmark of this test. `params` are extra benchmark URI
+    parameters ('name=value&' each). Stub kernel behaviour is set with STUB_KERNEL_* environment variables
+    (see stub_kernel.py) before the first session starts the kernel
+    """
+    from compiler_gym.datasets import Benchmark
+
+    bench_dir = tmp_path / "bench"
+    bench_dir.mkdir()
+    (bench_dir / "main.c").write_text("int main() { return 0; }\n")
+    bench_name = f"test-{os.getpid()}-{request.node.name}"[:40]
+    sessions = []
+
+    def make(params="run_string=./a.out&", fun_name="fun0"):
+        uri = (
+            f"multienv{bench_dir}/?{params}"
+            f"kernel_bin={STUB_KERNEL}&bench_name={bench_name}&fun_name={fun_name}"
+        )
+        session = session_class(
+            tmp_path,
+            session_class.action_spaces[0],
+            Benchmark.from_file_contents(uri, None),
+        )
+        sessions.append(session)
+        return session
+
+    yield make
+    for session in sessions:
+        session.__del__()
+
+
+@pytest.fixture
+def uncached(session_class, monkeypatch):
+    """
+    States are not taken from the state cache shared by sessions, so every step reaches the kernel
+    (or the trace)
+    """
+    from compiler_gym.envs.gcc_multienv.cache import PrefixTrieCache
+
+    monkeypatch.setattr(session_class, "state_cache", PrefixTrieCache(0))
+
+
+def legal_walk(session_class, length, seed=0):
+    """
+    Random valid pass sequence of `length` passes of list2, chosen with the action mask
+    """
+    rng = random.Random(seed)
+    node = session_class.pass_tree.root
+    passes = []
+    while len(passes) < length:
+        mask = session_class.action_mask(node.properties)
+        names = [
+            name
+            for name, flag in zip(session_class.action_list2, mask)
+            if flag and name != "none_pass"
+        ]
+        rng.shuffle(names)
+        for name in names:
+            child = session_class.pass_tree.advance(node, name)
+            if child.valid:
+                node = child
+                passes.append(name)
+                break
+        else:
+            raise AssertionError(f"No valid pass after {passes}")
+    return passes
+
+
+def observe(session, name):
+    space = next(space for space in session.observation_spaces if space.name == name)
+    return session.get_observation(space)
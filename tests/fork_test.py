@@ -0,0 +1,43 @@
+"""
+Tests of session fork against the stub kernel
+"""
+
+import sys
+
+import pytest
+from compiler_gym.service.proto import Event
+
+from conftest import legal_walk, observe
+
+
+def state(session):
+    """
+    Size and embedding of the session state (runtimes are measured with noise)
+    """
+    return session.size, list(observe(session, "embedding").double_tensor.value)
+
+
+def test_fork_continues_independently(make_session, uncached):
+    session = make_session()
+    walk = legal_walk(type(session), 2)
+    session.apply_action(Event(string_value=walk[0]))
+    forked = session.fork()
+    try:
+        assert forked.soc is not session.soc
+        assert (forked.runtime_sec, state(forked)) == (
+            session.runtime_sec,
+            state(session),
+        )
+        forked.apply_action(Event(string_value=walk[1]))
+        assert session.pass_list == walk[:1]
+        assert forked.pass_list == walk
+
+        fresh = make_session()
+        fresh.apply_action(Event(string_value="\n".join(walk)))
+        assert state(forked) == state(fresh)
+    finally:
+        forked.__del__()
+
+
+if __name__ == "__main__":
+    sys.exit(pytest.main([__file__]))
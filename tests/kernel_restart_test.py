@@ -0,0 +1,79 @@
+"""
+Tests of restarting benchmark kernels that die, with the stub kernel
+"""
+
+import os
+import socket
+import sys
+
+import pytest
+from compiler_gym.service.proto import Event
+
+from compiler_gym.envs.gcc_multienv.backend import KernelPool, kernel_command
+
+from conftest import STUB_KERNEL, legal_walk
+
+
+def stub_handle(pool, tmp_path, name):
+    bench_dir = tmp_path / "bench"
+    bench_dir.mkdir(exist_ok=True)
+    soc = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM, 0)
+    soc.bind(f"\0{name}:fun_0")
+    soc.settimeout(30)
+    handle = pool.acquire(
+        soc, name, 0, bench_dir, kernel_command(str(STUB_KERNEL), name, {}, 0)
+    )
+    return soc, handle
+
+
+def recv_response(soc):
+    while True:
+        response = soc.recv(1 << 20)
+        if response != b"":
+            return response
+
+
+def test_restart_waits_for_exiting_kernel(tmp_path, monkeypatch):
+    monkeypatch.setenv("STUB_KERNEL_CRASH_ON", "crash")
+    name = f"test-restart-{os.getpid()}"
+    pool = KernelPool()
+    soc, handle = stub_handle(pool, tmp_path, name)
+    soc.send(b"?")
+    assert recv_response(soc) != b""
+
+    soc.send(b"crash\n")
+    pool.wait_exit(handle)
+    assert not handle[0].alive()
+
+    # The kernel is started anew instead of reusing the exiting one
+    pool.release(handle)
+    handle = pool.acquire(
+        soc, name, 0, tmp_path / "bench", kernel_command(str(STUB_KERNEL), name, {}, 0)
+    )
+    soc.send(b"?")
+    assert recv_response(soc) != b""
+    pool.release(handle)
+    handle[0].process.terminate()
+    soc.close()
+
+
+def test_session_gives_up_on_request_that_kills_kernel(make_session, monkeypatch):
+    session = make_session()
+    walk = legal_walk(type(session), 2)
+    monkeypatch.setenv("STUB_KERNEL_CRASH_ON", walk[1])
+    os.kill(session.kernel_handle[0].pid, 9)  # Next kernel crashes on walk[1]
+    session.apply_action(Event(string_value=walk[0]))
+
+    with pytest.raises(RuntimeError, match=walk[1]):
+        session.apply_action(Event(string_value=walk[1]))
+    assert session.sent == type(session.sent)()
+
+    # Other requests start the kernel again
+    embedding_msg, prof_data = session.request(
+        session.encode_pass_list([walk[0], walk[0]])
+    )
+    assert prof_data[2] > 0
+
+
+if __name__ == "__main__":
+    sys.exit(pytest.main([__file__]))
@@ -0,0 +1,81 @@
+"""
+Tests of adaptive runtime measurement
+"""
+
+import math
+import random
+import statistics
+import sys
+
+import pytest
+
+from compiler_gym.envs.gcc_multienv.backend import KERNEL_RERUN, RuntimeEstimate
+
+from conftest import legal_walk
+
+
+def test_welford_mean_and_variance():
+    rng = random.Random(0)
+    samples = [rng.gauss(1.0, 0.1) for _ in range(50)]
+    estimate = RuntimeEstimate()
+    for i, sample in enumerate(samples):
+        estimate.add(sample, 100 * i)
+    assert estimate.n == 50
+    assert estimate.mean == pytest.approx(statistics.mean(samples))
+    assert estimate.variance == pytest.approx(statistics.variance(samples))
+    assert estimate.mean_percent == pytest.approx(100 * 49 / 2)
+    # Beyond the t table, the normal quantile is used
+    assert estimate.half_width() == pytest.approx(
+        1.96 * statistics.stdev(samples) / math.sqrt(50)
+    )
+
+
+def test_half_width_and_stop_rule():
+    estimate = RuntimeEstimate()
+    assert math.isnan(estimate.variance) and estimate.half_width() == math.inf
+    estimate.add(1.0, 0)
+    assert math.isnan(estimate.variance) and not estimate.converged(1.0)
+
+    # t quantile of one degree of freedom
+    estimate.add(1.2, 0)
+    assert estimate.half_width() == pytest.approx(12.706 * math.sqrt(0.02 / 2))
+    assert not estimate.converged(0.5)
+    assert estimate.converged(1.2)
+
+    # Identical samples converge as soon as there is a variance
+    stable = RuntimeEstimate()
+    stable.add(2.0, 0)
+    stable.add(2.0, 0)
+    assert stable.converged(0.0)
+
+
+def test_samples_rerun_the_built_binary(make_session, monkeypatch):
+    monkeypatch.setenv("STUB_KERNEL_BUILD_SEC", "0.05")
+    session = make_session(
+        "run_string=./a.out&runtime_tolerance=0.00001&runtime_max_samples=4&"
+    )
+    assert session.kernel_features & KERNEL_RERUN
+
+    session.timings.current = {}
+    walk = legal_walk(type(session), 1)
+    embedding_msg, prof_data = session.request(session.encode_pass_list(walk))
+    assert not math.isnan(prof_data[3])
+    # Only the first of the 4 samples builds the benchmark
+    assert session.timings.current["kernel_build"] == pytest.approx(0.05)
+
+
+def test_single_sample_sessions_do_not_sample_adaptively(make_session):
+    session = make_session(
+        "run_string=./a.out&runtime_tolerance=0.01&runtime_max_samples=1&"
+    )
+    assert not session.adaptive_sampling
+    walk = legal_walk(type(session), 1)
+    sent = []
+    send = session.send
+    session.send = lambda msg: sent.append(msg) or send(msg)
+    session.request(session.encode_pass_list(walk))
+    assert len(sent) == 1
+
+
+if __name__ == "__main__":
+    sys.exit(pytest.main([__file__]))
@@ -0,0 +1,140 @@
+"""
+Tests of incremental pass sequence validation and action masks
+"""
+
+import random
+import sys
+
+import pytest
+
+from compiler_gym.envs.gcc_multienv.validation import (
+    ActionMask,
+    PassTree,
+    parse_constraints,
+)
+
+
+@pytest.fixture
+def constraints(tmp_path):
+    path = tmp_path / "constraints.txt"
+    # Custom properties start as 0b011; 'provide' sets bit 2 of the custom properties and destroys
+    # bit 0 of the original ones, 'need_orig' requires it, 'need_both' requires bit 2 of the custom ones too
+    path.write_text(
+        "3\n"
+        "provide 1 4 0\n"
+        "need_both 4 0 0\n"
+        "\n"
+        "provide 0 0 1\n"
+        "need_orig 1 0 0\n"
+        "need_both 1 0 0\n"
+        "end_state 0\n"
+    )
+    return path
+
+
+def counting_check(calls):
+    """
+    Check that records the sequences it is called with: sequences with 'invalid' are not valid,
+    and properties are (length of the sequence, 0)
+    """
+
+    def check(passes):
+        calls.append(list(passes))
+        if "invalid" in passes:
+            return None
+        return len(passes), 0
+
+    return check
+
+
+def test_parse_constraints(constraints):
+    initial, sections = parse_constraints(constraints.read_text())
+    assert initial == 3
+    assert sections == [
+        {"provide": (1, 4, 0), "need_both": (4, 0, 0)},
+        {"provide": (0, 0, 1), "need_orig": (1, 0, 0), "need_both": (1, 0, 0)},
+    ]
+
+
+def test_mask_from_constraints(constraints):
+    names = ["provide", ">need_both", "need_orig", "unconstrained"]
+    mask = ActionMask(names, constraints)
+    assert mask((1, 3)) == [1, 0, 1, 1]
+    assert mask((0, 7)) == [1, 0, 0, 1]
+    assert mask((1, 7)) == [1, 1, 1, 1]
+    assert mask((1, 3)) is mask((1, 3))
+
+
+def test_prefixes_are_checked_once():
+    calls = []
+    tree = PassTree(counting_check(calls))
+    assert tree.root.properties == (0, 0) and calls == [[]]
+
+    first = tree.advance(tree.root, ">a")
+    second = tree.advance(first, "b")
+    assert second.valid and second.properties == (2, 0)
+    assert second.passes() == [">a", "b"]
+    assert tree.advance(tree.advance(tree.root, ">a"), "b") is second
+    assert calls == [[], [">a"], [">a", "b"]]
+
+    invalid = tree.advance(second, "invalid")
+    assert not invalid.valid and invalid.properties is None
+    # Nothing after an invalid prefix is valid, and the check is not called for it
+    assert not tree.advance(invalid, "c").valid
+    assert calls[-1] == [">a", "b", "invalid"]
+
+
+def test_mask_agrees_with_shuffler(session_class):
+    from compiler_gym.envs.gcc_multienv.shuffler import (
+        get_property_by_history,
+        valid_pass_seq,
+    )
+
+    tree, lib = session_class.pass_tree, session_class.actions_lib
+    # 'none_pass' is not a pass, sessions skip it
+    indices = [
+        i for i, name in enumerate(session_class.action_list2) if name != "none_pass"
+    ]
+    names = [session_class.action_list2[i] for i in indices]
+    rng = random.Random(0)
+    for _ in range(10):
+        node, history = tree.root, []
+        for _ in range(20):
+            mask = session_class.action_mask(node.properties)
+            valid = [valid_pass_seq(lib, history + [name], 2) == 0 for name in names]
+            assert [mask[i] for i in indices] == [int(flag) for flag in valid]
+            assert [tree.advance(node, name).valid for name in names] == valid
+            choices = [name for name, flag in zip(names, valid) if flag]
+            if choices == []:
+                break
+            name = rng.choice(choices)
+            node, history = tree.advance(node, name), history + [name]
+            assert node.properties == tuple(get_property_by_history(lib, history, 2))
+
+
+def test_tree_is_started_anew_beyond_byte_cap():
+    calls = []
+    tree = PassTree(counting_check(calls))
+    held = tree.root
+    for i in range(50):
+        held = tree.advance(held, f"pass{i}")
+    tree.max_bytes = tree.bytes
+    old = tree.advance(held, "last")
+    assert tree.generation == 1 and tree.bytes == 0
+    assert tree.root.children == {}
+
+    # Held nodes keep only their ancestors, and advancing from them continues in the new tree
+    tree.max_bytes = 1 << 20
+    node = old
+    while node is not None:
+        assert node.children == {}
+        node = node.parent
+    child = tree.advance(old, "other")
+    assert child.generation == tree.generation
+    assert child.passes() == [f"pass{i}" for i in range(50)] + ["last", "other"]
+    assert child.properties == (52, 0)
+    assert tree.advance(tree.advance(tree.root, "pass0"), "pass1") is not held.parent
+
+
+if __name__ == "__main__":
+    sys.exit(pytest.main([__file__]))
@@ -0,0 +1,79 @@
+"""
+Tests of pipelined submit/collect against the stub kernel
+"""
+
+import sys
+
+import pytest
+from compiler_gym.service.proto import Event
+
+from conftest import legal_walk, observe
+
+
+def submit(session, sequences):
+    action = "submit\n" + "\n\n".join("\n".join(passes) for passes in sequences)
+    session.apply_action(Event(string_value=action))
+    return list(observe(session, "request_ids").int64_tensor.value)
+
+
+@pytest.mark.parametrize("graph_len", [64, 6000])
+def test_submit_more_requests_than_socket_queues_hold(
+    make_session, monkeypatch, graph_len
+):
+    # 20 requests are more than the socket queue length (10 by default), and with graphs of 6000 ints
+    # their responses (48 KB each) are more than the kernel send buffer (about 208 KB by default)
+    monkeypatch.setenv("STUB_KERNEL_GRAPH_LEN", str(graph_len))
+    session = make_session()
+    walk = legal_walk(type(session), 20)
+    sequences = [walk[: i + 1] for i in range(20)]
+
+    request_ids = submit(session, sequences)
+    assert -1 not in request_ids
+    assert len(session.in_flight) <= session.DGRAM_QUEUE_LEN // 2
+    assert (
+        len(session.in_flight) <= 1
+        or len(session.in_flight) * session.response_bytes
+        <= session.DGRAM_QUEUE_BYTES // 2
+    )
+
+    session.apply_action(Event(string_value="wait"))
+    results = observe(session, "completed_results").event_list.event
+    assert sorted(int(result.double_tensor.value[0]) for result in results) == sorted(
+        request_ids
+    )
+    assert session.kernel_handle[0].alive()
+
+    # Results are the same as of sequences evaluated one by one
+    by_id = {int(result.double_tensor.value[0]): result for result in results}
+    for request_id, passes in zip(request_ids, sequences):
+        session.apply_action(Event(string_value="another_try"))
+        session.apply_action(Event(string_value="\n".join(passes)))
+        assert by_id[request_id].double_tensor.value[1] == session.size
+
+
+def test_collect_gathers_submitted_requests(make_session, uncached, monkeypatch):
+    monkeypatch.setenv("STUB_KERNEL_BUILD_SEC", "0.05")
+    session = make_session()
+    walk = legal_walk(type(session), 2)
+    assert submit(session, [walk[:1], walk, walk[:1]]) == [0, 1, 2]
+    assert session.pass_list == []
+
+    # Results are [request id, size, runtime_sec, runtime_percent, *embedding], runtimes are measured with noise
+    completed = {}
+    while len(completed) < 3:
+        session.apply_action(Event(string_value="collect"))
+        for result in observe(session, "completed_results").event_list.event:
+            value = list(result.double_tensor.value)
+            completed[int(value[0])] = [value[1], *value[4:]]
+    assert completed[0] == completed[2]
+    assert not session.in_flight and not session.sent
+
+    session.apply_action(Event(string_value="\n".join(walk)))
+    assert completed[1] == [
+        session.size,
+        *observe(session, "embedding").double_tensor.value,
+    ]
+
+
+if __name__ == "__main__":
+    sys.exit(pytest.main([__file__]))
@@ -0,0 +1,120 @@
+"""
+Tests of remote kernels served by a kernel host, with the stub kernel
+"""
+
+import os
+import select
+import socket
+import sys
+import threading
+
+import pytest
+
+from compiler_gym.envs.gcc_multienv.backend import (
+    RemoteConnectionPool,
+    RemoteSocket,
+    recv_frame,
+    send_frame,
+)
+from compiler_gym.envs.gcc_multienv.backend.kernel_host import KernelHostServer
+
+from conftest import STUB_KERNEL, legal_walk
+
+KEY = b"test key"
+
+
+@pytest.fixture
+def kernel_host(tmp_path):
+    server = KernelHostServer(("127.0.0.1", 0), KEY, STUB_KERNEL, [tmp_path])
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server.server_address
+    server.shutdown()
+    server.server_close()
+
+
+def recv_response(soc, buffer):
+    while True:
+        nbytes = soc.recv_into(buffer)
+        if nbytes != 0:
+            return nbytes
+
+
+def test_remote_kernel_round_trip(kernel_host, tmp_path):
+    bench_dir = tmp_path / "bench"
+    bench_dir.mkdir()
+    pool = RemoteConnectionPool()
+    soc = RemoteSocket(pool, kernel_host, KEY)
+    name = f"test-remote-{os.getpid()}"
+    assert soc.attach(name, "fun0", bench_dir, ("copy", []), {"run_strings": []}) == 0
+    soc.send(b"?")
+    assert recv_response(soc, bytearray(1 << 16)) > 0
+    connection = soc._soc
+    soc.close()
+
+    # The connection is reused by the next session
+    soc = RemoteSocket(pool, kernel_host, KEY)
+    soc.attach(name, "fun1", bench_dir, ("copy", []), {"run_strings": []})
+    assert soc._soc is connection
+    soc.close()
+
+
+def test_pool_drops_connections_closed_by_host():
+    server = socket.create_server(("127.0.0.1", 0))
+    accepted = []
+
+    def serve():
+        for _ in range(2):
+            connection, _ = server.accept()
+            send_frame(connection, b"C", os.urandom(32))
+            recv_frame(connection)
+            accepted.append(connection)
+
+    thread = threading.Thread(target=serve, daemon=True)
+    thread.start()
+    address = server.getsockname()
+    pool = RemoteConnectionPool()
+    first = pool.get(address, KEY)
+    pool.put(address, KEY, first)
+    assert pool.get(address, KEY) is first
+    pool.put(address, KEY, first)
+
+    # Host restarted: the pooled connection is closed
+    while len(accepted) < 1:
+        select.select([], [], [], 0.01)
+    accepted[0].close()
+    select.select([first], [], [], 5)
+    second = pool.get(address, KEY)
+    assert second is not first and first.fileno() == -1
+    thread.join(5)
+    for connection in [second, *accepted]:
+        connection.close()
+    server.close()
+
+
+def test_remote_session_takes_no_slot(
+    session_class, make_session, kernel_host, tmp_path, monkeypatch
+):
+    allocated = []
+    allocate = session_class.slot_table.allocate
+    monkeypatch.setattr(
+        session_class.slot_table,
+        "allocate",
+        lambda key, skip=(): allocated.append(key) or allocate(key, skip),
+    )
+    key = tmp_path / "key"
+    key.write_bytes(KEY)
+    params = f"run_string=./a.out&kernel_host={kernel_host[0]}:{kernel_host[1]}&kernel_host_key={key}&"
+    session = make_session(params)
+    assert session.slot is None and allocated == []
+
+    # The kernel host of this process binds its own socket names, so the slot of a local session may be any
+    local = make_session()
+    assert local.slot is not None and allocated != []
+
+    walk = legal_walk(type(session), 1)
+    assert session.request(session.encode_pass_list(walk))[1][2] > 0
+
+
+if __name__ == "__main__":
+    sys.exit(pytest.main([__file__]))
@@ -0,0 +1,102 @@
+"""
+Tests of benchmark sharding and weighted sampling
+"""
+
+import random
+import sys
+from collections import Counter
+
+import pytest
+
+from compiler_gym.envs.gcc_multienv.datasets import (
+    AliasTable,
+    BenchmarkSampler,
+    MultienvDataset,
+)
+
+
+def uris(benchmarks, functions=1):
+    return [
+        f"multienv/benchmarks/b{i}/?bench_name=b{i}&fun_name=f{j}"
+        for i in range(benchmarks)
+        for j in range(functions)
+    ]
+
+
+def test_alias_table_distribution():
+    weights = [1, 2, 3, 0, 4]
+    table = AliasTable(weights)
+    rng = random.Random(0)
+    counts = Counter(table.sample(rng) for _ in range(100000))
+    assert counts[3] == 0
+    for i, weight in enumerate(weights):
+        assert counts[i] / 100000 == pytest.approx(weight / sum(weights), abs=0.01)
+
+
+def test_alias_table_rejects_invalid_weights():
+    for weights in ([], [0, 0], [1, -1]):
+        with pytest.raises(ValueError):
+            AliasTable(weights)
+
+
+def test_shards_partition_benchmarks():
+    all_uris = uris(5, functions=3)
+    shards = [
+        BenchmarkSampler(list(reversed(all_uris)), rank, 3).uris for rank in range(3)
+    ]
+    assert sorted(uri for shard in shards for uri in shard) == sorted(all_uris)
+    # Functions of a benchmark stay in one shard, and shards are balanced
+    assert sorted(len(shard) for shard in shards) == [3, 6, 6]
+    for shard in shards:
+        assert len({uri.split("?")[0] for uri in shard}) * 3 == len(shard)
+
+
+def test_shard_of_every_worker_is_non_empty():
+    assert [BenchmarkSampler(uris(2), rank, 2).uris for rank in range(2)] == [
+        uris(2)[:1],
+        uris(2)[1:],
+    ]
+
+
+def test_workers_without_own_shard_sample_all_benchmarks():
+    assert BenchmarkSampler(uris(1), 1, 2).uris == uris(1)
+    with pytest.raises(LookupError):
+        BenchmarkSampler([], 0, 1)
+
+
+def test_weighted_sampling():
+    all_uris = uris(2)
+    sampler = BenchmarkSampler(all_uris, weights={all_uris[0]: 3.0}, seed=0)
+    counts = Counter(sampler.sample() for _ in range(20000))
+    assert counts[all_uris[0]] / 20000 == pytest.approx(0.75, abs=0.02)
+
+
+def test_seeds():
+    all_uris = uris(10)
+    first = BenchmarkSampler(all_uris, seed=1)
+    second = BenchmarkSampler(all_uris, seed=1)
+    assert [first.sample() for _ in range(20)] == [second.sample() for _ in range(20)]
+    first.seed(2)
+    second.seed(2)
+    assert [first.sample() for _ in range(20)] == [second.sample() for _ in range(20)]
+    samples = [first.sample(random.Random(3)) for _ in range(2)]
+    assert samples[0] == samples[1]
+
+
+def test_dataset_sampler(tmp_path):
+    for name in ("a", "b"):
+        (tmp_path / name).mkdir()
+        (tmp_path / name / "benchmark_info.txt").write_text("functions:\nmain\n")
+    dataset = MultienvDataset()
+    dataset.path = [tmp_path]
+    shards = [dataset.sampler(rank, 2) for rank in range(2)]
+    assert [len(shard) for shard in shards] == [1, 1]
+
+    dataset.sampler(seed=0)
+    first = [str(dataset.random_benchmark(random_state=5).uri) for _ in range(10)]
+    second = [str(dataset.random_benchmark(random_state=5).uri) for _ in range(10)]
+    assert first == second
+
+
+if __name__ == "__main__":
+    sys.exit(pytest.main([__file__]))
@@ -0,0 +1,92 @@
+"""
+Tests of session slot allocation and measurement core leases
+"""
+
+import os
+import subprocess
+import sys
+from time import monotonic, sleep
+
+import pytest
+
+from compiler_gym.envs.gcc_multienv.backend import (
+    CpuScheduler,
+    SlotTable,
+    parse_cpu_list,
+)
+
+
+def test_parse_cpu_list():
+    assert parse_cpu_list("0-3,8, 10-11,") == [0, 1, 2, 3, 8, 10, 11]
+
+
+def test_slots_are_lowest_free(tmp_path):
+    table = SlotTable(tmp_path)
+    assert [table.allocate("bench:fun") for _ in range(3)] == [0, 1, 2]
+    table.release("bench:fun", 1)
+    assert table.allocate("bench:fun") == 1
+    assert table.allocate("bench:fun", skip=[3]) == 4
+    assert table.allocate("bench:other") == 0
+
+
+def test_slots_of_exited_processes_are_reused(tmp_path):
+    table = SlotTable(tmp_path)
+    child = subprocess.Popen(
+        [
+            sys.executable,
+            "-c",
+            "import sys; from compiler_gym.envs.gcc_multienv.backend import SlotTable; "
+            "print(SlotTable(sys.argv[1]).allocate('bench:fun'))",
+            str(tmp_path),
+        ],
+        stdout=subprocess.PIPE,
+    )
+    assert child.communicate()[0].strip() == b"0"
+    assert table.allocate("bench:fun") == 0
+
+
+@pytest.fixture
+def kernel():
+    process = subprocess.Popen(["sleep", "60"])
+    yield process.pid
+    process.kill()
+    process.wait()
+
+
+@pytest.fixture
+def scheduler(tmp_path):
+    cpus = sorted(os.sched_getaffinity(0))
+    return CpuScheduler([cpus[-1]], lease_sec=0.2, wait_sec=2, directory=tmp_path)
+
+
+def test_kernel_is_pinned_while_leased(scheduler, kernel):
+    scheduler.acquire("kernel", kernel, "1:0")
+    assert os.sched_getaffinity(kernel) == scheduler.groups[0]
+    scheduler.acquire("kernel", kernel, "1:1")
+    scheduler.release("kernel", "1:0")
+    assert os.sched_getaffinity(kernel) == scheduler.groups[0]
+    scheduler.release("kernel", "1:1")
+    assert os.sched_getaffinity(kernel) == scheduler.compile_cpus
+
+
+def test_leases_of_sessions_that_stop_renewing_expire(scheduler, kernel):
+    holder = f"{os.getpid()}:0"
+    scheduler.acquire("first", kernel, holder)
+    start = monotonic()
+    while monotonic() - start < 0.4:
+        assert scheduler.renew("first", holder)
+        sleep(0.05)
+
+    # A session of the same process that never collects its responses loses the lease
+    started = monotonic()
+    scheduler.acquire("second", kernel, f"{os.getpid()}:1")
+    assert 0.1 < monotonic() - started < 1
+    assert not scheduler.renew("first", holder)
+
+    scheduler.wait_sec = 0.1
+    with pytest.raises(TimeoutError):
+        scheduler.acquire("third", kernel, f"{os.getpid()}:2")
+
+
+if __name__ == "__main__":
+    sys.exit(pytest.main([__file__]))
@@ -0,0 +1,70 @@
+"""
+Tests of the shared memory transport of kernel responses
+"""
+
+import socket
+import struct
+import sys
+
+import pytest
+from compiler_gym.service.proto import Event
+
+from compiler_gym.envs.gcc_multienv.backend import (
+    KERNEL_SHM,
+    recv_shared,
+    send_shared,
+)
+
+from conftest import legal_walk
+
+
+def test_payload_is_mapped_from_memfd():
+    kernel, session = socket.socketpair(socket.AF_UNIX, socket.SOCK_DGRAM)
+    buffer = bytearray(64)
+    payload = bytes(range(256)) * 1024
+    send_shared(kernel, payload)
+    length, mapping = recv_shared(session, buffer)
+    assert length == len(payload) and mapping[:length] == payload
+    mapping.close()
+
+    # Small responses may still come inline
+    kernel.send(b"inline")
+    assert recv_shared(session, buffer) == (6, None)
+    assert buffer[:6] == b"inline"
+    kernel.close()
+    session.close()
+
+
+def test_shared_memory_session_maps_responses(make_session):
+    # The first response comes in a datagram, and tells the session that the kernel implements the transport
+    session = make_session("run_string=./a.out&transport=shm&")
+    assert session.kernel_features & KERNEL_SHM
+    walk = legal_walk(type(session), 1)
+    session.apply_action(Event(string_value=walk[0]))
+    assert session.mapping is not None
+    emb_len = struct.unpack_from("i", session.response_view)[0]
+    assert (
+        session.size == struct.unpack_from("ddi", session.response_view, emb_len + 4)[2]
+    )
+
+
+def test_shared_memory_falls_back_to_datagrams(make_session, monkeypatch):
+    # Like the GCC kernel, the kernel does not advertise KERNEL_SHM
+    monkeypatch.setenv("STUB_KERNEL_FEATURES", "0")
+    session = make_session("run_string=./a.out&transport=shm&")
+    assert session.shared_memory and session.kernel_features == 0
+    walk = legal_walk(type(session), 1)
+    session.apply_action(Event(string_value=walk[0]))
+    assert session.mapping is None
+
+
+@pytest.mark.filterwarnings("error::pytest.PytestUnraisableExceptionWarning")
+def test_shared_memory_needs_a_local_kernel(make_session, tmp_path):
+    key = tmp_path / "key"
+    key.write_text("secret\n")
+    with pytest.raises(ValueError, match="kernel_host"):
+        make_session(f"transport=shm&kernel_host=localhost:1&kernel_host_key={key}&")
+
+
+if __name__ == "__main__":
+    sys.exit(pytest.main([__file__]))
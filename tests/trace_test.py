@@ -0,0 +1,72 @@
+"""
+Tests of record and replay of kernel traces, with the stub kernel
+"""
+
+import sys
+
+import pytest
+from compiler_gym.service.proto import Event
+
+from compiler_gym.envs.gcc_multienv.backend import TraceMissError
+
+from conftest import legal_walk, observe
+
+
+def state(session):
+    return (
+        session.size,
+        session.runtime_sec,
+        session.runtime_percent,
+        list(observe(session, "embedding").double_tensor.value),
+    )
+
+
+@pytest.mark.parametrize("replay_miss", ["error", "end"])
+def test_trace_miss_keeps_session_state(make_session, tmp_path, replay_miss):
+    trace = tmp_path / "trace.db"
+    recording = make_session(f"run_string=./a.out&record_trace={trace}&")
+    walk = legal_walk(type(recording), 2)
+    recording.apply_action(Event(string_value=walk[0]))
+    expected = (recording.size, recording.runtime_sec)
+
+    session = make_session(
+        f"run_string=./a.out&replay_trace={trace}&replay_miss={replay_miss}&"
+    )
+    session.apply_action(Event(string_value=walk[0]))
+    assert (session.size, session.runtime_sec) == expected
+    node = session.pass_node
+
+    if replay_miss == "end":
+        assert session.apply_action(Event(string_value=walk[1]))[2]
+    else:
+        with pytest.raises(TraceMissError):
+            session.apply_action(Event(string_value=walk[1]))
+    assert session.pass_list == walk[:1]
+    assert session.pass_node is node
+    assert len(session.sent) == 0
+
+    # The session goes on from the last replayed state
+    session.apply_action(Event(string_value="another_try"))
+    session.apply_action(Event(string_value=walk[0]))
+    assert (session.size, session.runtime_sec) == expected
+
+
+def test_replay_answers_like_the_kernel(make_session, uncached, tmp_path):
+    trace = tmp_path / "trace.db"
+    recording = make_session(f"run_string=./a.out&record_trace={trace}&")
+    walk = legal_walk(type(recording), 3)
+    recorded = []
+    for action in walk:
+        recording.apply_action(Event(string_value=action))
+        recorded.append(state(recording))
+
+    replay = make_session(f"run_string=./a.out&replay_trace={trace}&")
+    assert replay.kernel_handle is None
+    for action, expected in zip(walk, recorded):
+        replay.apply_action(Event(string_value=action))
+        assert state(replay) == expected
+    assert replay.soc.misses == 0
+
+
+if __name__ == "__main__":
+    sys.exit(pytest.main([__file__]))
@@ -0,0 +1,17 @@
+from compiler_gym.envs.gcc_multienv.validation.action_mask import (
+    ActionMask,
+    parse_constraints,
+)
+from compiler_gym.envs.gcc_multienv.validation.pass_tree import (
+    PassNode,
+    PassTree,
+    shuffler_check,
+)
+
+__all__ = [
+    "ActionMask",
+    "PassNode",
+    "PassTree",
+    "parse_constraints",
+    "shuffler_check",
+]
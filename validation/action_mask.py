@@ -0,0 +1,85 @@
+"""
+Masks of legal actions computed from pass constraint lists (lists/constraints<N>.txt).
+
+Constraint file starts with the initial value of custom properties, followed by sections of
+'<pass name> <required> <provided> <destroyed>' lines separated by empty lines. The first section
+constrains custom properties, the second one original properties. A section may end with
+an 'end_state <properties>' line, which only matters for complete sequences.
+"""
+
+import threading
+from pathlib import Path
+
+
+def parse_constraints(text):
+    """
+    Returns (initial properties, sections), where every section is a dict
+    mapping pass name to (required, provided, destroyed) property bits
+    """
+    lines = text.split("\n")
+    initial = int(lines[0]) if lines and lines[0].strip() != "" else 0
+    sections = [{}]
+    for line in lines[1:]:
+        fields = line.split()
+        if fields == []:
+            if sections[-1] != {}:
+                sections.append({})
+            continue
+        if fields[0] == "end_state" or len(fields) < 4:
+            continue
+        name = " ".join(fields[:-3])
+        sections[-1][name] = tuple(int(x) for x in fields[-3:])
+    if sections[-1] == {}:
+        sections.pop()
+    return initial, sections
+
+
+class ActionMask:
+    """
+    Legality of all actions of a pass list for given properties. A pass is legal if all properties it
+    requires are set; passes without constraints are always legal.
+
+    Actions are grouped by their required bits, so a mask is computed with one check per distinct
+    requirement rather than one validator call per pass. Masks are memoized by properties, of which
+    there are few. Constraints are read on first use from `path`.
+    Masks are hints for agents: passes are still validated by the shuffler when they are applied (see PassTree)
+    """
+
+    def __init__(self, names, path):
+        self.names = list(names)
+        self.path = Path(path)
+        self._groups = None
+        self._masks = {}
+        self._lock = threading.Lock()
+
+    def _load(self):
+        _, sections = parse_constraints(self.path.read_text())
+        groups = {}
+        for i, name in enumerate(self.names):
+            name = name[1:] if name.startswith(">") else name
+            required = tuple(
+                section[name][0] if name in section else 0 for section in sections
+            )
+            if any(required):
+                groups.setdefault(required, []).append(i)
+        self._groups = list(groups.items())
+
+    def __call__(self, properties):
+        """
+        Returns list of 0/1 flags over `names` for (original, custom) `properties`
+        """
+        mask = self._masks.get(properties)
+        if mask is not None:
+            return mask
+        with self._lock:
+            if self._groups is None:
+                self._load()
+        orig_properties, custom_properties = properties
+        state = (custom_properties, orig_properties)
+        mask = [1] * len(self.names)
+        for required, indices in self._groups:
+            if any(bits & ~value for bits, value in zip(required, state)):
+                for i in indices:
+                    mask[i] = 0
+        self._masks[properties] = mask
+        return mask
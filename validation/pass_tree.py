@@ -0,0 +1,149 @@
+"""
+Incremental pass sequence validation.
+Shuffler checks take the whole pass history, so their results are memoized in a tree of
+pass sequence prefixes shared by all sessions, and sessions advance through the tree one pass at a time
+"""
+
+import sys
+import threading
+
+
+class PassNode:
+    """
+    Validated pass sequence prefix. `properties` is the (original, custom) properties pair
+    after the prefix (None for invalid prefixes). Nodes do not change once created (only their
+    children do), so a node is a snapshot of validator state, and rolling back is returning to an older node.
+    `generation` is the generation of the tree the node was created in (see `PassTree.advance`).
+    """
+
+    __slots__ = (
+        "parent",
+        "pass_name",
+        "length",
+        "valid",
+        "properties",
+        "children",
+        "generation",
+    )
+
+    def __init__(self, parent, pass_name, valid, properties, generation=0):
+        self.parent = parent
+        self.pass_name = pass_name
+        self.length = 0 if parent is None else parent.length + 1
+        self.valid = valid
+        self.properties = properties
+        self.children = {}
+        self.generation = generation
+
+    def passes(self):
+        passes = []
+        node = self
+        while node.parent is not None:
+            passes.append(node.pass_name)
+            node = node.parent
+        passes.reverse()
+        return passes
+
+
+def _node_bytes():
+    """
+    Approximate memory taken by a node without its pass name: the node, its children dict,
+    properties tuple and the entry in its parent's children dict
+    """
+    node = PassNode(None, None, True, (1 << 30, 1 << 30))
+    return (
+        sys.getsizeof(node)
+        + sys.getsizeof(node.children)
+        + sys.getsizeof(node.properties)
+        + 2 * sys.getsizeof(1 << 30)
+        + 3 * 8
+    )
+
+
+NODE_BYTES = _node_bytes()
+
+
+def shuffler_check(actions_lib, list_num):
+    """
+    Check of pass sequences of list `list_num` by the shuffler library (see PassTree)
+    """
+    from compiler_gym.envs.gcc_multienv.shuffler import (
+        get_property_by_history,
+        valid_pass_seq,
+    )
+
+    def check(passes):
+        if valid_pass_seq(actions_lib, passes, list_num) != 0:
+            return None
+        return tuple(get_property_by_history(actions_lib, passes, list_num))
+
+    return check
+
+
+class PassTree:
+    """
+    Tree of validated prefixes for one pass list, shared by all sessions of the process.
+    `check(passes)` returns the (original, custom) properties after a pass sequence, or None if the sequence
+    is not valid (see `shuffler_check`). Every prefix is checked only once, when a session first reaches it.
+
+    When nodes take more than `max_bytes`, the tree is started anew. Children of the old nodes are dropped,
+    so nodes still held by sessions keep only their ancestors alive, and advancing from them continues
+    in the new tree.
+    """
+
+    def __init__(self, check, max_bytes=256 << 20):
+        self.check = check
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self.generation = 0
+        self._lock = threading.Lock()
+        self.root = PassNode(None, None, True, check([]))
+
+    def advance(self, node, pass_name):
+        """
+        Returns node for `node` prefix followed by `pass_name` (check its `valid` field)
+        """
+        child = node.children.get(pass_name)
+        if child is not None:
+            return child
+
+        if node.generation != self.generation:
+            # Node of a tree that was started anew: the same prefix is found in the current tree
+            passes = node.passes() + [pass_name]
+            node = self.root
+            for name in passes:
+                node = self.advance(node, name)
+            return node
+
+        properties = None
+        if node.valid:
+            properties = self.check(node.passes() + [pass_name])
+        child = PassNode(
+            node, pass_name, properties is not None, properties, node.generation
+        )
+
+        with self._lock:
+            if node.generation != self.generation:
+                return child
+            existing = node.children.setdefault(pass_name, child)
+            if existing is child:
+                self.bytes += NODE_BYTES + sys.getsizeof(pass_name)
+                if self.bytes > self.max_bytes:
+                    self._reset()
+            return existing
+
+    def _reset(self):
+        """
+        Start the tree anew, dropping children of all nodes of the old one
+        """
+        old_root = self.root
+        self.generation += 1
+        self.root = PassNode(
+            None, None, True, old_root.properties, generation=self.generation
+        )
+        self.bytes = 0
+        stack = [old_root]
+        while stack:
+            node = stack.pop()
+            stack.extend(node.children.values())
+            node.children = {}